@@ -0,0 +1,42 @@
+# Command line entry point for the benchmarks - run with `python -m benchmarks`
+# from the repository root
+
+import argparse
+from pathlib import Path
+import sys
+
+from .results import addResultsArguments, finishResults, resultsDocument
+from .suite import benchmarks, runBenchmarks
+from .synthetic import addSpecArguments, specFromArguments, syntheticFiles
+
+from typing import Any, Dict
+
+def printResult(name : str, result : Dict[str, Any]) -> None:
+    throughput = result['itemsPerSecond']
+    peak = result['peakRssMiB']
+    print(f'{name:30} {result["medianMs"]:10.1f} ms'
+            + (f' {throughput:12.0f} items/s' if throughput is not None else '')
+            + (f' {peak:8.0f} MiB peak' if peak is not None else ''))
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='benchmarks', description='Benchmark RSI-editor against a synthetic RSI')
+    addSpecArguments(parser, 200)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of each benchmark (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs before timing each benchmark (default: 1)')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks.keys()), help='benchmarks to run (default: all)')
+    addResultsArguments(parser)
+    args = parser.parse_args()
+
+    spec = specFromArguments(args)
+    if spec is None:
+        return 2
+
+    (rsiPath, dmiPath) = syntheticFiles(Path(args.data), spec)
+
+    names = args.only if args.only is not None else list(benchmarks.keys())
+    results = runBenchmarks(names, spec, rsiPath, dmiPath, args.repeat, args.warmup, printResult)
+
+    return finishResults(args, resultsDocument(spec, results, repeat=args.repeat))
+
+if __name__ == '__main__':
+    sys.exit(main())
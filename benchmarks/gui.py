@@ -0,0 +1,265 @@
+# Performance of the editor's views, measured by driving the editor window -
+# run with `python -m benchmarks.gui` from the repository root
+
+# The editor is run on Qt's offscreen platform, so this works on a headless
+# machine. It's given empty config, data and cache folders (through the XDG
+# variables, so this is for Linux), so there's nothing to recover and every
+# cache starts cold, and a fixed window size so the views always show the same
+# number of items.
+#
+# Each phase drives the editor the way a user would - scrolling the state list,
+# opening states, changing the number of directions, or just watching the
+# animations play - and records how long each step took (including repainting
+# the view straight away), how long each paint of the state list and state
+# contents views took, and how many times the models' data() was called.
+
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+
+import PySide2.QtCore as QtC
+import PySide2.QtWidgets as QtW
+
+from .results import addResultsArguments, finishResults, resultsDocument
+from .synthetic import addSpecArguments, specFromArguments, syntheticFiles
+
+from typing import Any, Callable, Dict, List, Optional
+
+windowSize = QtC.QSize(1280, 800)
+
+# Roles worth telling apart in the call counts - any others are counted by number
+roleNames = { int(getattr(QtC.Qt, name)): name for name in
+        ['DisplayRole', 'DecorationRole', 'EditRole', 'ToolTipRole', 'StatusTipRole', 'WhatsThisRole',
+        'SizeHintRole', 'FontRole', 'TextAlignmentRole', 'BackgroundRole', 'ForegroundRole', 'CheckStateRole'] }
+
+def percentile(values : List[float], fraction : float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def timingSummary(prefix : str, times : List[float]) -> Dict[str, Any]:
+    if len(times) == 0:
+        return { f'{prefix}Count': 0 }
+
+    return {
+        f'{prefix}Count': len(times),
+        f'{prefix}MedianMs': statistics.median(times),
+        f'{prefix}MeanMs': statistics.mean(times),
+        f'{prefix}P95Ms': percentile(times, 0.95),
+        f'{prefix}MaxMs': max(times),
+    }
+
+# Wraps data() and paintEvent() of some classes to count and time them, while
+# a phase is being recorded
+class ViewInstruments():
+    def __init__(self, models : List[Any], views : List[Any]):
+        self.dataCalls : Dict[str, int] = {}
+        self.paintTimes : List[float] = []
+        self.recording = False
+
+        for model in models:
+            self.countData(model)
+        for view in views:
+            self.timePaints(view)
+
+    # `model` and `view` are classes, whose methods are replaced
+    def countData(self, model : Any) -> None:
+        originalData = model.data
+
+        def data(modelSelf : Any, index : QtC.QModelIndex, role : int = QtC.Qt.DisplayRole) -> object:
+            if self.recording:
+                key = f'{model.__name__}.{roleNames.get(int(role), str(int(role)))}'
+                self.dataCalls[key] = self.dataCalls.get(key, 0) + 1
+            return originalData(modelSelf, index, role)
+
+        model.data = data
+
+    def timePaints(self, view : Any) -> None:
+        originalPaintEvent = view.paintEvent
+
+        def paintEvent(viewSelf : Any, event : Any) -> None:
+            start = time.perf_counter()
+            originalPaintEvent(viewSelf, event)
+            if self.recording:
+                self.paintTimes.append((time.perf_counter() - start) * 1000)
+
+        view.paintEvent = paintEvent
+
+    def start(self) -> None:
+        self.dataCalls = {}
+        self.paintTimes = []
+        self.recording = True
+
+    def stop(self) -> Dict[str, Any]:
+        self.recording = False
+        return {
+            'dataCalls': sum(self.dataCalls.values()),
+            'dataCallsByRole': dict(sorted(self.dataCalls.items())),
+            **timingSummary('paint', self.paintTimes),
+        }
+
+class GuiHarness():
+    def __init__(self, app : QtW.QApplication, rsiPath : Path):
+        # Imported here, as the editor reads its config when the window is made
+        from rsi_editor.AnimationView import AnimationView
+        from rsi_editor.ListView import ListView
+        from rsi_editor.Rsi import Rsi
+        from rsi_editor.State import State
+        from rsi_editor.editor import EditorWindow
+
+        self.app = app
+        self.rsiPath = rsiPath
+        self.instruments = ViewInstruments([Rsi, State], [ListView, AnimationView])
+
+        self.window = EditorWindow()
+        self.window.resize(windowSize)
+        self.window.show()
+        self.settle()
+
+        self.results : Dict[str, Dict[str, Any]] = {}
+
+    def settle(self) -> None:
+        self.app.processEvents()
+
+    # Times a step, including repainting `view` as soon as it's done
+    def step(self, action : Callable[[], object], view : QtW.QAbstractItemView) -> float:
+        start = time.perf_counter()
+        action()
+        self.app.processEvents()
+        view.viewport().repaint()
+        return (time.perf_counter() - start) * 1000
+
+    def phase(self, name : str, steps : List[float], extra : Optional[Dict[str, Any]] = None) -> None:
+        result = self.instruments.stop()
+        result.update(timingSummary('step', steps))
+
+        # What's compared between runs
+        result['medianMs'] = result.get('stepMedianMs', result.get('paintMedianMs', 0))
+        result.update(extra or {})
+
+        self.results[name] = result
+        print(f'{name:24} {result["medianMs"]:8.2f} ms median, {result.get("stepMaxMs", result.get("paintMaxMs", 0)):8.2f} ms worst, '
+                f'{result["paintCount"]:5} paints, {result["dataCalls"]:8} data() calls')
+
+    def openRsi(self) -> None:
+        self.instruments.start()
+        steps = [self.step(lambda: self.window.openRsiPath(str(self.rsiPath)), self.window.stateList)]
+        self.phase('open', steps)
+
+    # Scrolls the state list from top to bottom, the way a mouse wheel would,
+    # then back up again once the thumbnails are cached
+    def scrollStateList(self, maxSteps : int) -> None:
+        scrollBar = self.window.stateList.verticalScrollBar()
+        stepSize = max(scrollBar.singleStep() * 3, (scrollBar.maximum() - scrollBar.minimum()) // max(maxSteps, 1) + 1)
+        positions = list(range(scrollBar.minimum(), scrollBar.maximum() + 1, stepSize))
+
+        for (name, order) in [('scrollStateList', positions), ('scrollStateListWarm', positions[::-1])]:
+            self.instruments.start()
+            steps = []
+            for position in order:
+                def scroll(position : int = position) -> None:
+                    scrollBar.setValue(position)
+                steps.append(self.step(scroll, self.window.stateList))
+            self.phase(name, steps)
+
+    def openStates(self, count : int) -> None:
+        stateList = self.window.stateList
+        rows = min(count, stateList.model().rowCount())
+
+        self.instruments.start()
+        steps = []
+        for row in range(rows):
+            def openState(row : int = row) -> None:
+                self.window.stateListDrillDown(stateList.model().index(row, 0))
+            steps.append(self.step(openState, self.window.stateContents))
+        self.phase('openStates', steps)
+
+    # Cycles the open state between 1, 4 and 8 directions
+    def setDirections(self, toggles : int) -> None:
+        from rsi_editor.editor import SetDirectionsCommand
+
+        currentState = self.window.currentState
+        if currentState is None:
+            return
+
+        cycle = [1, 4, 8]
+        start = cycle.index(currentState.directions()) if currentState.directions() in cycle else 0
+        targets = [cycle[(start + toggle + 1) % len(cycle)] for toggle in range(toggles)]
+
+        self.instruments.start()
+        steps = []
+        for directions in targets:
+            def toggle(directions : int = directions) -> None:
+                self.window.undoStack.push(SetDirectionsCommand(self.window, directions))
+            steps.append(self.step(toggle, self.window.stateContents))
+        self.phase('setDirections', steps, { 'liveAnimations': currentState.liveAnimations() })
+
+    # Leaves the open state's animations playing
+    def animate(self, seconds : float) -> None:
+        self.instruments.start()
+
+        loop = QtC.QEventLoop()
+        QtC.QTimer.singleShot(int(seconds * 1000), loop.quit)
+        loop.exec_()
+
+        paints = len(self.instruments.paintTimes)
+        self.phase('animation', [], { 'seconds': seconds, 'paintsPerSecond': paints / seconds })
+
+        # How many calls there are depends on how long it ran for, so only the
+        # rate is worth comparing
+        result = self.results['animation']
+        result['dataCallsPerSecond'] = result.pop('dataCalls') / seconds
+
+    def close(self) -> None:
+        # Nothing was saved, so there's nothing worth keeping
+        for document in self.window.documents:
+            document.undoStack.setClean()
+        self.window.close()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='benchmarks.gui', description="Measure how quickly RSI-editor's views respond, using a synthetic RSI")
+    addSpecArguments(parser, 500)
+    parser.add_argument('--scroll-steps', type=int, default=100, help='most steps to scroll the state list in (default: 100)')
+    parser.add_argument('--open-states', type=int, default=20, help='states to open one after another (default: 20)')
+    parser.add_argument('--toggles', type=int, default=30, help='times to change the number of directions (default: 30)')
+    parser.add_argument('--animate', type=float, default=2, help='seconds to leave the animations playing (default: 2)')
+    addResultsArguments(parser)
+    args = parser.parse_args()
+
+    spec = specFromArguments(args)
+    if spec is None:
+        return 2
+
+    (rsiPath, _dmiPath) = syntheticFiles(Path(args.data), spec)
+
+    with tempfile.TemporaryDirectory(prefix='rsi-editor-gui-') as home:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        for variable in ['XDG_CONFIG_HOME', 'XDG_DATA_HOME', 'XDG_CACHE_HOME']:
+            os.environ[variable] = str(Path(home) / variable.lower())
+
+        app = QtW.QApplication([])
+        harness = GuiHarness(app, rsiPath)
+
+        harness.openRsi()
+        harness.scrollStateList(args.scroll_steps)
+        harness.openStates(args.open_states)
+        harness.setDirections(args.toggles)
+        harness.animate(args.animate)
+        harness.close()
+
+        options = {
+            'window': [windowSize.width(), windowSize.height()],
+            'scrollSteps': args.scroll_steps,
+            'openStates': args.open_states,
+            'toggles': args.toggles,
+            'animate': args.animate,
+        }
+        return finishResults(args, resultsDocument(spec, harness.results, harness='gui', options=options))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# Writing benchmark results, and comparing them with earlier ones
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+
+import numpy as np
+
+import PIL # type: ignore
+
+import PySide2
+import PySide2.QtCore as QtC
+
+from .synthetic import SyntheticSpec
+
+from typing import Any, Dict, Optional
+
+# Bump this when the layout of the results changes
+resultsVersion = 1
+
+def currentCommit() -> Optional[str]:
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent, capture_output=True, text=True)
+    except OSError:
+        return None
+
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def environment() -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'pyside2': PySide2.__version__,
+        'qt': QtC.qVersion(),
+    }
+
+# Everything that's written out, with `benchmarks` being the result of each
+# benchmark by name. Every result has at least a `medianMs`.
+def resultsDocument(spec : SyntheticSpec, benchmarks : Dict[str, Dict[str, Any]], **details : Any) -> Dict[str, Any]:
+    return {
+        'version': resultsVersion,
+        'commit': currentCommit(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': environment(),
+        'spec': spec.dict(),
+        **details,
+        'benchmarks': benchmarks,
+    }
+
+def addResultsArguments(parser : argparse.ArgumentParser) -> None:
+    parser.add_argument('-o', '--output', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='earlier results to compare against - exits with 1 if anything got slower')
+    parser.add_argument('--threshold', type=float, default=0.1, help='how much slower counts as a regression, as a fraction (default: 0.1)')
+
+# Writes and compares the results as asked by addResultsArguments' arguments,
+# returning the exit code
+def finishResults(args : argparse.Namespace, results : Dict[str, Any]) -> int:
+    if args.output is not None:
+        writeResults(args.output, results)
+
+    if args.compare is not None and compareResults(readResults(args.compare), results, args.threshold):
+        return 1
+
+    return 0
+
+def writeResults(path : str, results : Dict[str, Any]) -> None:
+    with open(path, 'w') as outputFile:
+        json.dump(results, outputFile, indent=4)
+
+def readResults(path : str) -> Dict[str, Any]:
+    with open(path) as resultsFile:
+        return json.load(resultsFile)
+
+# Compares against earlier results. Returns whether any benchmark got slower by
+# more than `threshold` (as a fraction of the earlier median), or, for results
+# which count them, made that many more data() calls.
+def compareResults(old : Dict[str, Any], new : Dict[str, Any], threshold : float) -> bool:
+    if old.get('spec') != new.get('spec'):
+        print('Warning: the earlier results are for a different synthetic RSI, so they may not be comparable')
+
+    print(f'\nCompared with {old.get("commit") or "earlier results"}:')
+
+    regressed = False
+    for (name, result) in new['benchmarks'].items():
+        oldResult = old['benchmarks'].get(name)
+        if oldResult is None:
+            print(f'{name:30} (new)')
+            continue
+
+        ratio = result['medianMs'] / oldResult['medianMs'] if oldResult['medianMs'] > 0 else 1
+        slower = ratio > 1 + threshold
+        regressed = regressed or slower
+        print(f'{name:30} {oldResult["medianMs"]:10.1f} -> {result["medianMs"]:10.1f} ms ({ratio:5.2f}x){"  SLOWER" if slower else ""}')
+
+        # Unlike times, call counts hardly depend on how busy the machine is
+        if 'dataCalls' in result and 'dataCalls' in oldResult:
+            moreCalls = result['dataCalls'] > oldResult['dataCalls'] * (1 + threshold)
+            regressed = regressed or moreCalls
+            print(f'{"":30} {oldResult["dataCalls"]:10} -> {result["dataCalls"]:10} data() calls{"  MORE" if moreCalls else ""}')
+
+    return regressed
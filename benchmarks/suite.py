@@ -0,0 +1,251 @@
+# The benchmarks, and running them
+
+# Each benchmark is set up and run in a fresh process, so that one benchmark's
+# caches and memory use don't affect the next, and the process's peak resident
+# memory can be reported for it. (Most of the memory goes on PIL images, which
+# tracemalloc doesn't see.) Qt runs on the offscreen platform, so no display is
+# needed.
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+import gc
+import multiprocessing
+import os
+from pathlib import Path
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None # type: ignore
+
+from .synthetic import SyntheticSpec
+
+# What a benchmark gets to work with
+class BenchmarkContext():
+    def __init__(self, spec : SyntheticSpec, rsiPath : Path, dmiPath : Path, scratch : Path):
+        self.spec = spec
+        self.rsiPath = rsiPath
+        self.dmiPath = dmiPath
+
+        # Emptied after the benchmark
+        self.scratch = scratch
+
+# Sets up a benchmark, returning the function to time and how many items (frames,
+# rows...) it handles each time it runs
+Benchmark = Callable[[BenchmarkContext], Tuple[Callable[[], object], int]]
+
+# Loading
+
+def loadRsi(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi
+
+    return (lambda: Rsi.fromFile(str(context.rsiPath)), context.spec.frameCount())
+
+def loadDmi(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi
+
+    return (lambda: Rsi.fromDmi(str(context.dmiPath)), context.spec.frameCount())
+
+# Opening through the frame cache with the pack already built
+def loadMapped(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.FrameCache import FrameCache
+    from rsi_editor.Rsi import Rsi
+
+    frameCache = FrameCache(context.scratch / 'frames')
+    frameCache.openRsi(context.rsiPath)
+
+    return (lambda: Rsi.fromFile(str(context.rsiPath), frameCache), context.spec.frameCount())
+
+# Opening through the frame cache for the first time, which builds the pack
+def buildFrameCache(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.FrameCache import FrameCache
+    from rsi_editor.Rsi import Rsi
+
+    cacheFolder = context.scratch / 'frames'
+
+    def build() -> object:
+        shutil.rmtree(cacheFolder, ignore_errors=True)
+        return Rsi.fromFile(str(context.rsiPath), FrameCache(cacheFolder))
+
+    return (build, context.spec.frameCount())
+
+# Saving
+
+def saveRsi(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi
+
+    rsi = Rsi.fromFile(str(context.rsiPath))
+    return (lambda: rsi.save(str(context.scratch / 'saved.rsi'), 4), context.spec.frameCount())
+
+def saveRsiStaged(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi
+
+    rsi = Rsi.fromFile(str(context.rsiPath))
+    return (lambda: rsi.saveStaged(str(context.scratch / 'saved.rsi'), 4), context.spec.frameCount())
+
+# Model queries
+
+def rsiRows(rsi : Any) -> None:
+    import PySide2.QtCore as QtC
+
+    for row in range(rsi.rowCount()):
+        index = rsi.index(row)
+        rsi.data(index, QtC.Qt.DisplayRole)
+        rsi.data(index, QtC.Qt.DecorationRole)
+
+# The state list, drawing every thumbnail
+def rsiDataCold(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi
+    from rsi_editor.ThumbnailCache import ThumbnailCache
+
+    rsi = Rsi.fromFile(str(context.rsiPath))
+
+    def query() -> None:
+        rsi.thumbnailCache = ThumbnailCache()
+        rsiRows(rsi)
+
+    return (query, context.spec.states)
+
+# The state list, with every thumbnail already cached
+def rsiDataWarm(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi
+    from rsi_editor.ThumbnailCache import ThumbnailCache
+
+    rsi = Rsi.fromFile(str(context.rsiPath))
+    rsi.thumbnailCache = ThumbnailCache()
+    rsiRows(rsi)
+
+    return (lambda: rsiRows(rsi), context.spec.states)
+
+# The state list in a new session, with every thumbnail stored on disk
+def rsiDataStored(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    from rsi_editor.Rsi import Rsi, iconSize
+    from rsi_editor.ThumbnailCache import ThumbnailCache
+
+    cacheFolder = context.scratch / 'thumbnails'
+    rsi = Rsi.fromFile(str(context.rsiPath))
+
+    future = ThumbnailCache(cacheFolder).savePack(context.rsiPath, rsi.thumbnailFrames(), iconSize)
+    assert future is not None
+    future.result()
+
+    def query() -> None:
+        rsi.thumbnailCache = ThumbnailCache(cacheFolder)
+        rsi.thumbnailPack = rsi.thumbnailCache.openPack(context.rsiPath, rsi.states.keys(), iconSize)
+        rsiRows(rsi)
+
+    return (query, context.spec.states)
+
+def stateModels(context : BenchmarkContext) -> List[Any]:
+    from rsi_editor.Rsi import Rsi
+    from rsi_editor.State import State
+
+    rsi = Rsi.fromFile(str(context.rsiPath))
+    return [State(rsi, name) for name in rsi.states.keys()]
+
+# Every cell of every state's table, as the state contents view asks for them
+def stateData(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    import PySide2.QtCore as QtC
+
+    states = stateModels(context)
+
+    def query() -> None:
+        for state in states:
+            for row in range(state.rowCount()):
+                for column in range(state.columnCount()):
+                    index = state.index(row, column)
+                    state.data(index, QtC.Qt.DisplayRole)
+                    state.data(index, QtC.Qt.DecorationRole)
+
+    cells = sum(state.rowCount() * state.columnCount() for state in states)
+    return (query, cells)
+
+# Rebuilding the animation of every direction of every state
+def recalculateSummary(context : BenchmarkContext) -> Tuple[Callable[[], object], int]:
+    states = stateModels(context)
+
+    def recalculate() -> None:
+        for state in states:
+            state.recalculateSummary()
+
+    return (recalculate, context.spec.states * context.spec.directions)
+
+benchmarks : Dict[str, Benchmark] = {
+    'load.fromFile': loadRsi,
+    'load.fromDmi': loadDmi,
+    'load.mapped': loadMapped,
+    'load.buildFrameCache': buildFrameCache,
+    'save.save': saveRsi,
+    'save.saveStaged': saveRsiStaged,
+    'model.rsiDataCold': rsiDataCold,
+    'model.rsiDataWarm': rsiDataWarm,
+    'model.rsiDataStored': rsiDataStored,
+    'model.stateData': stateData,
+    'animation.recalculateSummary': recalculateSummary,
+}
+
+# Peak resident memory of this process so far, in MiB
+def peakRssMiB() -> Optional[float]:
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, KiB everywhere else
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+# Runs in the benchmark's own process
+def runBenchmark(name : str, spec : SyntheticSpec, rsiPath : Path, dmiPath : Path, repeat : int, warmup : int) -> Dict[str, Any]:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    import PySide2.QtWidgets as QtW
+    app = QtW.QApplication.instance() or QtW.QApplication([])
+
+    with tempfile.TemporaryDirectory(prefix='rsi-editor-benchmark-') as scratch:
+        context = BenchmarkContext(spec, rsiPath, dmiPath, Path(scratch))
+        (run, items) = benchmarks[name](context)
+        setupPeak = peakRssMiB()
+
+        for _run in range(warmup):
+            run()
+
+        runs = []
+        for _run in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            run()
+            runs.append((time.perf_counter() - start) * 1000)
+
+    median = statistics.median(runs)
+    return {
+        'runsMs': runs,
+        'minMs': min(runs),
+        'medianMs': median,
+        'meanMs': statistics.mean(runs),
+        'items': items,
+        'itemsPerSecond': items / (median / 1000) if median > 0 else None,
+        'setupPeakRssMiB': setupPeak,
+        'peakRssMiB': peakRssMiB(),
+    }
+
+# Runs each benchmark in a fresh process
+def runBenchmarks(names : List[str], spec : SyntheticSpec, rsiPath : Path, dmiPath : Path, repeat : int, warmup : int,
+        report : Callable[[str, Dict[str, Any]], None]) -> Dict[str, Dict[str, Any]]:
+    results = {}
+
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results[name] = executor.submit(runBenchmark, name, spec, rsiPath, dmiPath, repeat, warmup).result()
+        report(name, results[name])
+
+    return results
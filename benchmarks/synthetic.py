@@ -0,0 +1,152 @@
+# Synthetic RSIs (and the same thing as a DMI) to benchmark against
+
+# Frames are a few opaque rectangles on a transparent background, which
+# compress about as well as real sprites do, and are generated from a seed so
+# every run benchmarks exactly the same images.
+
+from __future__ import annotations
+
+import argparse
+import math
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+import PIL.PngImagePlugin # type: ignore
+
+import rsi as RSIPy
+
+from rsi_editor.RsiResize import parseSize
+
+from typing import List, Optional, Tuple
+
+defaultDataFolder = Path(tempfile.gettempdir()) / 'rsi-editor-benchmarks'
+
+class SyntheticSpec():
+    def __init__(self, states : int, directions : int, frames : int, size : Tuple[int, int], seed : int = 0):
+        self.states = states
+        self.directions = directions
+        self.frames = frames
+        self.size = size
+        self.seed = seed
+
+    def name(self) -> str:
+        (x, y) = self.size
+        return f'{self.states}s-{self.directions}d-{self.frames}f-{x}x{y}-{self.seed}'
+
+    def frameCount(self) -> int:
+        return self.states * self.directions * self.frames
+
+    def dict(self) -> dict:
+        return {
+            'states': self.states,
+            'directions': self.directions,
+            'frames': self.frames,
+            'size': list(self.size),
+            'seed': self.seed,
+        }
+
+def syntheticFrame(random : np.random.Generator, size : Tuple[int, int]) -> PIL.Image.Image:
+    (x, y) = size
+    pixels = np.zeros((y, x, 4), dtype=np.uint8)
+
+    for _rectangle in range(random.integers(1, 5)):
+        (left, right) = sorted(random.integers(0, x, 2))
+        (top, bottom) = sorted(random.integers(0, y, 2))
+        pixels[top:bottom + 1, left:right + 1, :3] = random.integers(0, 256, 3)
+        pixels[top:bottom + 1, left:right + 1, 3] = 255
+
+    return PIL.Image.fromarray(pixels, 'RGBA')
+
+# [state][direction][frame]
+def syntheticFrames(spec : SyntheticSpec) -> List[List[List[PIL.Image.Image]]]:
+    random = np.random.default_rng(spec.seed)
+    return [[[syntheticFrame(random, spec.size) for _frame in range(spec.frames)]
+            for _direction in range(spec.directions)] for _state in range(spec.states)]
+
+def stateName(number : int) -> str:
+    return f'state_{number}'
+
+def writeSyntheticRsi(path : Path, spec : SyntheticSpec) -> None:
+    rsi = RSIPy.Rsi(spec.size)
+    rsi.license = 'CC-BY-SA-3.0'
+    rsi.copyright = 'Synthetic benchmark RSI'
+
+    for (number, directions) in enumerate(syntheticFrames(spec)):
+        state = rsi.new_state(spec.directions, stateName(number))
+        for (direction, frames) in enumerate(directions):
+            state.icons[direction] = frames
+            state.delays[direction] = [0.1] * len(frames)
+
+    rsi.write(path)
+
+# The same states as writeSyntheticRsi, as a DMI. BYOND stores every direction
+# of a frame before the next frame.
+def writeSyntheticDmi(path : Path, spec : SyntheticSpec) -> None:
+    (x, y) = spec.size
+
+    manifest = ['# BEGIN DMI', 'version = 4.0', f'\twidth = {x}', f'\theight = {y}']
+    icons = []
+
+    for (number, directions) in enumerate(syntheticFrames(spec)):
+        manifest += [
+            f'state = "{stateName(number)}"',
+            f'\tdirs = {spec.directions}',
+            f'\tframes = {spec.frames}',
+        ]
+        if spec.frames > 1:
+            manifest.append('\tdelay = ' + ','.join(['1'] * spec.frames))
+
+        for frame in range(spec.frames):
+            for direction in range(spec.directions):
+                icons.append(directions[direction][frame])
+
+    manifest.append('# END DMI')
+
+    columns = max(math.ceil(math.sqrt(len(icons))), 1)
+    rows = max(math.ceil(len(icons) / columns), 1)
+    sheet = PIL.Image.new('RGBA', (columns * x, rows * y))
+    for (number, icon) in enumerate(icons):
+        sheet.paste(icon, ((number % columns) * x, (number // columns) * y))
+
+    info = PIL.PngImagePlugin.PngInfo()
+    info.add_text('Description', '\n'.join(manifest), zip=True)
+    sheet.save(path, format='PNG', pnginfo=info)
+
+def addSpecArguments(parser : argparse.ArgumentParser, states : int) -> None:
+    parser.add_argument('--states', type=int, default=states, help=f'states in the synthetic RSI (default: {states})')
+    parser.add_argument('--directions', type=int, choices=[1, 4, 8], default=4, help='directions of each state (default: 4)')
+    parser.add_argument('--frames', type=int, default=4, help='frames in each direction (default: 4)')
+    parser.add_argument('--size', default='32x32', help='frame size (default: 32x32)')
+    parser.add_argument('--seed', type=int, default=0, help='seed the frames are generated from (default: 0)')
+    parser.add_argument('--data', default=str(defaultDataFolder), help=f'where synthetic RSIs are kept between runs (default: {defaultDataFolder})')
+
+# The spec given by addSpecArguments' arguments, or None if they're invalid
+def specFromArguments(args : argparse.Namespace) -> Optional[SyntheticSpec]:
+    try:
+        size = parseSize(args.size)
+    except ValueError:
+        print(f'Invalid size {args.size} - expected e.g. 32x32')
+        return None
+
+    spec = SyntheticSpec(args.states, args.directions, args.frames, size, args.seed)
+    print(f'Synthetic RSI: {spec.states} states x {spec.directions} directions x {spec.frames} frames of {size[0]}x{size[1]}')
+    return spec
+
+# Writes the RSI and DMI for a spec into `folder`, unless they're already
+# there from an earlier run. Returns their paths.
+def syntheticFiles(folder : Path, spec : SyntheticSpec) -> Tuple[Path, Path]:
+    rsiPath = folder / f'{spec.name()}.rsi'
+    dmiPath = folder / f'{spec.name()}.dmi'
+
+    if not (rsiPath / 'meta.json').is_file():
+        folder.mkdir(parents=True, exist_ok=True)
+        writeSyntheticRsi(rsiPath, spec)
+
+    if not dmiPath.is_file():
+        writeSyntheticDmi(dmiPath, spec)
+
+    return (rsiPath, dmiPath)
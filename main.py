@@ -1,3 +1,4 @@
 from rsi_editor.__main__ import main
 
-exit(main())
+if __name__ == '__main__':
+    exit(main())
@@ -5,7 +5,9 @@ import toml
 import PySide2.QtCore as QtC
 import PySide2.QtWidgets as QtW
 
-from typing import Any, MutableMapping, List, Optional
+from .DirectionSynthesis import defaultRules
+
+from typing import Any, Dict, MutableMapping, List, Optional
 
 class Config():
     editorCommand : Optional[List[str]]
@@ -29,14 +31,65 @@ class Config():
         else:
             self.metadataIndent = 4
 
+        if 'watchFiles' in dictionary:
+            self.watchFiles = dictionary['watchFiles']
+        else:
+            self.watchFiles = True
+
+        if 'stagedSave' in dictionary:
+            self.stagedSave = dictionary['stagedSave']
+        else:
+            self.stagedSave = False
+
+        if 'optimisePng' in dictionary:
+            self.optimisePng = dictionary['optimisePng']
+        else:
+            self.optimisePng = False
+
+        if 'synthesiseDirections' in dictionary:
+            self.synthesiseDirections = dictionary['synthesiseDirections']
+        else:
+            self.synthesiseDirections = True
+
+        # In MiB, see Document.enforceMemoryBudget
+        if 'memoryBudget' in dictionary:
+            self.memoryBudget = dictionary['memoryBudget']
+        else:
+            self.memoryBudget = 1024
+
+        # Whether to open RSIs through the frame cache, see FrameCache
+        if 'mapFrames' in dictionary:
+            self.mapFrames = dictionary['mapFrames']
+        else:
+            self.mapFrames = False
+
+        # The directory last searched with the RSI browser
+        if 'browserRoot' in dictionary:
+            self.browserRoot = dictionary['browserRoot']
+        else:
+            self.browserRoot = ''
+
+        # Direction name -> rule, see DirectionSynthesis
+        self.directionRules = dict(defaultRules)
+        if 'directionRules' in dictionary:
+            self.directionRules.update(dictionary['directionRules'])
+
     def dict(self) -> MutableMapping[str, Any]:
-        contents = {}
+        contents : Dict[str, Any] = {}
 
         if self.editorCommand is not None:
             contents['editor'] = ' '.join(self.editorCommand)
 
         contents['formatMetadata'] = self.formatMetadata
         contents['metadataIndent'] = self.metadataIndent
+        contents['watchFiles'] = self.watchFiles
+        contents['stagedSave'] = self.stagedSave
+        contents['optimisePng'] = self.optimisePng
+        contents['synthesiseDirections'] = self.synthesiseDirections
+        contents['memoryBudget'] = self.memoryBudget
+        contents['mapFrames'] = self.mapFrames
+        contents['browserRoot'] = self.browserRoot
+        contents['directionRules'] = self.directionRules
 
         return contents
 
@@ -101,6 +154,38 @@ class ConfigEditor(QtW.QDialog):
         
         configForm.addRow('JSON indentation level:', self.metadataIndentEdit)
 
+        self.watchFilesEdit = QtW.QCheckBox()
+        self.watchFilesEdit.setChecked(config.watchFiles)
+
+        configForm.addRow('Reload files changed outside the editor:', self.watchFilesEdit)
+
+        self.stagedSaveEdit = QtW.QCheckBox()
+        self.stagedSaveEdit.setChecked(config.stagedSave)
+
+        configForm.addRow('Save through a staging directory:', self.stagedSaveEdit)
+
+        self.optimisePngEdit = QtW.QCheckBox()
+        self.optimisePngEdit.setChecked(config.optimisePng)
+
+        configForm.addRow('Optimise saved PNGs:', self.optimisePngEdit)
+
+        self.synthesiseDirectionsEdit = QtW.QCheckBox()
+        self.synthesiseDirectionsEdit.setChecked(config.synthesiseDirections)
+
+        configForm.addRow('Mirror existing directions to make new ones:', self.synthesiseDirectionsEdit)
+
+        self.memoryBudgetEdit = QtW.QSpinBox()
+        self.memoryBudgetEdit.setRange(64, 65536)
+        self.memoryBudgetEdit.setSuffix(' MiB')
+        self.memoryBudgetEdit.setValue(config.memoryBudget)
+
+        configForm.addRow('Memory for images of open RSIs:', self.memoryBudgetEdit)
+
+        self.mapFramesEdit = QtW.QCheckBox()
+        self.mapFramesEdit.setChecked(config.mapFrames)
+
+        configForm.addRow('Map frames from a cache on disk (for very large RSIs):', self.mapFramesEdit)
+
         buttonBox = QtW.QDialogButtonBox(QtW.QDialogButtonBox.Cancel
                              | QtW.QDialogButtonBox.Save)
 
@@ -120,6 +205,12 @@ class ConfigEditor(QtW.QDialog):
             self.config.editorCommand = self.editorCommandEdit.text().split()
             self.config.formatMetadata = self.formatMetadataEdit.isChecked()
             self.config.metadataIndent = self.metadataIndentEdit.value()
+            self.config.watchFiles = self.watchFilesEdit.isChecked()
+            self.config.stagedSave = self.stagedSaveEdit.isChecked()
+            self.config.optimisePng = self.optimisePngEdit.isChecked()
+            self.config.synthesiseDirections = self.synthesiseDirectionsEdit.isChecked()
+            self.config.memoryBudget = self.memoryBudgetEdit.value()
+            self.config.mapFrames = self.mapFramesEdit.isChecked()
             return True
         else:
             return False
@@ -0,0 +1,47 @@
+# Content hashes for frames and states
+
+# Two frames (or states) with the same hash are byte-identical, no matter which
+# RSI they came from, so these are used anywhere we need to spot duplicates or
+# key a cache on image contents
+
+import hashlib
+
+import PIL # type: ignore
+
+import rsi as RSIPy
+
+from typing import List, Optional, Tuple
+
+def imageHash(image : PIL.Image.Image) -> str:
+    # Paletted and RGBA copies of the same pixels should hash the same
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+
+    return rgbaHash(image.tobytes(), image.size)
+
+# The same hash as imageHash, for the raw RGBA pixels of a frame
+def rgbaHash(pixels : bytes, size : Tuple[int, int]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'RGBA:{size[0]}x{size[1]}:'.encode())
+    digest.update(pixels)
+    return digest.hexdigest()
+
+def bytesHash(data : bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Hashes the contents of a state - the name is deliberately left out, so that
+# copies of a state under a different name are still detected
+def stateHash(state : RSIPy.State, frameHashes : Optional[List[List[str]]] = None) -> str:
+    if frameHashes is None:
+        frameHashes = [[imageHash(icon) for icon in icons] for icons in state.icons]
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{state.directions}:{state.delays}:'.encode())
+    for direction in frameHashes:
+        digest.update(','.join(direction).encode())
+        digest.update(b';')
+    return digest.hexdigest()
+
+def fileHash(path : str) -> str:
+    with open(path, 'rb') as hashedFile:
+        return bytesHash(hashedFile.read())
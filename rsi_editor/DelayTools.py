@@ -0,0 +1,51 @@
+# Operations on many frame delays at once
+
+# Each takes the delays to change, as (direction, frame) -> delay, and returns
+# the new delays for the same frames.
+
+from typing import Dict, List, Tuple
+
+Delays = Dict[Tuple[int, int], float]
+
+# The delay of a frame without one - a direction's delays can be left empty
+# when it's just a single frame
+defaultDelay = 0.0
+
+# A direction's delays, with the single frame of an empty list at the default
+# delay
+def directionDelays(delays : List[float]) -> List[float]:
+    return delays if len(delays) != 0 else [defaultDelay]
+
+# Delays are kept to the millisecond, so that scaling doesn't leave long
+# floating point tails in the metadata
+def roundDelay(delay : float) -> float:
+    return round(delay, 3)
+
+def setAll(delays : Delays, delay : float) -> Delays:
+    return { position: roundDelay(delay) for position in delays.keys() }
+
+def scale(delays : Delays, factor : float) -> Delays:
+    return { position: roundDelay(delay * factor) for (position, delay) in delays.items() }
+
+# Scales the delays in each direction so they add up to `total` seconds
+def normalise(delays : Delays, total : float) -> Delays:
+    byDirection : Dict[int, List[Tuple[int, int]]] = {}
+    for position in delays.keys():
+        byDirection.setdefault(position[0], []).append(position)
+
+    normalised = {}
+    for positions in byDirection.values():
+        current = sum(delays[position] for position in positions)
+
+        for position in positions:
+            if current == 0:
+                normalised[position] = roundDelay(total / len(positions))
+            else:
+                normalised[position] = roundDelay(delays[position] * total / current)
+
+    return normalised
+
+# Gives each frame the delay of the same frame in `timing`. Frames past the end
+# of `timing` keep their delays.
+def copyTiming(delays : Delays, timing : List[float]) -> Delays:
+    return { (direction, frame): timing[frame] if frame < len(timing) else delay for ((direction, frame), delay) in delays.items() }
@@ -0,0 +1,117 @@
+# Generates the frames of new directions from the directions a state already
+# has, when the number of directions is increased
+
+# Each new direction has a rule saying which direction it's made from, and how -
+# for example West is usually East mirrored. Rules are written as
+# "<transform> <direction>", e.g. "mirror East" or "copy South". A rule can use
+# a direction which is itself being generated, as long as it comes earlier.
+#
+# Every frame needing the same transforms is transformed in one go, using the
+# same NumPy transforms as the Transform menu.
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+from .FrameTransforms import Transform, flipHorizontal, flipVertical, rotateAnticlockwise, rotateClockwise, rotateHalf
+from .RsiFiles import directionNames
+
+from typing import Dict, List, Mapping, Optional, Tuple
+
+# Transforms which can be used in rules. None leaves the frames as they are.
+ruleTransforms : Dict[str, Optional[Transform]] = {
+    'copy': None,
+    'mirror': flipHorizontal,
+    'flip': flipVertical,
+    'clockwise': rotateClockwise,
+    'anticlockwise': rotateAnticlockwise,
+    'half': rotateHalf,
+}
+
+# Quarter turns only work on square frames
+quarterTurns = ['clockwise', 'anticlockwise']
+
+defaultRules = {
+    'North': 'copy South',
+    'East': 'copy South',
+    'West': 'mirror East',
+    'South East': 'copy East',
+    'South West': 'mirror South East',
+    'North East': 'copy East',
+    'North West': 'mirror North East',
+}
+
+# (transform name, source direction), or None if the rule doesn't make sense
+def parseRule(rule : str) -> Optional[Tuple[str, int]]:
+    words = rule.split()
+
+    if len(words) > 1 and words[0] in ruleTransforms:
+        transform = words[0]
+        words = words[1:]
+    else:
+        transform = 'copy'
+
+    sourceName = ' '.join(words)
+    for (direction, name) in enumerate(directionNames):
+        if name.lower() == sourceName.lower():
+            return (transform, direction)
+
+    return None
+
+# Works out the frames and delays of directions `len(icons)` up to `directions`.
+#
+# New directions without a usable rule are copies of the existing directions in
+# turn, which is what happens when no rules are given at all.
+def synthesiseDirections(icons : List[List[PIL.Image.Image]], delays : List[List[float]], directions : int,
+        rules : Mapping[str, str], size : Tuple[int, int]) -> Tuple[List[List[PIL.Image.Image]], List[List[float]]]:
+    existing = len(icons)
+
+    # Each direction as (existing direction it's made from, transforms to apply)
+    sources : Dict[int, Tuple[int, Tuple[str, ...]]] = { direction: (direction, ()) for direction in range(existing) }
+
+    for target in range(existing, directions):
+        rule = parseRule(rules.get(directionNames[target], ''))
+
+        if rule is not None and rule[1] in sources and not (rule[0] in quarterTurns and size[0] != size[1]):
+            (transform, source) = rule
+            (original, transforms) = sources[source]
+            sources[target] = (original, transforms if transform == 'copy' else transforms + (transform,))
+        else:
+            sources[target] = sources[(target - existing) % existing]
+
+    newIcons : Dict[int, List[PIL.Image.Image]] = {}
+
+    # Group the new directions by the transforms they need
+    groups : Dict[Tuple[str, ...], List[int]] = {}
+    for target in range(existing, directions):
+        groups.setdefault(sources[target][1], []).append(target)
+
+    for (transforms, targets) in groups.items():
+        if len(transforms) == 0:
+            # Frames are shared rather than copied - see Rsi.internFrame
+            for target in targets:
+                newIcons[target] = list(icons[sources[target][0]])
+            continue
+
+        frames = [icon for target in targets for icon in icons[sources[target][0]]]
+        if len(frames) == 0:
+            for target in targets:
+                newIcons[target] = []
+            continue
+
+        stacked = np.stack([np.asarray(frame if frame.mode == 'RGBA' else frame.convert('RGBA')) for frame in frames])
+        for transform in transforms:
+            transformFunction = ruleTransforms[transform]
+            assert transformFunction is not None
+            stacked = transformFunction(stacked)
+        stacked = np.ascontiguousarray(stacked)
+
+        transformed = iter(PIL.Image.fromarray(pixels, 'RGBA') for pixels in stacked)
+        for target in targets:
+            newIcons[target] = [next(transformed) for _ in icons[sources[target][0]]]
+
+    return (
+        [newIcons[target] for target in range(existing, directions)],
+        [list(delays[sources[target][0]]) for target in range(existing, directions)],
+    )
@@ -0,0 +1,104 @@
+# An RSI open in the editor, with everything that belongs to it rather than to
+# the window - its undo stack, crash recovery journal and file path
+
+# Several documents can be open at once, one per tab. Only the active one is
+# shown and edited, but the decoded frames of every open RSI stay in memory, so
+# all of them (along with the state list thumbnails) share a memory budget.
+# When it's exceeded, the frames of the least recently used inactive documents
+# which haven't been changed are dropped, and read back from disk when they're
+# next shown.
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import PySide2.QtWidgets as QtW
+
+from .FrameCache import FrameCache
+from .Journal import Journal
+from .Rsi import Rsi
+from .ThumbnailCache import ThumbnailCache
+
+from typing import List, Optional
+
+class Document():
+    def __init__(self, undoGroup : QtW.QUndoGroup):
+        self.rsi : Optional[Rsi] = None
+        self.path = ''
+
+        # Added to the group, which follows the active document
+        self.undoStack = QtW.QUndoStack(undoGroup)
+
+        # Crash recovery journal, and the undo stack index it has been written
+        # up to
+        self.journal : Optional[Journal] = None
+        self.journalIndex = 0
+
+        # The state being edited, so it can be shown again when switching back
+        self.stateName : Optional[str] = None
+
+        # When the document was last active, for choosing what to unload
+        self.lastActive = 0
+
+        # Whether the frames were dropped to save memory - the RSI is read back
+        # from `path` when it's next needed
+        self.unloaded = False
+
+    def title(self) -> str:
+        if self.path == '':
+            return 'Untitled'
+        return Path(self.path).name
+
+    # Whether nothing has been opened in the document
+    def isEmpty(self) -> bool:
+        return self.rsi is None and not self.unloaded
+
+    # Rough size of the decoded frames, which is what most of the memory goes on.
+    # Frames mapped from the frame cache aren't counted, as the OS pages them
+    # out by itself.
+    def frameBytes(self) -> int:
+        if self.rsi is None:
+            return 0
+
+        return sum(frame.width * frame.height * len(frame.getbands()) for frame in self.rsi.uniqueFrames() if not self.rsi.isMapped(frame))
+
+    # Only RSIs which are exactly as they were saved can be reread from disk.
+    # Commands in the undo history keep the frames they changed (and often the
+    # whole states) alive, so unloading an RSI with any history wouldn't free
+    # its frames.
+    def canUnload(self) -> bool:
+        return self.rsi is not None and self.path != '' and self.undoStack.isClean() and self.undoStack.count() == 0
+
+    def unload(self) -> None:
+        self.rsi = None
+        self.unloaded = True
+
+    def load(self, frameCache : Optional[FrameCache] = None) -> None:
+        if self.unloaded:
+            self.rsi = Rsi.fromFile(self.path, frameCache)
+            self.unloaded = False
+
+# Unloads inactive documents, least recently used first, until the frames of
+# the open documents and the thumbnails fit in `budget` bytes. If the active
+# document is too big on its own, the thumbnails kept in memory are cut down
+# instead. Returns the documents which were unloaded.
+def enforceMemoryBudget(documents : List[Document], active : Document, thumbnailCache : ThumbnailCache, budget : int) -> List[Document]:
+    sizes = { id(document): document.frameBytes() for document in documents }
+    total = sum(sizes.values()) + thumbnailCache.memoryBytes
+
+    unloaded = []
+    for document in sorted(documents, key=lambda document: document.lastActive):
+        if total <= budget:
+            break
+
+        if document is active or not document.canUnload():
+            continue
+
+        document.unload()
+        total -= sizes[id(document)]
+        unloaded.append(document)
+
+    if total > budget:
+        thumbnailCache.trimMemory(max(thumbnailCache.memoryBytes - (total - budget), 0))
+
+    return unloaded
@@ -0,0 +1,268 @@
+# Cache of decoded frames, memory mapped rather than held in memory
+
+# Opening an RSI normally decodes every sprite sheet into frames held in memory,
+# so very large RSIs use a lot of memory just by being open. With the frame
+# cache, each sheet is decoded once into raw RGBA frames in a pack file (one per
+# RSI), and the frames are views of the memory mapped pack. The OS pages them in
+# as they're shown and can drop them again whenever memory is short, since
+# they're backed by the file.
+#
+# A pack records which version of each sheet it holds (by modification time and
+# size), so when an RSI is opened again only the sheets changed since are
+# decoded - the rest are copied across from the old pack. It also holds the
+# content hash of every frame, so frames don't need reading to be deduplicated.
+# Frames are never edited in place, so edited frames simply stop being views.
+#
+# A pack is laid out as the magic, the offset of the header, the frames of each
+# sheet one after another, and then the JSON header.
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+import PySide2.QtCore as QtC
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from .ContentHash import bytesHash, rgbaHash
+from .Profiling import profiler
+from .RsiFiles import metadataSize, readMetadata, stateFromSheet, statePath
+
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+# Bump this when the layout of packs changes, so old ones are ignored
+frameCacheVersion = 1
+
+packMagic = b'RSIFRAME'
+prefixSize = len(packMagic) + 8
+
+# Packs are raw pixels, so they're much bigger than the RSIs themselves
+defaultMaxBytes = 4 * 1024 * 1024 * 1024
+
+def defaultCacheFolder() -> Optional[Path]:
+    cacheFolder = QtC.QStandardPaths.writableLocation(QtC.QStandardPaths.CacheLocation)
+
+    if cacheFolder == '':
+        return None
+
+    return Path(cacheFolder) / 'frames'
+
+# Which version of a sheet is on disk
+def sheetKey(sheetPath : Path) -> str:
+    stat = sheetPath.stat()
+    return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+# An RSI opened through the cache, with every frame it maps and the frame's
+# content hash
+class MappedRsi():
+    def __init__(self, rsi : RSIPy.Rsi, frames : List[Tuple[PIL.Image.Image, str]]):
+        self.rsi = rsi
+        self.frames = frames
+
+# A pack file opened and mapped
+class Pack():
+    def __init__(self, header : Dict[str, Any], mapped : mmap.mmap):
+        self.header = header
+        self.mapped = mapped
+
+    def sheet(self, name : str) -> Optional[Dict[str, Any]]:
+        return self.header['sheets'].get(name)
+
+    def sheetBytes(self, sheet : Dict[str, Any], frameSize : int) -> memoryview:
+        start = prefixSize + sheet['offset']
+        return memoryview(self.mapped)[start:start + sheet['frames'] * frameSize]
+
+class FrameCache():
+    def __init__(self, cacheFolder : Optional[Path] = None, maxBytes : int = defaultMaxBytes):
+        self.cacheFolder = cacheFolder
+        self.maxBytes = maxBytes
+
+    def packPath(self, rsiPath : Union[str, Path]) -> Optional[Path]:
+        if self.cacheFolder is None:
+            return None
+
+        key = bytesHash(str(Path(rsiPath).absolute()).encode())
+        return self.cacheFolder / f'{key}.frames'
+
+    # Opens an RSI with its frames mapped from its pack, which is brought up to
+    # date first. Returns None if the RSI can't be opened this way (e.g. the
+    # cache can't be written), in which case it should be opened normally.
+    def openRsi(self, rsiPath : Union[str, Path]) -> Optional[MappedRsi]:
+        packPath = self.packPath(rsiPath)
+        if packPath is None:
+            return None
+
+        try:
+            metadata = readMetadata(rsiPath)
+            size = metadataSize(metadata)
+            stateMetas = metadata.get('states', [])
+            sheetKeys = { stateMeta['name']: sheetKey(statePath(rsiPath, stateMeta['name'])) for stateMeta in stateMetas }
+
+            pack = self.readPack(packPath)
+            if pack is None or not self.isCurrent(pack, size, sheetKeys):
+                self.writePack(packPath, rsiPath, size, sheetKeys, pack)
+                pack = self.readPack(packPath)
+                if pack is None:
+                    return None
+            else:
+                os.utime(packPath)
+
+            return self.mapRsi(pack, metadata, size)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def isCurrent(self, pack : Pack, size : Tuple[int, int], sheetKeys : Dict[str, str]) -> bool:
+        if tuple(pack.header['size']) != size:
+            return False
+
+        for (name, key) in sheetKeys.items():
+            sheet = pack.sheet(name)
+            if sheet is None or sheet['key'] != key:
+                return False
+
+        return True
+
+    def readPack(self, packPath : Path) -> Optional[Pack]:
+        try:
+            with packPath.open('rb') as packFile:
+                prefix = packFile.read(prefixSize)
+                if len(prefix) != prefixSize or prefix[:len(packMagic)] != packMagic:
+                    return None
+
+                (headerOffset,) = struct.unpack_from('<Q', prefix, len(packMagic))
+                packFile.seek(headerOffset)
+                header = json.loads(packFile.read())
+                if header.get('version') != frameCacheVersion:
+                    return None
+
+                # The map stays valid after the file is closed, and even after
+                # it's replaced by a newer pack
+                mapped = mmap.mmap(packFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        return Pack(header, mapped)
+
+    # Writes a new pack for an RSI, reusing the sheets from `old` which haven't
+    # changed. It's written alongside and then moved into place, so a pack is
+    # never seen half written.
+    def writePack(self, packPath : Path, rsiPath : Union[str, Path], size : Tuple[int, int], sheetKeys : Dict[str, str], old : Optional[Pack]) -> None:
+        packPath.parent.mkdir(parents=True, exist_ok=True)
+        temporaryPath = packPath.with_name(f'{packPath.name}.{os.getpid()}.tmp')
+
+        frameSize = size[0] * size[1] * 4
+        sheets : Dict[str, Dict[str, Any]] = {}
+
+        try:
+            with temporaryPath.open('wb') as packFile:
+                packFile.write(packMagic + struct.pack('<Q', 0))
+                offset = 0
+
+                for (name, key) in sheetKeys.items():
+                    oldSheet = old.sheet(name) if old is not None and tuple(old.header['size']) == size else None
+
+                    if old is not None and oldSheet is not None and oldSheet['key'] == key:
+                        packFile.write(old.sheetBytes(oldSheet, frameSize))
+                        hashes = oldSheet['hashes']
+                    else:
+                        hashes = writeSheetFrames(packFile, statePath(rsiPath, name), size)
+                        profiler.count('frame cache sheets decoded')
+
+                    sheets[name] = { 'key': key, 'offset': offset, 'frames': len(hashes), 'hashes': hashes }
+                    offset += len(hashes) * frameSize
+
+                header = { 'version': frameCacheVersion, 'size': list(size), 'sheets': sheets }
+                packFile.write(json.dumps(header).encode())
+                packFile.seek(len(packMagic))
+                packFile.write(struct.pack('<Q', prefixSize + offset))
+
+            os.replace(temporaryPath, packPath)
+        except BaseException:
+            temporaryPath.unlink(missing_ok=True)
+            raise
+
+        self.evict(packPath)
+
+    # Builds the RSI out of views of the pack's frames, in the same order
+    # RsiFiles.loadState would crop them from the sheets
+    def mapRsi(self, pack : Pack, metadata : Dict[str, Any], size : Tuple[int, int]) -> MappedRsi:
+        frameSize = size[0] * size[1] * 4
+
+        rsi = RSIPy.Rsi(size)
+        rsi.license = metadata.get('license')
+        rsi.copyright = metadata.get('copyright')
+
+        frames : List[Tuple[PIL.Image.Image, str]] = []
+
+        for stateMeta in metadata.get('states', []):
+            sheet = pack.sheet(stateMeta['name'])
+            assert sheet is not None
+            pixels = pack.sheetBytes(sheet, frameSize)
+
+            def sheetFrame(frameIndex : int) -> PIL.Image.Image:
+                if frameIndex >= sheet['frames']:
+                    raise ValueError(f'{stateMeta["name"]} has more frames than fit in its sheet')
+
+                start = frameIndex * frameSize
+                frame = PIL.Image.frombuffer('RGBA', size, pixels[start:start + frameSize], 'raw', 'RGBA', 0, 1)
+                frames.append((frame, sheet['hashes'][frameIndex]))
+                return frame
+
+            rsi.states[stateMeta['name']] = stateFromSheet(stateMeta, size, sheetFrame)
+
+        return MappedRsi(rsi, frames)
+
+    # Deletes the least recently used packs, other than `keep`, once the cache
+    # is bigger than its limit. Packs still mapped stay readable until they're
+    # unmapped.
+    def evict(self, keep : Path) -> None:
+        assert self.cacheFolder is not None
+
+        packs = []
+        for packPath in self.cacheFolder.glob('*.frames'):
+            try:
+                stat = packPath.stat()
+            except OSError:
+                continue
+            packs.append((stat.st_mtime, stat.st_size, packPath))
+
+        total = sum(packSize for (_time, packSize, _path) in packs)
+        for (_time, packSize, packPath) in sorted(packs):
+            if total <= self.maxBytes:
+                break
+            if packPath == keep:
+                continue
+
+            try:
+                packPath.unlink()
+            except OSError:
+                continue
+            total -= packSize
+
+# Decodes a sheet and writes every frame on it to a pack, returning the frames'
+# content hashes
+def writeSheetFrames(packFile : BinaryIO, sheetPath : Path, size : Tuple[int, int]) -> List[str]:
+    (x, y) = size
+
+    with PIL.Image.open(sheetPath) as sheet:
+        pixels = np.asarray(sheet if sheet.mode == 'RGBA' else sheet.convert('RGBA'))
+
+    rows = pixels.shape[0] // y
+    columns = pixels.shape[1] // x
+
+    # (rows, y, columns, x) -> (rows, columns, y, x), so each frame's pixels
+    # are together
+    frames = pixels[:rows * y, :columns * x].reshape(rows, y, columns, x, 4).transpose(0, 2, 1, 3, 4)
+    frameBytes = np.ascontiguousarray(frames).reshape(rows * columns, x * y * 4)
+
+    packFile.write(frameBytes.tobytes())
+    return [rgbaHash(frame.tobytes(), size) for frame in frameBytes]
@@ -0,0 +1,163 @@
+# On-disk index of frame and state hashes across a directory tree of RSIs
+
+# Used to find frames and whole states which have been copied between RSIs
+# (which happens a lot when converting DMIs). RSIs are only re-hashed when one
+# of their files has changed since the index was last updated.
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import rsi as RSIPy
+
+from .ContentHash import imageHash, stateHash
+
+from typing import Any, Dict, List, Tuple
+
+# The default name of the index file, written to the root of the indexed tree
+indexFileName = '.rsi-index.json'
+
+# Bump this when the hashes change, so old indexes are rebuilt
+indexVersion = 2
+
+# (rsi path, state name, direction, frame)
+FrameLocation = Tuple[str, str, int, int]
+# (rsi path, state name)
+StateLocation = Tuple[str, str]
+
+class FrameIndex():
+    def __init__(self, root : str, indexPath : str = ''):
+        self.root = Path(root)
+        self.indexPath = Path(indexPath) if indexPath != '' else self.root / indexFileName
+
+        # Relative RSI path -> { 'files': { filename: mtime }, 'states': { name: { 'hash', 'frames' } } }
+        self.rsis : Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def load(cls, root : str, indexPath : str = '') -> FrameIndex:
+        index = cls(root, indexPath)
+
+        if index.indexPath.is_file():
+            with index.indexPath.open() as indexFile:
+                contents = json.load(indexFile)
+
+            if contents.get('version') == indexVersion:
+                index.rsis = contents['rsis']
+
+        return index
+
+    def save(self) -> None:
+        with self.indexPath.open('w') as indexFile:
+            json.dump({ 'version': indexVersion, 'rsis': self.rsis }, indexFile)
+
+    # Brings the index up to date with the tree - returns the number of RSIs
+    # which had to be re-hashed
+    def update(self) -> int:
+        found = {}
+        for metaPath in self.root.rglob('meta.json'):
+            rsiPath = metaPath.parent
+            found[rsiPath.relative_to(self.root).as_posix()] = rsiPath
+
+        for removed in set(self.rsis.keys()) - set(found.keys()):
+            del self.rsis[removed]
+
+        rehashed = 0
+        for relativePath, rsiPath in found.items():
+            files = fileTimes(rsiPath)
+
+            entry = self.rsis.get(relativePath)
+            if entry is not None and entry['files'] == files:
+                continue
+
+            try:
+                rsi = RSIPy.Rsi.open(rsiPath)
+            except Exception:
+                # Broken RSIs are skipped, rather than stopping the whole scan
+                self.rsis.pop(relativePath, None)
+                continue
+
+            self.rsis[relativePath] = { 'files': files, 'states': hashRsi(rsi) }
+            rehashed += 1
+
+        return rehashed
+
+    def frameLocations(self) -> Dict[str, List[FrameLocation]]:
+        locations : Dict[str, List[FrameLocation]] = {}
+
+        for rsiPath, entry in self.rsis.items():
+            for stateName, stateEntry in entry['states'].items():
+                for direction, frames in enumerate(stateEntry['frames']):
+                    for frame, frameHash in enumerate(frames):
+                        locations.setdefault(frameHash, []).append((rsiPath, stateName, direction, frame))
+
+        return locations
+
+    def stateLocations(self) -> Dict[str, List[StateLocation]]:
+        locations : Dict[str, List[StateLocation]] = {}
+
+        for rsiPath, entry in self.rsis.items():
+            for stateName, stateEntry in entry['states'].items():
+                locations.setdefault(stateEntry['hash'], []).append((rsiPath, stateName))
+
+        return locations
+
+    # Frames which appear more than once. Repeats within a single state are
+    # usually deliberate (e.g. holding a frame in an animation), so by default
+    # only frames shared between different states are reported
+    def duplicateFrames(self, includeWithinState : bool = False) -> Dict[str, List[FrameLocation]]:
+        duplicates = {}
+
+        for frameHash, locations in self.frameLocations().items():
+            if len(locations) < 2:
+                continue
+
+            if not includeWithinState and len({ (rsiPath, stateName) for (rsiPath, stateName, _, _) in locations }) < 2:
+                continue
+
+            duplicates[frameHash] = locations
+
+        return duplicates
+
+    def duplicateStates(self) -> Dict[str, List[StateLocation]]:
+        return { contentHash: locations for contentHash, locations in self.stateLocations().items() if len(locations) > 1 }
+
+def fileTimes(rsiPath : Path) -> Dict[str, int]:
+    times = {}
+    for entry in os.scandir(rsiPath):
+        if entry.is_file() and (entry.name == 'meta.json' or entry.name.endswith('.png')):
+            times[entry.name] = entry.stat().st_mtime_ns
+    return times
+
+def hashRsi(rsi : RSIPy.Rsi) -> Dict[str, Dict[str, Any]]:
+    states = {}
+
+    for name, state in rsi.states.items():
+        frameHashes = [[imageHash(icon) for icon in icons] for icons in state.icons]
+        states[name] = { 'hash': stateHash(state, frameHashes), 'frames': frameHashes }
+
+    return states
+
+# Command line entry point - prints every duplicated state and frame in the tree
+def reportDuplicates(root : str, indexPath : str = '', includeWithinState : bool = False) -> int:
+    index = FrameIndex.load(root, indexPath)
+    rehashed = index.update()
+    index.save()
+
+    print(f'Indexed {len(index.rsis)} RSIs ({rehashed} re-hashed)')
+
+    duplicateStates = index.duplicateStates()
+    for stateLocations in duplicateStates.values():
+        print('Duplicate state:')
+        for (rsiPath, stateName) in stateLocations:
+            print(f'    {rsiPath}: {stateName}')
+
+    duplicateFrames = index.duplicateFrames(includeWithinState)
+    for frameLocations in duplicateFrames.values():
+        print('Duplicate frame:')
+        for (rsiPath, stateName, direction, frame) in frameLocations:
+            print(f'    {rsiPath}: {stateName} (direction {direction}, frame {frame})')
+
+    print(f'{len(duplicateStates)} duplicated states, {len(duplicateFrames)} duplicated frames')
+    return 0
@@ -0,0 +1,54 @@
+import PySide2.QtCore as QtC
+import PySide2.QtGui as QtG
+import PySide2.QtWidgets as QtW
+
+import PIL # type: ignore
+import PIL.ImageQt as PILQt # type: ignore
+
+from typing import List, Optional
+
+# Dialog for picking one of the frames already in the RSI, so that it can be
+# reused instead of creating a new copy of it
+class FramePicker(QtW.QDialog):
+    def __init__(self, frames : List[PIL.Image.Image], iconSize : QtC.QSize, parent : Optional[QtC.QObject] = None):
+        QtW.QDialog.__init__(self, parent)
+
+        self.setWindowTitle('Reuse existing frame')
+        self.setSizeGripEnabled(True)
+
+        self.frames = frames
+
+        overallLayout = QtW.QVBoxLayout()
+
+        self.frameList = QtW.QListWidget()
+        self.frameList.setViewMode(QtW.QListView.IconMode)
+        self.frameList.setIconSize(iconSize)
+        self.frameList.setMovement(QtW.QListView.Static)
+        self.frameList.setResizeMode(QtW.QListView.Adjust)
+        self.frameList.setUniformItemSizes(True)
+        self.frameList.setSelectionMode(QtW.QAbstractItemView.SingleSelection)
+        self.frameList.itemDoubleClicked.connect(lambda _item: self.accept())
+
+        for frame in frames:
+            framePixmap = QtG.QPixmap.fromImage(PILQt.ImageQt(frame))
+            framePixmap = framePixmap.scaled(iconSize)
+            QtW.QListWidgetItem(QtG.QIcon(framePixmap), '', self.frameList)
+
+        buttonBox = QtW.QDialogButtonBox(QtW.QDialogButtonBox.Cancel
+                             | QtW.QDialogButtonBox.Ok)
+
+        buttonBox.accepted.connect(self.accept)
+        buttonBox.rejected.connect(self.reject)
+
+        overallLayout.addWidget(self.frameList)
+        overallLayout.addWidget(buttonBox)
+
+        self.setLayout(overallLayout)
+
+    def frame(self) -> Optional[PIL.Image.Image]:
+        result = self.exec()
+
+        if result == QtW.QDialog.Accepted and self.frameList.currentRow() >= 0:
+            return self.frames[self.frameList.currentRow()]
+        else:
+            return None
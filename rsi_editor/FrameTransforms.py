@@ -0,0 +1,147 @@
+# Bulk transforms of frames - flipping, rotating, shifting and recolouring
+
+# Transforms work on NumPy arrays of RGBA pixels, with the frames stacked along
+# the first axis (frames, height, width, 4), so every frame of every selected
+# state is transformed in one go. Frames shared between states (or used more
+# than once in a state) are only transformed once.
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from typing import Callable, Dict, List, Tuple
+
+Transform = Callable[[np.ndarray], np.ndarray]
+
+def flipHorizontal(frames : np.ndarray) -> np.ndarray:
+    return frames[:, :, ::-1]
+
+def flipVertical(frames : np.ndarray) -> np.ndarray:
+    return frames[:, ::-1]
+
+# Rotating by a quarter turn only works for square frames
+def rotateClockwise(frames : np.ndarray) -> np.ndarray:
+    return np.rot90(frames, k=-1, axes=(1, 2))
+
+def rotateAnticlockwise(frames : np.ndarray) -> np.ndarray:
+    return np.rot90(frames, k=1, axes=(1, 2))
+
+def rotateHalf(frames : np.ndarray) -> np.ndarray:
+    return np.rot90(frames, k=2, axes=(1, 2))
+
+# Moves every pixel by (x, y). Pixels moved off one edge either come back on the
+# other edge, or are lost, leaving transparent pixels behind.
+def shift(x : int, y : int, wrap : bool) -> Transform:
+    def shiftFrames(frames : np.ndarray) -> np.ndarray:
+        shifted = np.roll(frames, (y, x), axis=(1, 2))
+
+        if not wrap:
+            (height, width) = frames.shape[1:3]
+            if y > 0:
+                shifted[:, :min(y, height)] = 0
+            elif y < 0:
+                shifted[:, max(height + y, 0):] = 0
+            if x > 0:
+                shifted[:, :, :min(x, width)] = 0
+            elif x < 0:
+                shifted[:, :, max(width + x, 0):] = 0
+
+        return shifted
+
+    return shiftFrames
+
+# Rotates the hue of every pixel by some number of degrees
+def hueShift(degrees : float) -> Transform:
+    def shiftHue(frames : np.ndarray) -> np.ndarray:
+        rgb = frames[..., :3].astype(np.float64) / 255
+
+        maximum = rgb.max(axis=-1)
+        minimum = rgb.min(axis=-1)
+        chroma = maximum - minimum
+
+        # Hue in [0, 6)
+        (red, green, blue) = (rgb[..., 0], rgb[..., 1], rgb[..., 2])
+        safeChroma = np.where(chroma == 0, 1, chroma)
+        hue = np.select(
+                [chroma == 0, maximum == red, maximum == green],
+                [0, ((green - blue) / safeChroma) % 6, (blue - red) / safeChroma + 2],
+                (red - green) / safeChroma + 4)
+
+        hue = (hue + degrees / 60) % 6
+
+        # Back to RGB, keeping the value and chroma the same
+        second = chroma * (1 - np.abs(hue % 2 - 1))
+
+        # A tiny negative hue wraps round to 6 itself, which is the same as 0
+        # but isn't a sector
+        sector = np.minimum(hue.astype(np.int32), 5)
+        zero = np.zeros_like(chroma)
+
+        shifted = np.stack([
+            np.choose(sector, [chroma, second, zero, zero, second, chroma]),
+            np.choose(sector, [second, chroma, chroma, second, zero, zero]),
+            np.choose(sector, [zero, zero, second, chroma, chroma, second]),
+        ], axis=-1) + (maximum - chroma)[..., None]
+
+        result = frames.copy()
+        result[..., :3] = np.clip(np.round(shifted * 255), 0, 255).astype(np.uint8)
+        return result
+
+    return shiftHue
+
+# Replaces every pixel of one colour with another. Fully transparent pixels are
+# left alone, whatever colour they hold.
+def replaceColour(old : Tuple[int, int, int, int], new : Tuple[int, int, int, int]) -> Transform:
+    def replace(frames : np.ndarray) -> np.ndarray:
+        matching = np.all(frames == np.array(old, dtype=np.uint8), axis=-1) & (frames[..., 3] != 0)
+
+        result = frames.copy()
+        result[matching] = new
+        return result
+
+    return replace
+
+# Each distinct frame (by identity) used by some states, and the position of
+# each in the list by id
+def distinctFrames(states : List[RSIPy.State]) -> Tuple[List[PIL.Image.Image], Dict[int, int]]:
+    frameNumbers : Dict[int, int] = {}
+    frames : List[PIL.Image.Image] = []
+    for state in states:
+        for icons in state.icons:
+            for icon in icons:
+                if id(icon) not in frameNumbers:
+                    frameNumbers[id(icon)] = len(frames)
+                    frames.append(icon)
+
+    return (frames, frameNumbers)
+
+# Applies a transform to a list of frames (all the same size) in one go
+def transformFrames(frames : List[PIL.Image.Image], transform : Transform) -> List[PIL.Image.Image]:
+    if len(frames) == 0:
+        return []
+
+    stacked = np.stack([np.asarray(frame if frame.mode == 'RGBA' else frame.convert('RGBA')) for frame in frames])
+    result = np.ascontiguousarray(transform(stacked))
+    return [PIL.Image.fromarray(pixels, 'RGBA') for pixels in result]
+
+# Copies of some states, with each frame replaced by the transformed frame in
+# the same position as it has in distinctFrames
+def replaceFrames(states : List[RSIPy.State], size : Tuple[int, int], frameNumbers : Dict[int, int], transformed : List[PIL.Image.Image]) -> List[RSIPy.State]:
+    copies = []
+    for state in states:
+        copy = RSIPy.State(state.name, size, state.directions)
+        copy.flags = dict(state.flags)
+        copy.delays = [list(delays) for delays in state.delays]
+        copy.icons = [[transformed[frameNumbers[id(icon)]] for icon in icons] for icons in state.icons]
+        copies.append(copy)
+
+    return copies
+
+# Applies a transform to every frame of some states, returning transformed
+# copies of the states. The states themselves are left untouched.
+def transformStates(states : List[RSIPy.State], size : Tuple[int, int], transform : Transform) -> List[RSIPy.State]:
+    (frames, frameNumbers) = distinctFrames(states)
+    return replaceFrames(states, size, frameNumbers, transformFrames(frames, transform))
@@ -9,23 +9,30 @@ import os
 import subprocess
 import tempfile
 
+from .Profiling import profiler, timed
+
 from typing import List, Optional
 
 class ImageEditor():
-    # Expects a PIL image
+    # Expects a PIL image. Most of the time spent is the user editing, so
+    # writing and reading back the image are timed separately.
+    @timed('ImageEditor.editImage')
     def editImage(image : PIL.Image.Image, command : List[str]) -> Optional[PIL.Image.Image]:
-        temp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-        tempPath = temp.name
-    
-        image.save(temp, format='PNG')
-        temp.close()
+        with profiler.span('ImageEditor.writeImage'):
+            temp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+            tempPath = temp.name
+
+            image.save(temp, format='PNG')
+            temp.close()
     
         # `{}` is where the file path should be inserted
         result = subprocess.run([(tempPath if segment == '{}' else segment) for segment in command])
     
         retValue = None
         if result.returncode == 0:
-            retValue = PIL.Image.open(tempPath)
+            with profiler.span('ImageEditor.readImage'):
+                retValue = PIL.Image.open(tempPath)
+                retValue.load()
 
         os.unlink(tempPath)
         return retValue
@@ -0,0 +1,305 @@
+# Crash-safe journal of the changes made to an RSI since it was last saved
+
+# Every time a command is done or undone, it describes what it changed as a list
+# of small operations (see the `journal` method on each undo command). These are
+# appended to a journal file on a background thread, with any images stored
+# once each as PNGs named by their content hash. If the editor crashes, the
+# journal is replayed over the last saved version of the RSI to get the work
+# back.
+#
+# The journal file is JSON lines. The first line says what the RSI was based on
+# (a saved RSI, a DMI or a new RSI of some size), every line after it holds the
+# operations from one change to the undo stack.
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+
+import PySide2.QtCore as QtC
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from .ContentHash import imageHash
+from .Rsi import Rsi
+from .State import State
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+journalVersion = 1
+
+journalFileName = 'journal.jsonl'
+lockFileName = 'lock'
+imageFolderName = 'images'
+
+Operation = Dict[str, Any]
+
+def journalRoot() -> Path:
+    dataFolder = QtC.QStandardPaths.writableLocation(QtC.QStandardPaths.AppDataLocation)
+
+    if dataFolder == '':
+        raise PermissionError("Could not find a folder to write the journal to!")
+
+    return Path(dataFolder) / 'journal'
+
+class Journal():
+    def __init__(self, folder : Path, lock : QtC.QLockFile):
+        self.folder = folder
+        self.lock = lock
+
+        # Only one worker, so that writes happen in the order they were made
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
+        # Hashes of images already written to the image folder - only touched
+        # by the writer thread
+        self.writtenImages : Set[str] = set()
+
+    # Starts a new journal. `base` says what to replay the journal over:
+    # { 'path': <rsi> }, { 'dmi': <dmi> } or { 'size': [x, y] }
+    @classmethod
+    def create(cls, base : Dict[str, Any]) -> Optional[Journal]:
+        folder = journalRoot() / uuid.uuid4().hex
+        folder.mkdir(parents=True, exist_ok=True)
+
+        lock = QtC.QLockFile(str(folder / lockFileName))
+        if not lock.tryLock(0):
+            return None
+
+        journal = cls(folder, lock)
+        journal.reset(base)
+        return journal
+
+    # Takes over a journal left behind by a previous session
+    @classmethod
+    def resume(cls, folder : Path) -> Optional[Journal]:
+        lock = QtC.QLockFile(str(folder / lockFileName))
+        if not lock.tryLock(0):
+            return None
+
+        journal = cls(folder, lock)
+        imageFolder = folder / imageFolderName
+        if imageFolder.is_dir():
+            journal.writtenImages = { imagePath.stem for imagePath in imageFolder.iterdir() }
+        return journal
+
+    def record(self, operations : List[Operation]) -> None:
+        if len(operations) != 0:
+            self.writer.submit(self.writeOperations, operations)
+
+    # Throws away everything journaled so far - used once the RSI is saved
+    def reset(self, base : Dict[str, Any]) -> None:
+        self.writer.submit(self.writeHeader, base)
+
+    # Deletes the journal, once its changes are either saved or abandoned
+    def discard(self) -> None:
+        self.writer.shutdown(wait=True)
+        self.lock.unlock()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # Writer thread functions
+
+    def writeHeader(self, base : Dict[str, Any]) -> None:
+        shutil.rmtree(self.folder / imageFolderName, ignore_errors=True)
+        self.writtenImages.clear()
+
+        with (self.folder / journalFileName).open('w') as journalFile:
+            journalFile.write(json.dumps({ 'journal': journalVersion, 'base': base }) + '\n')
+            journalFile.flush()
+            os.fsync(journalFile.fileno())
+
+    def writeOperations(self, operations : List[Operation]) -> None:
+        line = json.dumps([self.storeImages(operation) for operation in operations])
+
+        with (self.folder / journalFileName).open('a') as journalFile:
+            journalFile.write(line + '\n')
+            journalFile.flush()
+            os.fsync(journalFile.fileno())
+
+    # Replaces every image in an operation with its hash, writing out any images
+    # which haven't been seen before
+    def storeImages(self, value : Any) -> Any:
+        if isinstance(value, PIL.Image.Image):
+            contentHash = imageHash(value)
+
+            if contentHash not in self.writtenImages:
+                imageFolder = self.folder / imageFolderName
+                imageFolder.mkdir(exist_ok=True)
+
+                # Written under a temporary name first, so a crash can never
+                # leave a truncated image behind under the real name
+                temporaryPath = imageFolder / f'{contentHash}.tmp'
+                value.save(temporaryPath, format='PNG')
+                os.replace(temporaryPath, imageFolder / f'{contentHash}.png')
+                self.writtenImages.add(contentHash)
+
+            return contentHash
+        if isinstance(value, dict):
+            return { key: self.storeImages(item) for key, item in value.items() }
+        if isinstance(value, list) or isinstance(value, tuple):
+            return [self.storeImages(item) for item in value]
+        return value
+
+# Journals left behind by sessions which didn't exit cleanly
+def abandonedJournals() -> List[Path]:
+    try:
+        root = journalRoot()
+    except PermissionError:
+        return []
+
+    if not root.is_dir():
+        return []
+
+    abandoned = []
+    for folder in root.iterdir():
+        if not (folder / journalFileName).is_file():
+            continue
+
+        # A journal still locked belongs to an editor that's still running
+        lock = QtC.QLockFile(str(folder / lockFileName))
+        if lock.tryLock(0):
+            lock.unlock()
+            abandoned.append(folder)
+
+    return abandoned
+
+def readJournal(folder : Path) -> Tuple[Dict[str, Any], List[Operation]]:
+    base : Dict[str, Any] = {}
+    operations : List[Operation] = []
+
+    with (folder / journalFileName).open() as journalFile:
+        for lineNumber, line in enumerate(journalFile):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line may have been cut off by the crash
+                break
+
+            if lineNumber == 0:
+                if entry.get('journal') != journalVersion:
+                    break
+                base = entry['base']
+            else:
+                operations.extend(entry)
+
+    return (base, operations)
+
+def loadBase(base : Dict[str, Any]) -> Optional[Rsi]:
+    if 'path' in base:
+        return Rsi.fromFile(base['path'])
+    if 'dmi' in base:
+        return Rsi.fromDmi(base['dmi'])
+    if 'size' in base:
+        return Rsi.new(base['size'][0], base['size'][1])
+    return None
+
+# Applies journaled operations to an RSI, in the same way the undo commands
+# originally did
+def replay(folder : Path, rsi : Rsi, operations : List[Operation]) -> None:
+    images : Dict[str, PIL.Image.Image] = {}
+
+    def loadImage(contentHash : Optional[str]) -> Optional[PIL.Image.Image]:
+        if contentHash is None:
+            return None
+        if contentHash not in images:
+            with PIL.Image.open(folder / imageFolderName / f'{contentHash}.png') as image:
+                images[contentHash] = image.convert('RGBA')
+        return images[contentHash]
+
+    # State models are only created once per state, as they're fairly heavy
+    states : Dict[str, State] = {}
+
+    # Everything is replayed as one batch, so the models don't rebuild their
+    # animations after every operation
+    batches = ExitStack()
+
+    def stateModel(name : str) -> State:
+        if name not in states:
+            states[name] = State(rsi, name)
+            batches.enter_context(states[name].batchUpdate())
+        return states[name]
+
+    # The models are only used to make the changes, so their animations are
+    # never needed
+    def forgetModel(name : str) -> None:
+        model = states.pop(name, None)
+        if model is not None:
+            model.dispose()
+
+    with batches:
+        batches.enter_context(rsi.batchUpdate())
+
+        for operation in operations:
+            kind = operation['op']
+
+            if kind == 'license':
+                rsi.setLicense(operation['value'])
+            elif kind == 'copyright':
+                rsi.setCopyright(operation['value'])
+            elif kind == 'size':
+                rsi.setSize(tuple(operation['value']))
+            elif kind == 'addState':
+                rsi.addState(operation['name'])
+            elif kind == 'putState':
+                saved = operation['state']
+                state = RSIPy.State(operation['name'], rsi.size, saved['directions'])
+                state.flags = saved.get('flags', {})
+                state.delays = [list(delays) for delays in saved['delays']]
+                state.icons = [[loadImage(icon) for icon in icons] for icons in saved['icons']]
+                forgetModel(operation['name'])
+                rsi.addState(operation['name'], state)
+            elif kind == 'removeState':
+                forgetModel(operation['name'])
+                rsi.removeState(operation['name'])
+            elif kind == 'renameState':
+                forgetModel(operation['old'])
+                forgetModel(operation['new'])
+                rsi.renameState(operation['old'], operation['new'])
+            else:
+                model = stateModel(operation['state'])
+
+                if kind == 'setDirections':
+                    model.setDirections(operation['directions'], operation.get('rules'))
+
+                    # Directions removed earlier and now being put back
+                    firstRestored = operation.get('firstRestored', 0)
+                    for (offset, (icons, delays)) in enumerate(zip(operation.get('icons', []), operation.get('delays', []))):
+                        for frame in range(len(icons)):
+                            model.setFrame(model.index(firstRestored + offset, frame), loadImage(icons[frame]))
+                            model.setDelay(model.index(firstRestored + offset, frame), delays[frame])
+                elif kind == 'setFrame':
+                    model.setFrame(model.index(operation['row'], operation['column']), loadImage(operation['image']))
+                elif kind == 'setDelay':
+                    model.setDelay(model.index(operation['row'], operation['column']), operation['delay'])
+                elif kind == 'setDelays':
+                    model.setDelays({ (direction, frame): delay for (direction, frame, delay) in operation['delays'] })
+                elif kind == 'addFrame':
+                    model.addFrame(model.index(operation['row'], operation['column']), loadImage(operation.get('image')), operation.get('delay', 0.0))
+                elif kind == 'deleteFrame':
+                    model.deleteFrame(model.index(operation['row'], operation['column']))
+
+        for name in list(states.keys()):
+            forgetModel(name)
+
+# Journals an entire state, so that it can be put back exactly as it was
+def putStateOperation(name : str, state : RSIPy.State) -> Operation:
+    return {
+        'op': 'putState',
+        'name': name,
+        'state': {
+            'directions': state.directions,
+            'flags': state.flags,
+            'delays': [list(delays) for delays in state.delays],
+            'icons': [list(icons) for icons in state.icons],
+        },
+    }
+
+def deleteJournal(folder : Path) -> None:
+    shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,126 @@
+# Renders an overview of a whole RSI into a single image, for reviewing many
+# states at once without opening each one
+
+# Every state gets a tile of the same size, with a row for each direction and a
+# column for each frame shown, and its name underneath. All the frames are
+# copied into one preallocated array, which is then composited over a
+# checkerboard (to show transparency) in a single step.
+
+import time
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+import PIL.ImageDraw # type: ignore
+import PIL.ImageFont # type: ignore
+
+import rsi as RSIPy
+
+from typing import List, Tuple
+
+labelHeight = 12
+labelColour = (0, 0, 0, 255)
+
+# Gap around each tile, in pixels
+tileSpacing = 4
+
+checkerSize = 8
+checkerColours = [(255, 255, 255), (204, 204, 204)]
+
+# Background behind the tiles and labels
+backgroundColour = (255, 255, 255)
+
+# `maxFrames` is how many frames of each direction to show - 1 for just the
+# first frame, or 0 for every frame
+def renderOverview(states : List[RSIPy.State], size : Tuple[int, int], maxFrames : int = 1, labels : bool = True) -> PIL.Image.Image:
+    (width, height) = size
+
+    directions = max((state.directions for state in states), default=1)
+    frameColumns = max((len(icons) for state in states for icons in state.icons), default=1)
+    if maxFrames > 0:
+        frameColumns = min(frameColumns, maxFrames)
+    frameColumns = max(frameColumns, 1)
+
+    tileWidth = frameColumns * width
+    tileHeight = directions * height
+    cellWidth = tileWidth + tileSpacing
+    cellHeight = tileHeight + tileSpacing + (labelHeight if labels else 0)
+
+    # Lay the tiles out so the whole image is roughly square
+    columns = max(round(np.sqrt(len(states) * cellHeight / cellWidth)), 1)
+    rows = max(-(-len(states) // columns), 1)
+
+    canvas = np.zeros((rows * cellHeight + tileSpacing, columns * cellWidth + tileSpacing, 4), dtype=np.uint8)
+
+    # The background - a checkerboard behind each tile to show transparency
+    background = np.empty(canvas.shape[:2] + (3,), dtype=np.uint8)
+    background[...] = backgroundColour
+
+    checker = (np.arange(tileHeight)[:, None] // checkerSize + np.arange(tileWidth)[None, :] // checkerSize) % 2 == 1
+    tileBackground = np.where(checker[..., None], np.array(checkerColours[1], dtype=np.uint8), np.array(checkerColours[0], dtype=np.uint8))
+
+    for (stateNumber, state) in enumerate(states):
+        left = (stateNumber % columns) * cellWidth + tileSpacing
+        top = (stateNumber // columns) * cellHeight + tileSpacing
+
+        background[top:top + tileHeight, left:left + tileWidth] = tileBackground
+
+        for (direction, icons) in enumerate(state.icons):
+            for (frame, icon) in enumerate(icons[:frameColumns]):
+                if icon.mode != 'RGBA':
+                    icon = icon.convert('RGBA')
+
+                x = left + frame * width
+                y = top + direction * height
+                canvas[y:y + height, x:x + width] = np.asarray(icon)
+
+    # Composite everything over the background in one go. Sprites are mostly
+    # fully opaque or fully transparent pixels, so only the rest are blended.
+    alpha = canvas[..., 3]
+    composited = background
+    np.copyto(composited, canvas[..., :3], where=(alpha == 255)[..., None])
+
+    blended = np.nonzero((alpha != 0) & (alpha != 255))
+    if len(blended[0]) != 0:
+        blendAlpha = alpha[blended][:, None].astype(np.uint16)
+        composited[blended] = ((canvas[blended][:, :3] * blendAlpha + composited[blended] * (255 - blendAlpha) + 127) // 255).astype(np.uint8)
+
+    overview = PIL.Image.fromarray(composited, 'RGB')
+
+    if labels:
+        draw = PIL.ImageDraw.Draw(overview)
+        font = PIL.ImageFont.load_default()
+
+        for (stateNumber, state) in enumerate(states):
+            left = (stateNumber % columns) * cellWidth + tileSpacing
+            top = (stateNumber // columns) * cellHeight + tileSpacing + tileHeight + 1
+
+            draw.text((left, top), fitLabel(draw, font, state.name, tileWidth + tileSpacing), fill=labelColour, font=font)
+
+    return overview
+
+# Shortens a label until it fits in the given width
+def fitLabel(draw : PIL.ImageDraw.ImageDraw, font : PIL.ImageFont.ImageFont, label : str, width : int) -> str:
+    if draw.textlength(label, font=font) <= width:
+        return label
+
+    while len(label) > 0 and draw.textlength(label + '...', font=font) > width:
+        label = label[:-1]
+
+    return label + '...'
+
+# Command line entry point
+def writeOverview(rsiPath : str, outputPath : str, maxFrames : int = 1, scale : int = 1, labels : bool = True) -> int:
+    rsi = RSIPy.Rsi.open(rsiPath)
+
+    startTime = time.perf_counter()
+
+    overview = renderOverview(sorted(rsi.states.values(), key=lambda state: state.name), rsi.size, maxFrames, labels)
+    if scale != 1:
+        overview = overview.resize((overview.width * scale, overview.height * scale), PIL.Image.NEAREST)
+
+    overview.save(outputPath)
+
+    print(f'Rendered {len(rsi.states)} states in {(time.perf_counter() - startTime) * 1000:.0f} ms')
+    return 0
@@ -0,0 +1,116 @@
+# Optional optimisation stage for the sprite sheets written when saving
+
+# Sheets with 256 colours or fewer are also tried as (exact, lossless) paletted
+# images, and every candidate is compressed with each zlib strategy - the
+# smallest result wins. No metadata chunks are ever written. Results are cached
+# on disk by the hash of the sheet's pixels, so sheets which haven't changed are
+# never optimised again.
+
+from __future__ import annotations
+
+import io
+import os
+from pathlib import Path
+
+import numpy as np
+
+import PySide2.QtCore as QtC
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+from .ContentHash import imageHash
+
+from typing import List, Optional
+
+# Bump this when the optimisation changes, so old cached results are ignored
+optimiserVersion = 1
+
+# zlib's Z_DEFAULT_STRATEGY, Z_FILTERED, Z_HUFFMAN_ONLY, Z_RLE and Z_FIXED
+zlibStrategies = [0, 1, 2, 3, 4]
+
+def defaultCacheFolder() -> Optional[Path]:
+    cacheFolder = QtC.QStandardPaths.writableLocation(QtC.QStandardPaths.CacheLocation)
+
+    if cacheFolder == '':
+        return None
+
+    return Path(cacheFolder) / 'png'
+
+class PngOptimiser():
+    def __init__(self, cacheFolder : Optional[Path] = None):
+        self.cacheFolder = cacheFolder
+
+    # Usable wherever a sheet encoder is expected (see RsiFiles.SheetEncoder).
+    # Safe to call from several threads at once.
+    def encode(self, sheet : PIL.Image.Image) -> bytes:
+        cachePath = None
+        if self.cacheFolder is not None:
+            key = f'{imageHash(sheet)}-{optimiserVersion}'
+            cachePath = self.cacheFolder / key[:2] / f'{key}.png'
+
+            try:
+                return cachePath.read_bytes()
+            except OSError:
+                pass
+
+        best = min((encodeCandidate(candidate, strategy) for candidate in candidates(sheet) for strategy in zlibStrategies), key=len)
+
+        if cachePath is not None:
+            try:
+                cachePath.parent.mkdir(parents=True, exist_ok=True)
+
+                # Another thread may be writing the same sheet, so each thread
+                # writes its own temporary file before moving it into place
+                temporaryPath = cachePath.with_suffix(f'.{os.getpid()}-{id(sheet)}.tmp')
+                temporaryPath.write_bytes(best)
+                os.replace(temporaryPath, cachePath)
+            except OSError:
+                # Failing to cache isn't a reason to fail the save
+                pass
+
+        return best
+
+# The different ways of storing the same pixels
+def candidates(sheet : PIL.Image.Image) -> List[PIL.Image.Image]:
+    if sheet.mode != 'RGBA':
+        sheet = sheet.convert('RGBA')
+
+    results = [sheet]
+
+    paletted = exactPalette(sheet)
+    if paletted is not None:
+        results.append(paletted)
+
+    return results
+
+# Converts to a paletted image with exactly the same colours, if there are few
+# enough of them. Unlike quantize(), this never changes any pixel. `sheet` must
+# be RGBA.
+def exactPalette(sheet : PIL.Image.Image) -> Optional[PIL.Image.Image]:
+    # getcolors gives up quickly on sheets with too many colours
+    if sheet.getcolors(256) is None:
+        return None
+
+    # Each pixel as a single number, so the colours can be found all at once
+    pixels = np.asarray(sheet).view(np.uint32).reshape(sheet.height, sheet.width)
+    (colours, paletteIndexes) = np.unique(pixels, return_inverse=True)
+    palette = colours.view(np.uint8).reshape(-1, 4)
+
+    paletted = PIL.Image.fromarray(paletteIndexes.reshape(sheet.height, sheet.width).astype(np.uint8), 'P')
+    paletted.putpalette(palette[:, :3].tobytes())
+    paletted.info['transparency'] = palette[:, 3].tobytes()
+
+    return paletted
+
+def encodeCandidate(image : PIL.Image.Image, strategy : int) -> bytes:
+    encoded = io.BytesIO()
+
+    if image.mode == 'P':
+        colourCount = len(image.info['transparency'])
+        bits = next(bits for bits in [1, 2, 4, 8] if colourCount <= 2 ** bits)
+        image.save(encoded, format='PNG', compress_level=9, compress_type=strategy, bits=bits, transparency=image.info['transparency'])
+    else:
+        image.save(encoded, format='PNG', compress_level=9, compress_type=strategy)
+
+    return encoded.getvalue()
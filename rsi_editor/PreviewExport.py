@@ -0,0 +1,251 @@
+# Batch export of animated previews of states
+
+# Every direction of every state is rendered to an animated GIF, APNG or WebP
+# using the state's delays, for showing states where the editor isn't available
+# (wikis, pull requests...). States are rendered in a pool of processes, and a
+# manifest in the output folder records which state contents each preview was
+# made from, so exporting again only renders the states which have changed.
+
+import io
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+import PIL.PngImagePlugin # type: ignore
+
+import rsi as RSIPy
+
+from .ContentHash import stateHash
+from .RsiFiles import directionNames
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# Format name -> (PIL format, file extension)
+previewFormats = {
+    'gif': ('GIF', '.gif'),
+    'apng': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+}
+
+manifestFileName = '.previews.json'
+
+# Bump this when the rendering changes, so old previews are rendered again
+manifestVersion = 1
+
+# Used for states without any delays, which are just a single frame
+defaultDuration = 100
+
+# (states rendered, states to render) -> whether to carry on
+ExportProgress = Callable[[int, int], bool]
+
+# Longest to wait for a state to be rendered before reporting progress again,
+# in seconds
+progressInterval = 0.1
+
+# The file name (without extension) of one direction's preview
+def previewName(stateName : str, direction : int, directions : int) -> str:
+    if directions == 1:
+        return stateName
+
+    return f'{stateName}_{directionNames[direction].lower().replace(" ", "_")}'
+
+# Frame durations in milliseconds, from delays in seconds
+def frameDurations(delays : List[float], frameCount : int) -> List[int]:
+    if len(delays) != frameCount:
+        return [defaultDuration] * frameCount
+
+    # Browsers slow down GIF frames shorter than 20ms, so keep to at least that
+    return [max(round(delay * 1000), 20) for delay in delays]
+
+# GIF only has 256 colours and transparency which is either on or off, so the
+# last palette entry is kept for transparent pixels
+def gifFrame(frame : PIL.Image.Image) -> PIL.Image.Image:
+    frame = frame.convert('RGBA')
+
+    paletted = frame.convert('RGB').quantize(255)
+    paletted.paste(255, mask=frame.getchannel('A').point(lambda alpha: 255 if alpha < 128 else 0))
+    return paletted
+
+def renderPreview(frames : List[PIL.Image.Image], delays : List[float], previewFormat : str, scale : int = 1) -> bytes:
+    if scale != 1:
+        frames = [frame.resize((frame.width * scale, frame.height * scale), PIL.Image.NEAREST) for frame in frames]
+
+    durations = frameDurations(delays, len(frames))
+    encoded = io.BytesIO()
+
+    if previewFormat == 'gif':
+        frames = [gifFrame(frame) for frame in frames]
+        frames[0].save(encoded, format='GIF', save_all=True, append_images=frames[1:], duration=durations, loop=0,
+                disposal=2, transparency=255, optimize=False)
+    elif previewFormat == 'apng':
+        frames = [frame.convert('RGBA') for frame in frames]
+        # Each frame replaces the last completely, rather than being drawn over it
+        frames[0].save(encoded, format='PNG', save_all=True, append_images=frames[1:], duration=durations, loop=0,
+                disposal=PIL.PngImagePlugin.APNG_DISPOSE_OP_BACKGROUND, blend=PIL.PngImagePlugin.APNG_BLEND_OP_SOURCE)
+    elif previewFormat == 'webp':
+        frames = [frame.convert('RGBA') for frame in frames]
+        frames[0].save(encoded, format='WEBP', save_all=True, append_images=frames[1:], duration=durations, loop=0,
+                lossless=True)
+    else:
+        raise ValueError(f'Unknown preview format {previewFormat}')
+
+    return encoded.getvalue()
+
+# Renders and writes the previews for every direction of a state, returning the
+# names of the files written. Run in the worker processes.
+def exportState(outputFolder : Path, state : RSIPy.State, previewFormat : str, scale : int) -> List[str]:
+    extension = previewFormats[previewFormat][1]
+    written = []
+
+    for direction in range(state.directions):
+        frames = state.icons[direction]
+        if len(frames) == 0:
+            continue
+
+        fileName = previewName(state.name, direction, state.directions) + extension
+
+        # Written under a temporary name first, so an interrupted export never
+        # leaves a broken preview behind
+        temporaryPath = outputFolder / f'{fileName}.tmp'
+        temporaryPath.write_bytes(renderPreview(frames, state.delays[direction], previewFormat, scale))
+        os.replace(temporaryPath, outputFolder / fileName)
+
+        written.append(fileName)
+
+    return written
+
+def readManifest(outputFolder : Path) -> Dict[str, Any]:
+    try:
+        with (outputFolder / manifestFileName).open() as manifestFile:
+            manifest = json.load(manifestFile)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('version') != manifestVersion:
+        return {}
+
+    return manifest['states']
+
+def writeManifest(outputFolder : Path, states : Dict[str, Any]) -> None:
+    with (outputFolder / manifestFileName).open('w') as manifestFile:
+        json.dump({ 'version': manifestVersion, 'states': states }, manifestFile, indent=1)
+
+# Exports previews of the given states into a folder, in each of the given
+# formats. Previews of states which haven't changed since the last export to
+# the same folder are kept as they are, and previews of states which no longer
+# exist are removed.
+#
+# `progress` is called as states are rendered, and is called regularly while
+# waiting for them, so it can keep a window responsive. If it returns False,
+# the states which haven't started rendering yet are left as they were.
+#
+# A state which fails to render keeps the previews it had, and doesn't stop
+# the others. Returns (the number of states rendered, the number of states
+# skipped, the error of each state which failed).
+def exportPreviews(states : Dict[str, RSIPy.State], outputFolder : Union[str, Path], formats : List[str],
+        scale : int = 1, workers : Optional[int] = None, progress : Optional[ExportProgress] = None) -> Tuple[int, int, Dict[str, str]]:
+    outputFolder = Path(outputFolder)
+    outputFolder.mkdir(parents=True, exist_ok=True)
+
+    # State name -> format -> { 'hash', 'files' }
+    manifest = readManifest(outputFolder)
+    exported : Dict[str, Dict[str, Any]] = {}
+
+    tasks : List[Tuple[str, str, str]] = []
+    for name, state in states.items():
+        contentHash = f'{stateHash(state)}:{scale}'
+
+        for previewFormat in formats:
+            entry = manifest.get(name, {}).get(previewFormat)
+
+            if entry is not None and entry['hash'] == contentHash and all((outputFolder / fileName).is_file() for fileName in entry['files']):
+                exported.setdefault(name, {})[previewFormat] = entry
+            else:
+                tasks.append((name, previewFormat, contentHash))
+
+    rendered = set()
+    failed : Dict[str, str] = {}
+
+    def finished(name : str, previewFormat : str, contentHash : str, written : List[str]) -> None:
+        exported.setdefault(name, {})[previewFormat] = { 'hash': contentHash, 'files': written }
+        rendered.add(name)
+
+    # Previews which weren't brought up to date stay as they were, and are
+    # still out of date in the manifest
+    def keepOld(name : str, previewFormat : str) -> None:
+        if previewFormat in manifest.get(name, {}):
+            exported.setdefault(name, {})[previewFormat] = manifest[name][previewFormat]
+
+    def renderFailed(name : str, previewFormat : str, error : Exception) -> None:
+        failed[name] = str(error) or type(error).__name__
+        keepOld(name, previewFormat)
+
+    # Starting processes isn't worth it for a single state
+    if len(tasks) == 1:
+        (name, previewFormat, contentHash) = tasks[0]
+        try:
+            finished(name, previewFormat, contentHash, exportState(outputFolder, states[name], previewFormat, scale))
+        except Exception as error:
+            renderFailed(name, previewFormat, error)
+    elif len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = { pool.submit(exportState, outputFolder, states[task[0]], task[1], scale): task for task in tasks }
+            pending = set(futures.keys())
+
+            while len(pending) != 0:
+                (_done, pending) = wait(pending, timeout=progressInterval, return_when=FIRST_COMPLETED)
+
+                if progress is not None and not progress(len(tasks) - len(pending), len(tasks)):
+                    for future in pending:
+                        future.cancel()
+                    break
+
+            # States already being rendered when cancelled are still finished
+            # off
+            for (future, (name, previewFormat, contentHash)) in futures.items():
+                if future.cancelled():
+                    keepOld(name, previewFormat)
+                    continue
+
+                try:
+                    finished(name, previewFormat, contentHash, future.result())
+                except Exception as error:
+                    renderFailed(name, previewFormat, error)
+
+    # Remove previews of states and directions which no longer exist. Previews
+    # in other formats from earlier exports are left alone.
+    keptFiles = { fileName for formatEntries in exported.values() for entry in formatEntries.values() for fileName in entry['files'] }
+    for name, formatEntries in manifest.items():
+        for previewFormat, entry in formatEntries.items():
+            if name in states and previewFormat not in formats:
+                exported.setdefault(name, {})[previewFormat] = entry
+                continue
+
+            for fileName in entry['files']:
+                if fileName not in keptFiles:
+                    (outputFolder / fileName).unlink(missing_ok=True)
+
+    writeManifest(outputFolder, exported)
+
+    return (len(rendered), len(states) - len({ name for (name, _, _) in tasks }), failed)
+
+# Command line entry point - exports previews of each RSI into its own folder
+# under the output folder
+def exportRsiPreviews(rsiPaths : List[str], outputFolder : str, formats : List[str], scale : int = 1, workers : Optional[int] = None) -> int:
+    anyFailed = False
+
+    for rsiPath in rsiPaths:
+        rsi = RSIPy.Rsi.open(rsiPath)
+        rsiOutput = Path(outputFolder) / Path(rsiPath).absolute().name
+
+        (rendered, skipped, failed) = exportPreviews(rsi.states, rsiOutput, formats, scale, workers)
+        print(f'{rsiPath}: {rendered} states rendered, {skipped} unchanged')
+
+        for name, error in sorted(failed.items()):
+            print(f'{rsiPath}: {name} could not be rendered: {error}')
+        anyFailed = anyFailed or len(failed) != 0
+
+    return 1 if anyFailed else 0
@@ -0,0 +1,84 @@
+import PySide2.QtCore as QtC
+
+from typing import List, Optional, Tuple
+
+# Plays the animation of one direction of a state, for the summary column.
+#
+# A player is made once per direction and reused every time the frames change,
+# along with the frame animations inside it - only frames beyond the new number
+# of frames are deleted. Once a player isn't needed it has to be disposed of,
+# otherwise it carries on running (and holding on to its frames) until its
+# parent is deleted.
+class PreviewPlayer(QtC.QObject):
+    # Emitted with the player's summary index when it moves on to another frame
+    frameChanged = QtC.Signal(QtC.QModelIndex)
+
+    def __init__(self, summaryIndex : QtC.QModelIndex, parent : Optional[QtC.QObject] = None):
+        QtC.QObject.__init__(self, parent)
+
+        self.summaryIndex = summaryIndex
+
+        self.group = QtC.QSequentialAnimationGroup(parent=self)
+        self.group.setLoopCount(-1)
+        self.group.currentAnimationChanged.connect(self.currentFrameChanged)
+
+        self.frames : List[SummaryFrame] = []
+
+    # Sets the (index, delay) of each frame and restarts the animation
+    def setFrames(self, frames : List[Tuple[QtC.QModelIndex, float]], summaryIndex : QtC.QModelIndex) -> None:
+        self.group.stop()
+        self.summaryIndex = summaryIndex
+
+        for (frame, (index, delay)) in zip(self.frames, frames):
+            frame.index = index
+            frame.delay = delay
+
+        for (index, delay) in frames[len(self.frames):]:
+            frame = SummaryFrame(index, delay)
+            self.group.addAnimation(frame)
+            self.frames.append(frame)
+
+        while len(self.frames) > len(frames):
+            frame = self.frames.pop()
+            self.group.removeAnimation(frame)
+            frame.deleteLater()
+
+        if len(self.frames) != 0:
+            self.group.setCurrentTime(0)
+            self.group.start()
+
+    # The index of the frame being shown, if any
+    def currentIndex(self) -> Optional[QtC.QModelIndex]:
+        current = self.group.currentAnimation()
+        if isinstance(current, SummaryFrame):
+            return current.index
+        return None
+
+    def stop(self) -> None:
+        self.group.stop()
+
+    def dispose(self) -> None:
+        self.group.stop()
+        self.frames = []
+        self.deleteLater()
+
+    # Number of animation objects (the group and its frames) owned by the player
+    def animationCount(self) -> int:
+        return 1 + len(self.frames)
+
+    def currentFrameChanged(self, _animation : QtC.QAbstractAnimation) -> None:
+        self.frameChanged.emit(self.summaryIndex)
+
+# Special kind of animation that does nothing other than hold on to an index
+# so that we can track it later
+class SummaryFrame(QtC.QAbstractAnimation):
+    def __init__(self, index : QtC.QModelIndex, delay : float, parent : Optional[QtC.QObject] = None):
+        QtC.QAbstractAnimation.__init__(self, parent)
+        self.index = index
+        self.delay = delay
+
+    def duration(self) -> int:
+        return int(self.delay * 1000)
+
+    def updateCurrentTime(self, time : float) -> None:
+        return
@@ -0,0 +1,99 @@
+import PySide2.QtCore as QtC
+import PySide2.QtWidgets as QtW
+
+from .Profiling import profiler
+
+from typing import Optional
+
+# How often the tables are refreshed while the panel is shown
+refreshInterval = 1000
+
+# Shows the totals of the profiler's spans and counters while the editor is
+# used, and exports what it recorded as a Chrome trace
+class ProfilerPanel(QtW.QDockWidget):
+    def __init__(self, parent : Optional[QtC.QObject] = None):
+        QtW.QDockWidget.__init__(self, 'Profiler', parent)
+        self.setObjectName('profilerPanel')
+
+        self.recordCheckBox = QtW.QCheckBox('Record')
+        self.recordCheckBox.setChecked(profiler.enabled)
+        self.recordCheckBox.toggled.connect(self.setRecording)
+
+        resetButton = QtW.QPushButton('Reset')
+        resetButton.clicked.connect(self.reset)
+
+        exportButton = QtW.QPushButton('Export trace...')
+        exportButton.clicked.connect(self.exportTrace)
+
+        buttonLayout = QtW.QHBoxLayout()
+        buttonLayout.addWidget(self.recordCheckBox)
+        buttonLayout.addStretch()
+        buttonLayout.addWidget(resetButton)
+        buttonLayout.addWidget(exportButton)
+
+        self.spanTable = QtW.QTableWidget(0, 5)
+        self.spanTable.setHorizontalHeaderLabels(['Span', 'Count', 'Total (ms)', 'Mean (ms)', 'Longest (ms)'])
+        self.spanTable.setEditTriggers(QtW.QAbstractItemView.NoEditTriggers)
+        self.spanTable.verticalHeader().hide()
+        self.spanTable.horizontalHeader().setSectionResizeMode(0, QtW.QHeaderView.Stretch)
+
+        self.counterTable = QtW.QTableWidget(0, 2)
+        self.counterTable.setHorizontalHeaderLabels(['Counter', 'Value'])
+        self.counterTable.setEditTriggers(QtW.QAbstractItemView.NoEditTriggers)
+        self.counterTable.verticalHeader().hide()
+        self.counterTable.horizontalHeader().setSectionResizeMode(0, QtW.QHeaderView.Stretch)
+
+        splitter = QtW.QSplitter(QtC.Qt.Vertical)
+        splitter.addWidget(self.spanTable)
+        splitter.addWidget(self.counterTable)
+
+        layout = QtW.QVBoxLayout()
+        layout.addLayout(buttonLayout)
+        layout.addWidget(splitter)
+
+        contents = QtW.QWidget()
+        contents.setLayout(layout)
+        self.setWidget(contents)
+
+        self.refreshTimer = QtC.QTimer(self)
+        self.refreshTimer.setInterval(refreshInterval)
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.updateTimer)
+
+    def setRecording(self, recording : bool) -> None:
+        profiler.enabled = recording
+
+    def updateTimer(self, visible : bool) -> None:
+        if visible:
+            self.refresh()
+            self.refreshTimer.start()
+        else:
+            self.refreshTimer.stop()
+
+    def reset(self) -> None:
+        profiler.reset()
+        self.refresh()
+
+    def refresh(self) -> None:
+        spans = profiler.spanSummary()
+        self.spanTable.setRowCount(len(spans))
+        for (row, (name, count, totalMs, longestMs)) in enumerate(spans):
+            values = [name, str(count), f'{totalMs:.1f}', f'{totalMs / count:.2f}', f'{longestMs:.2f}']
+            for (column, value) in enumerate(values):
+                self.spanTable.setItem(row, column, QtW.QTableWidgetItem(value))
+
+        counters = profiler.counterSummary()
+        self.counterTable.setRowCount(len(counters))
+        for (row, (name, total)) in enumerate(counters):
+            self.counterTable.setItem(row, 0, QtW.QTableWidgetItem(name))
+            self.counterTable.setItem(row, 1, QtW.QTableWidgetItem(str(total)))
+
+    def exportTrace(self) -> None:
+        (tracePath, _filter) = QtW.QFileDialog.getSaveFileName(self, 'Export trace', 'trace.json', 'Chrome trace (*.json)')
+        if tracePath == '':
+            return
+
+        try:
+            profiler.writeChromeTrace(tracePath)
+        except OSError as error:
+            QtW.QMessageBox.warning(self, 'Could not export trace', f'{tracePath} could not be written: {error}')
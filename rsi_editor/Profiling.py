@@ -0,0 +1,159 @@
+# Timing of the editor's slow paths, for finding out where time goes
+
+# Code is timed in named spans, and things worth counting (thumbnails drawn,
+# cache hits...) are counted in named counters. Both are only recorded while
+# the profiler is enabled - from the profiler panel, or by setting the
+# RSI_EDITOR_PROFILE environment variable to record from startup - and cost
+# next to nothing otherwise, so spans can be left around hot paths like model
+# data() calls.
+#
+# The profiler keeps a total for each span and counter, for the profiler panel,
+# and the most recent events, which can be written out as a Chrome trace (open
+# it in chrome://tracing or https://ui.perfetto.dev) to see them on a timeline.
+
+from __future__ import annotations
+
+from collections import deque
+import functools
+import json
+import os
+import threading
+import time
+
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+# Events kept for traces - older ones are dropped
+defaultMaxEvents = 200000
+
+# (name, times run, total milliseconds, longest milliseconds)
+SpanSummary = Tuple[str, int, float, float]
+
+class SpanStats():
+    def __init__(self):
+        self.count = 0
+        self.totalNs = 0
+        self.maxNs = 0
+
+class Span():
+    def __init__(self, profiler : Profiler, name : str, args : Optional[Dict[str, Any]]):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self) -> Span:
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_exception : object) -> None:
+        self.profiler.record(self.name, self.start, time.perf_counter_ns(), self.args)
+
+# What span() returns while the profiler is disabled
+class NullSpan():
+    def __enter__(self) -> NullSpan:
+        return self
+
+    def __exit__(self, *_exception : object) -> None:
+        pass
+
+nullSpan = NullSpan()
+
+class Profiler():
+    def __init__(self, maxEvents : int = defaultMaxEvents):
+        self.enabled = False
+
+        # Spans can be recorded from worker threads
+        self.lock = threading.Lock()
+
+        # Chrome trace events, in the order they finished
+        self.events : Deque[Dict[str, Any]] = deque(maxlen=maxEvents)
+        self.spans : Dict[str, SpanStats] = {}
+        self.counters : Dict[str, int] = {}
+
+        # Trace timestamps are relative to this
+        self.origin = time.perf_counter_ns()
+
+    def span(self, name : str, args : Optional[Dict[str, Any]] = None) -> Any:
+        if not self.enabled:
+            return nullSpan
+        return Span(self, name, args)
+
+    def record(self, name : str, start : int, end : int, args : Optional[Dict[str, Any]] = None) -> None:
+        event : Dict[str, Any] = {
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.origin) / 1000,
+            'dur': (end - start) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if args is not None:
+            event['args'] = args
+
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.totalNs += end - start
+            stats.maxNs = max(stats.maxNs, end - start)
+
+            self.events.append(event)
+
+    def count(self, name : str, amount : int = 1) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            value = self.counters[name] = self.counters.get(name, 0) + amount
+            self.events.append({
+                'name': name,
+                'ph': 'C',
+                'ts': (time.perf_counter_ns() - self.origin) / 1000,
+                'pid': os.getpid(),
+                'args': { 'value': value },
+            })
+
+    def reset(self) -> None:
+        with self.lock:
+            self.events.clear()
+            self.spans.clear()
+            self.counters.clear()
+
+    # Spans, slowest in total first
+    def spanSummary(self) -> List[SpanSummary]:
+        with self.lock:
+            summary = [(name, stats.count, stats.totalNs / 1e6, stats.maxNs / 1e6) for (name, stats) in self.spans.items()]
+
+        return sorted(summary, key=lambda span: span[2], reverse=True)
+
+    def counterSummary(self) -> List[Tuple[str, int]]:
+        with self.lock:
+            return sorted(self.counters.items())
+
+    def chromeTrace(self) -> Dict[str, Any]:
+        with self.lock:
+            events = list(self.events)
+
+        return { 'traceEvents': events, 'displayTimeUnit': 'ms' }
+
+    def writeChromeTrace(self, path : str) -> None:
+        with open(path, 'w') as traceFile:
+            json.dump(self.chromeTrace(), traceFile)
+
+profiler = Profiler()
+profiler.enabled = os.environ.get('RSI_EDITOR_PROFILE', '') != ''
+
+Function = TypeVar('Function', bound=Callable[..., Any])
+
+# Times every call of a function as a span
+def timed(name : str) -> Callable[[Function], Function]:
+    def decorate(function : Function) -> Function:
+        @functools.wraps(function)
+        def timedFunction(*args : Any, **kwargs : Any) -> Any:
+            with profiler.span(name):
+                return function(*args, **kwargs)
+
+        return timedFunction # type: ignore
+
+    return decorate
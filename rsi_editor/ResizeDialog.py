@@ -0,0 +1,59 @@
+import PySide2.QtCore as QtC
+import PySide2.QtWidgets as QtW
+
+from .RsiResize import anchors
+
+from typing import Optional, Tuple
+
+# Asks for the new size of an RSI's frames, and how to get there
+class ResizeDialog(QtW.QDialog):
+    def __init__(self, size : Tuple[int, int], parent : Optional[QtC.QObject] = None):
+        QtW.QDialog.__init__(self, parent)
+
+        self.setWindowTitle('Resize RSI')
+
+        (x, y) = size
+
+        self.xInput = QtW.QSpinBox()
+        self.xInput.setRange(1, 256)
+        self.xInput.setValue(x)
+
+        self.yInput = QtW.QSpinBox()
+        self.yInput.setRange(1, 256)
+        self.yInput.setValue(y)
+
+        self.anchorInput = QtW.QComboBox()
+        self.anchorInput.addItems([anchor.capitalize() for anchor in anchors.keys()])
+        self.anchorInput.setCurrentIndex(list(anchors.keys()).index('centre'))
+        self.anchorInput.setEnabled(False)
+
+        self.scaleButton = QtW.QRadioButton('Scale frames (nearest neighbour)')
+        self.scaleButton.setChecked(True)
+        self.canvasButton = QtW.QRadioButton('Pad or crop frames')
+        self.canvasButton.toggled.connect(lambda checked: self.anchorInput.setEnabled(checked))
+
+        formLayout = QtW.QFormLayout()
+        formLayout.addRow("Width:", self.xInput)
+        formLayout.addRow("Height:", self.yInput)
+        formLayout.addRow(self.scaleButton)
+        formLayout.addRow(self.canvasButton)
+        formLayout.addRow("Anchor:", self.anchorInput)
+
+        buttons = QtW.QDialogButtonBox(QtW.QDialogButtonBox.Ok | QtW.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        overallLayout = QtW.QVBoxLayout()
+        overallLayout.addLayout(formLayout)
+        overallLayout.addWidget(buttons)
+
+        self.setLayout(overallLayout)
+
+    # ((x, y), mode, anchor), or None if cancelled
+    def resize(self) -> Optional[Tuple[Tuple[int, int], str, str]]:
+        if self.exec() != QtW.QDialog.Accepted:
+            return None
+
+        mode = 'scale' if self.scaleButton.isChecked() else 'canvas'
+        anchor = list(anchors.keys())[self.anchorInput.currentIndex()]
+        return ((self.xInput.value(), self.yInput.value()), mode, anchor)
@@ -1,16 +1,27 @@
 from __future__ import annotations
 
 from collections import OrderedDict
+from contextlib import contextmanager
+import weakref
+from weakref import WeakValueDictionary
 
 import PySide2.QtCore as QtC
 import PySide2.QtGui as QtG
 
 import PIL as PIL # type: ignore
-import PIL.ImageQt as PILQt # type: ignore
 
 import rsi as RSIPy
 
-from typing import Dict, List, Optional
+from .ContentHash import imageHash
+from .FrameCache import FrameCache
+from .PngOptimiser import PngOptimiser
+from .Profiling import profiler, timed
+from .RsiFiles import encodePng, recoverInterruptedSave, writeRsi, writeRsiStaged
+from .StateNameIndex import StateNameIndex
+from .StateTransfer import StateTransfer, stateMimeData, stateMimeType, statesFromMimeData
+from .ThumbnailCache import ThumbnailCache, ThumbnailPack, renderThumbnail
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 # TODO: Have this be configured by zooming in and out
 iconSize = QtC.QSize(100, 100)
@@ -19,20 +30,78 @@ iconSize = QtC.QSize(100, 100)
 class Rsi(QtC.QAbstractListModel):
     stateRenamed = QtC.Signal(str, str)
 
+    # Really QtC.Signal(StateTransfer), like stateRenamed this is for the
+    # editor to add the states through the undo stack
+    statesDropped = QtC.Signal(object)
+
     licenseChanged = QtC.Signal()
+    sizeChanged = QtC.Signal()
     copyrightChanged = QtC.Signal()
 
     # Constructors
-    def __init__(self, rsi : RSIPy.Rsi, parent : Optional[QtC.QObject] =None):
+    def __init__(self, rsi : RSIPy.Rsi, parent : Optional[QtC.QObject] =None, mappedFrames : Optional[List[Tuple[PIL.Image.Image, str]]] = None):
         QtC.QAbstractListModel.__init__(self, parent)
         self.states = OrderedDict(rsi.states.items())
         self.size = rsi.size
         self.license = rsi.license
         self.copyright = rsi.copyright
 
-    def fromFile(rsiPath : str) -> Rsi:
-        return Rsi(RSIPy.Rsi.open(rsiPath))
-
+        # Identical frames are shared between every state that uses them. Frames
+        # are never edited in place (edits always replace the image), so sharing
+        # them is safe
+        self.framePool : WeakValueDictionary[str, PIL.Image.Image] = WeakValueDictionary()
+        self.frameHashes : Dict[int, Tuple[weakref.ref, str]] = {}
+
+        # Frames which are views of a FrameCache pack rather than held in
+        # memory, along with their hashes from the pack
+        self.mappedFrames : Dict[int, weakref.ref] = {}
+        for (frame, frameHash) in mappedFrames or []:
+            self.rememberHash(frame, frameHash)
+            self.markMapped(frame)
+
+        self.deduplicateFrames()
+
+        # What has been changed since the RSI was last loaded or saved, so that
+        # changes made on disk can be merged with unsaved ones
+        self.modifiedStates : Set[str] = set()
+        self.metadataModified = False
+
+        # Set by the editor, which keeps one cache for the whole session
+        self.thumbnailCache : Optional[ThumbnailCache] = None
+
+        # Thumbnails stored from an earlier session, also set by the editor.
+        # A state's stored thumbnail stops being used once it's changed.
+        self.thumbnailPack : Optional[ThumbnailPack] = None
+
+        # See batchUpdate
+        self.batchDepth = 0
+        self.pendingRows : Optional[Tuple[int, int]] = None
+
+        # For filtering the state list, kept up to date as states are added,
+        # removed and renamed
+        self.nameIndex = StateNameIndex(self.states.keys())
+
+        # State names in row order and the row of each name, so rows can be
+        # looked up without walking the states. Rebuilt when next needed after
+        # states are removed or renamed
+        self.rowNames : Optional[List[str]] = None
+        self.nameRows : Dict[str, int] = {}
+
+    # Maps the frames from `frameCache` if it's given, see FrameCache
+    def fromFile(rsiPath : str, frameCache : Optional[FrameCache] = None) -> Rsi:
+        with profiler.span('Rsi.fromFile', { 'path': str(rsiPath), 'mapped': frameCache is not None }):
+            recoverInterruptedSave(rsiPath)
+
+            if frameCache is not None:
+                mapped = frameCache.openRsi(rsiPath)
+                if mapped is not None:
+                    return Rsi(mapped.rsi, mappedFrames=mapped.frames)
+
+            with profiler.span('RSIPy.Rsi.open'):
+                rsi = RSIPy.Rsi.open(rsiPath)
+            return Rsi(rsi)
+
+    @timed('Rsi.fromDmi')
     def fromDmi(dmiPath : str) -> Rsi:
         return Rsi(RSIPy.Rsi.from_dmi(dmiPath))
 
@@ -41,7 +110,12 @@ class Rsi(QtC.QAbstractListModel):
 
     # Convenience function
 
-    def save(self, path : str, jsonIndent : Optional[int]) -> bool:
+    @timed('Rsi.save')
+    def save(self, path : str, jsonIndent : Optional[int], optimiser : Optional[PngOptimiser] = None) -> bool:
+        if optimiser is not None:
+            writeRsi(path, self.size, list(self.states.values()), self.license, self.copyright, jsonIndent, optimiser.encode)
+            return True
+
         rsi = RSIPy.Rsi(self.size)
         rsi.states = self.states
         rsi.license = self.license
@@ -49,11 +123,103 @@ class Rsi(QtC.QAbstractListModel):
         rsi.write(path, indent = jsonIndent)
         return True
 
+    # Saves through a staging directory, so that the RSI on disk is never left
+    # half written. Returns how long each step of the save took, in milliseconds.
+    @timed('Rsi.saveStaged')
+    def saveStaged(self, path : str, jsonIndent : Optional[int], optimiser : Optional[PngOptimiser] = None) -> Dict[str, float]:
+        encodeSheet = optimiser.encode if optimiser is not None else encodePng
+        return writeRsiStaged(path, self.size, list(self.states.values()), self.license, self.copyright, jsonIndent, encodeSheet)
+
+    # Frame deduplication
+
+    # Returns the shared copy of an image, if an identical one is already used
+    # somewhere in the RSI
+    def internFrame(self, image : PIL.Image.Image) -> PIL.Image.Image:
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+
+        frameHash = self.frameHash(image)
+
+        existing = self.framePool.get(frameHash)
+        if existing is not None:
+            return existing
+
+        self.framePool[frameHash] = image
+        return image
+
+    # The content hash of a frame, which is only worked out once for frames in
+    # the frame pool
+    def frameHash(self, image : PIL.Image.Image) -> str:
+        known = self.frameHashes.get(id(image))
+        if known is not None and known[0]() is image:
+            return known[1]
+
+        frameHash = imageHash(image)
+        self.rememberHash(image, frameHash)
+        return frameHash
+
+    def rememberHash(self, image : PIL.Image.Image, frameHash : str) -> None:
+        # Forgotten once the frame is deleted, as its id may be reused
+        frameId = id(image)
+        self.frameHashes[frameId] = (weakref.ref(image, lambda _ref: self.frameHashes.pop(frameId, None)), frameHash)
+
+    def markMapped(self, image : PIL.Image.Image) -> None:
+        frameId = id(image)
+        self.mappedFrames[frameId] = weakref.ref(image, lambda _ref: self.mappedFrames.pop(frameId, None))
+
+    def isMapped(self, image : PIL.Image.Image) -> bool:
+        known = self.mappedFrames.get(id(image))
+        return known is not None and known() is image
+
+    def internState(self, state : RSIPy.State) -> None:
+        for icons in state.icons:
+            for (frame, icon) in enumerate(icons):
+                if icon is not None:
+                    icons[frame] = self.internFrame(icon)
+
+    @timed('Rsi.deduplicateFrames')
+    def deduplicateFrames(self) -> None:
+        for state in self.states.values():
+            self.internState(state)
+
+    # Every distinct frame used in the RSI, in state order
+    def uniqueFrames(self) -> List[PIL.Image.Image]:
+        seen = set()
+        frames = []
+
+        for state in self.states.values():
+            for icons in state.icons:
+                for icon in icons:
+                    if icon is not None and id(icon) not in seen:
+                        seen.add(id(icon))
+                        frames.append(icon)
+
+        return frames
+
+    # Change tracking
+
+    def markModified(self, stateName : str) -> None:
+        self.modifiedStates.add(stateName)
+
+        if self.thumbnailPack is not None:
+            self.thumbnailPack.discard(stateName)
+
+    def markSaved(self) -> None:
+        self.modifiedStates.clear()
+        self.metadataModified = False
+
+    # Replaces (or adds) a state with the version on disk. Unlike addState, this
+    # doesn't count as an unsaved change.
+    def reloadState(self, stateName : str, state : RSIPy.State) -> None:
+        self.addState(stateName, state)
+        self.modifiedStates.discard(stateName)
+
     # Setters - return True if the RSI is changed
 
     def setLicense(self, licenseText : Optional[str]) -> bool:
         if self.license != licenseText:
             self.license = licenseText
+            self.metadataModified = True
             self.licenseChanged.emit()
             return True
         return False
@@ -61,22 +227,38 @@ class Rsi(QtC.QAbstractListModel):
     def setCopyright(self, copyrightText : Optional[str]) -> bool:
         if self.copyright != copyrightText:
             self.copyright = copyrightText
+            self.metadataModified = True
             self.copyrightChanged.emit()
             return True
         return False
 
+    # Only changes the size the frames are meant to be - the states have to be
+    # replaced with resized ones as well
+    def setSize(self, size : Tuple[int, int]) -> bool:
+        if self.size != size:
+            self.size = size
+            self.metadataModified = True
+            self.sizeChanged.emit()
+            return True
+        return False
+
     def addState(self, stateName : str, state : Optional[RSIPy.State] = None) -> bool:
+        self.markModified(stateName)
+
         if state is not None:
+            self.internState(state)
+
             if not stateName in self.states:
                 currentFinalRow = self.rowCount(QtC.QModelIndex())
 
                 self.beginInsertRows(QtC.QModelIndex(), currentFinalRow, currentFinalRow)
                 self.states[stateName] = state
+                self.appendRowName(stateName)
                 self.endInsertRows()
             else:
                 self.states[stateName] = state
                 currentIndex = self.getStateIndex(stateName)
-                self.dataChanged.emit(currentIndex, currentIndex)
+                self.notifyDataChanged(currentIndex, currentIndex)
             return True
         else:
             if stateName in self.states:
@@ -88,6 +270,7 @@ class Rsi(QtC.QAbstractListModel):
 
             self.beginInsertRows(QtC.QModelIndex(), currentFinalRow, currentFinalRow)
             self.states[stateName] = state
+            self.appendRowName(stateName)
             self.endInsertRows()
 
             return True
@@ -96,10 +279,13 @@ class Rsi(QtC.QAbstractListModel):
         if not stateName in self.states:
             return None
 
+        self.markModified(stateName)
         currentRow = self.getStateIndex(stateName).row()
 
         self.beginRemoveRows(QtC.QModelIndex(), currentRow, currentRow)
         state = self.states.pop(stateName)
+        self.nameIndex.remove(stateName)
+        self.rowNames = None
         self.endRemoveRows()
 
         return state
@@ -120,41 +306,102 @@ class Rsi(QtC.QAbstractListModel):
             return False
 
         if oldStateName != newStateName:
+            self.markModified(oldStateName)
+            self.markModified(newStateName)
+
             newRow = self.rowCount(QtC.QModelIndex()) - 1
             currentRow = self.getStateIndex(oldStateName).row()
 
             # If not the case, the row won't move, and endMoveRows() will actually
-            # segfault
+            # segfault. The destination is the row the state goes before, which
+            # for the end is one past the last row
             if currentRow != newRow:
-                self.beginMoveRows(QtC.QModelIndex(), currentRow, currentRow, QtC.QModelIndex(), newRow)
+                self.beginMoveRows(QtC.QModelIndex(), currentRow, currentRow, QtC.QModelIndex(), newRow + 1)
 
             state = self.states[oldStateName]
             self.states.pop(oldStateName)
             state.name = newStateName
             self.states[newStateName] = state
+            self.nameIndex.rename(oldStateName, newStateName)
+            self.rowNames = None
 
             if currentRow != newRow:
                 self.endMoveRows()
-            else:
-                newIndex = self.getStateIndex(newStateName)
-                self.dataChanged.emit(newIndex, newIndex)
+
+            newIndex = self.getStateIndex(newStateName)
+            self.notifyDataChanged(newIndex, newIndex)
             
             return True
         return False
 
+    # Batching changes
+
+    # Within a batch, changed states are reported with a single dataChanged
+    # covering all of them when the (outermost) batch ends, rather than one per
+    # state. See also State.batchUpdate.
+    @contextmanager
+    def batchUpdate(self) -> Iterator[None]:
+        self.batchDepth += 1
+        try:
+            yield
+        finally:
+            self.batchDepth -= 1
+            if self.batchDepth == 0:
+                self.flushBatch()
+
+    def notifyDataChanged(self, topLeft : QtC.QModelIndex, bottomRight : QtC.QModelIndex) -> None:
+        if self.batchDepth == 0:
+            self.dataChanged.emit(topLeft, bottomRight)
+            return
+
+        rows = (topLeft.row(), bottomRight.row())
+        if self.pendingRows is not None:
+            rows = (min(rows[0], self.pendingRows[0]), max(rows[1], self.pendingRows[1]))
+        self.pendingRows = rows
+
+    def flushBatch(self) -> None:
+        if self.pendingRows is None:
+            return
+
+        (top, bottom) = self.pendingRows
+        self.pendingRows = None
+
+        # Rows may have been removed since the change
+        bottom = min(bottom, self.rowCount() - 1)
+        if top <= bottom:
+            self.dataChanged.emit(self.index(top), self.index(bottom))
+
     # Model methods
 
     def rowCount(self, _parent : QtC.QModelIndex = QtC.QModelIndex()) -> int:
         return len(self.states)
 
+    def rowOrder(self) -> List[str]:
+        if self.rowNames is None:
+            self.rowNames = list(self.states.keys())
+            self.nameRows = { name: row for (row, name) in enumerate(self.rowNames) }
+        return self.rowNames
+
+    def stateName(self, row : int) -> str:
+        return self.rowOrder()[row]
+
+    def appendRowName(self, stateName : str) -> None:
+        self.nameIndex.add(stateName)
+
+        # New states always go at the end, so there's no need to rebuild
+        if self.rowNames is not None:
+            self.nameRows[stateName] = len(self.rowNames)
+            self.rowNames.append(stateName)
+
     def getState(self, index : QtC.QModelIndex) -> RSIPy.State:
-        return list(self.states.values())[index.row()]
+        return self.states[self.stateName(index.row())]
 
     def getStateIndex(self, stateName : str) -> QtC.QModelIndex:
-        for index, name in enumerate(self.states.keys()):
-            if name == stateName:
-                return self.createIndex(index, 0)
-        return QtC.QModelIndex()
+        if stateName not in self.states:
+            return QtC.QModelIndex()
+
+        self.rowOrder()
+        return self.createIndex(self.nameRows[stateName], 0)
 
     def data(self, index : QtC.QModelIndex, role : int = QtC.Qt.DisplayRole) -> object:
         state = self.getState(index)
@@ -162,23 +409,37 @@ class Rsi(QtC.QAbstractListModel):
         if role == QtC.Qt.DisplayRole or role == QtC.Qt.EditRole:
             return state.name
         if role == QtC.Qt.DecorationRole:
+            with profiler.span('Rsi.thumbnail'):
+                if self.thumbnailCache is not None and self.thumbnailPack is not None and self.thumbnailPack.has(state.name):
+                    return self.thumbnailCache.storedIcon(self.thumbnailPack, state.name)
 
-            if len(state.icons[0]) == 0:
-                image = PIL.Image.new('RGBA', self.size)
-            else:
-                image = state.icons[0][0]
+                image = self.thumbnailFrame(state)
 
-            statePixmap = QtG.QPixmap.fromImage(PILQt.ImageQt(image))
-            statePixmap = statePixmap.scaled(iconSize)
-            stateIcon = QtG.QIcon(statePixmap)
+                if self.thumbnailCache is not None:
+                    return self.thumbnailCache.icon(self.frameHash(image), image, iconSize)
 
-            return stateIcon
+                return QtG.QIcon(renderThumbnail(image, iconSize))
 
         return None
 
-    def flags(self, _index : QtC.QModelIndex) -> QtC.Qt.ItemFlags:
+    # The frame a state's thumbnail shows
+    def thumbnailFrame(self, state : RSIPy.State) -> PIL.Image.Image:
+        if len(state.icons[0]) == 0:
+            return PIL.Image.new('RGBA', self.size)
+        return state.icons[0][0]
+
+    # The frames shown by the thumbnails of states which are as they are on
+    # disk, for storing them - see ThumbnailCache.savePack
+    def thumbnailFrames(self) -> Dict[str, PIL.Image.Image]:
+        return { name: self.thumbnailFrame(state) for (name, state) in self.states.items() if name not in self.modifiedStates }
+
+    def flags(self, index : QtC.QModelIndex) -> QtC.Qt.ItemFlags:
+        # States are dropped onto the list as a whole, rather than a state
+        if not index.isValid():
+            return QtC.Qt.ItemIsDropEnabled
+
         # All states have the same flags
-        return QtC.Qt.ItemIsSelectable | QtC.Qt.ItemIsEditable | QtC.Qt.ItemIsEnabled | QtC.Qt.ItemNeverHasChildren
+        return QtC.Qt.ItemIsSelectable | QtC.Qt.ItemIsEditable | QtC.Qt.ItemIsEnabled | QtC.Qt.ItemNeverHasChildren | QtC.Qt.ItemIsDragEnabled
 
     # setData is intercepted to produce something on the undo stack and also
     # fix other data
@@ -193,6 +454,35 @@ class Rsi(QtC.QAbstractListModel):
             return True
         return False
 
+    # Dragging and dropping states
+
+    def mimeTypes(self) -> List[str]:
+        return [stateMimeType]
+
+    def mimeData(self, indexes : List[QtC.QModelIndex]) -> QtC.QMimeData:
+        rows = sorted({ index.row() for index in indexes if index.isValid() })
+        return stateMimeData(self.size, [self.states[self.stateName(row)] for row in rows], self)
+
+    def supportedDragActions(self) -> QtC.Qt.DropActions:
+        return QtC.Qt.CopyAction
+
+    def supportedDropActions(self) -> QtC.Qt.DropActions:
+        return QtC.Qt.CopyAction
+
+    def dropMimeData(self, data : QtC.QMimeData, action : QtC.Qt.DropAction, _row : int, _column : int, _parent : QtC.QModelIndex) -> bool:
+        if action != QtC.Qt.CopyAction:
+            return False
+
+        transfer = statesFromMimeData(data)
+
+        # Dragging states around the list they came from just moves them
+        # around the view
+        if transfer is None or transfer.source is self:
+            return False
+
+        self.statesDropped.emit(transfer)
+        return True
+
     # No header data right now
 
 
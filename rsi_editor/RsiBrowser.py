@@ -0,0 +1,211 @@
+import io
+
+import PySide2.QtCore as QtC
+import PySide2.QtGui as QtG
+import PySide2.QtWidgets as QtW
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+from .ContentHash import imageHash
+from .RsiFiles import statePath
+from .StateIndex import StateEntry, StateIndex, StateMatch
+from .ThumbnailCache import ThumbnailCache
+
+from typing import Dict, List, Optional, Tuple
+
+browserIconSize = QtC.QSize(32, 32)
+
+# Search results, with thumbnails loaded as they're shown
+class StateMatchModel(QtC.QAbstractListModel):
+    def __init__(self, index : StateIndex, thumbnailCache : ThumbnailCache, parent : Optional[QtC.QObject] = None):
+        QtC.QAbstractListModel.__init__(self, parent)
+
+        self.stateIndex = index
+        self.thumbnailCache = thumbnailCache
+        self.matches : List[StateMatch] = []
+
+        # (rsi path, state name) -> thumbnail, or None if the sheet couldn't be read
+        self.thumbnails : Dict[Tuple[str, str], Optional[QtG.QIcon]] = {}
+
+    def setIndex(self, index : StateIndex) -> None:
+        self.stateIndex = index
+        self.thumbnails = {}
+
+    def setMatches(self, matches : List[StateMatch]) -> None:
+        self.beginResetModel()
+        self.matches = matches
+        self.endResetModel()
+
+    def rowCount(self, _parent : QtC.QModelIndex = QtC.QModelIndex()) -> int:
+        return len(self.matches)
+
+    def data(self, index : QtC.QModelIndex, role : int = QtC.Qt.DisplayRole) -> object:
+        if not index.isValid() or index.row() >= len(self.matches):
+            return None
+
+        state = self.matches[index.row()].state
+
+        if role == QtC.Qt.DisplayRole:
+            return f'{state.name}  ({state.rsiPath})'
+        if role == QtC.Qt.ToolTipRole:
+            rsi = self.stateIndex.rsis[state.rsiPath]
+            (x, y) = rsi['size']
+            return f'{x}x{y}, {state.directions} directions, {state.frames} frames\nLicense: {rsi.get("license") or "none"}'
+        if role == QtC.Qt.DecorationRole:
+            return self.thumbnail(state)
+        return None
+
+    def thumbnail(self, state : StateEntry) -> Optional[QtG.QIcon]:
+        key = (state.rsiPath, state.name)
+        if key not in self.thumbnails:
+            try:
+                image = self.thumbnailImage(state)
+                self.thumbnails[key] = self.thumbnailCache.icon(imageHash(image), image, browserIconSize)
+            except OSError:
+                self.thumbnails[key] = None
+
+        return self.thumbnails[key]
+
+    # The state's first frame at the size it's shown at - from the index if
+    # it's there, otherwise read from the sheet and added to the index
+    def thumbnailImage(self, state : StateEntry) -> PIL.Image.Image:
+        sheetPath = statePath(self.stateIndex.rsiPath(state), state.name)
+        sheetMtime = sheetPath.stat().st_mtime_ns
+
+        png = self.stateIndex.thumbnail(state, sheetMtime)
+        if png is not None:
+            with PIL.Image.open(io.BytesIO(png)) as stored:
+                return stored.convert('RGBA')
+
+        (x, y) = self.stateIndex.rsis[state.rsiPath]['size']
+        with PIL.Image.open(sheetPath) as sheet:
+            # Only the first frame is converted, not the whole sheet
+            frame = sheet.crop((0, 0, x, y)).convert('RGBA')
+        image = frame.resize((browserIconSize.width(), browserIconSize.height()), PIL.Image.NEAREST)
+
+        encoded = io.BytesIO()
+        image.save(encoded, format='PNG')
+        self.stateIndex.setThumbnail(state, sheetMtime, encoded.getvalue())
+
+        return image
+
+    def match(self, index : QtC.QModelIndex) -> StateMatch:
+        return self.matches[index.row()]
+
+# Finds states across a whole tree of RSIs, using a StateIndex kept in the root
+# of the tree
+class RsiBrowser(QtW.QDialog):
+    # (path of the RSI, state name)
+    stateChosen = QtC.Signal(str, str)
+
+    # The root of the tree, when a different one is chosen
+    rootChanged = QtC.Signal(str)
+
+    def __init__(self, root : str, thumbnailCache : ThumbnailCache, parent : Optional[QtC.QObject] = None):
+        QtW.QDialog.__init__(self, parent)
+
+        self.setWindowTitle('Browse RSIs')
+        self.setSizeGripEnabled(True)
+
+        self.stateIndex = StateIndex(root)
+        self.results = StateMatchModel(self.stateIndex, thumbnailCache, self)
+
+        self.rootInput = QtW.QLineEdit()
+        self.rootInput.setReadOnly(True)
+
+        chooseButton = QtW.QPushButton('Choose...')
+        chooseButton.clicked.connect(lambda _checked: self.chooseRoot())
+
+        rescanButton = QtW.QPushButton('Rescan')
+        rescanButton.clicked.connect(lambda _checked: self.rescan())
+
+        rootLayout = QtW.QHBoxLayout()
+        rootLayout.addWidget(self.rootInput)
+        rootLayout.addWidget(chooseButton)
+        rootLayout.addWidget(rescanButton)
+
+        self.resultList = QtW.QListView()
+        self.resultList.setModel(self.results)
+        self.resultList.setIconSize(browserIconSize)
+        self.resultList.setUniformItemSizes(True)
+        self.resultList.activated.connect(self.chooseState)
+
+        self.searchInput = QtW.QLineEdit()
+        self.searchInput.setPlaceholderText('Search states')
+        self.searchInput.setClearButtonEnabled(True)
+        self.searchInput.textChanged.connect(lambda _text: self.search())
+        self.searchInput.returnPressed.connect(lambda: self.chooseState(self.resultList.currentIndex()))
+
+        self.statusLabel = QtW.QLabel()
+
+        overallLayout = QtW.QVBoxLayout()
+        overallLayout.addLayout(rootLayout)
+        overallLayout.addWidget(self.searchInput)
+        overallLayout.addWidget(self.resultList)
+        overallLayout.addWidget(self.statusLabel)
+
+        self.setLayout(overallLayout)
+        self.resize(500, 600)
+
+        if root != '':
+            self.setRoot(root)
+
+    def setRoot(self, root : str) -> None:
+        self.rootInput.setText(root)
+        self.stateIndex = StateIndex.load(root)
+        self.results.setIndex(self.stateIndex)
+        self.rescan()
+
+    def chooseRoot(self) -> None:
+        root = QtW.QFileDialog.getExistingDirectory(self, 'Choose a directory of RSIs')
+
+        if root == '':
+            return
+
+        self.setRoot(root)
+        self.rootChanged.emit(root)
+
+    # Rereads any metadata which has changed since the index was last updated
+    def rescan(self) -> None:
+        QtW.QApplication.setOverrideCursor(QtC.Qt.WaitCursor)
+        try:
+            reread = self.stateIndex.update()
+        finally:
+            QtW.QApplication.restoreOverrideCursor()
+
+        if reread != 0:
+            self.saveIndex()
+
+        # Sheets may have changed along with the metadata
+        self.results.setIndex(self.stateIndex)
+
+        self.statusLabel.setText(f'{len(self.stateIndex.rsis)} RSIs, {len(self.stateIndex.states)} states ({reread} RSIs reread)')
+        self.search()
+
+    def saveIndex(self) -> None:
+        try:
+            self.stateIndex.save()
+        except OSError:
+            # The index still works, it'll just be rebuilt next time
+            pass
+
+    # Keeps the thumbnails made while the browser was shown
+    def hideEvent(self, event : QtG.QHideEvent) -> None:
+        if self.stateIndex.thumbnailsChanged:
+            self.saveIndex()
+
+        QtW.QDialog.hideEvent(self, event)
+
+    def search(self) -> None:
+        self.results.setMatches(self.stateIndex.search(self.searchInput.text()))
+
+        if self.results.rowCount() != 0:
+            self.resultList.setCurrentIndex(self.results.index(0))
+
+    def chooseState(self, index : QtC.QModelIndex) -> None:
+        if not index.isValid():
+            return
+
+        state = self.results.match(index).state
+        self.stateChosen.emit(str(self.stateIndex.rsiPath(state)), state.name)
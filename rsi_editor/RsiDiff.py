@@ -0,0 +1,373 @@
+# Compares two versions of an RSI state by state and frame by frame
+
+# Frames (and whole states) are compared by content hash first, so only frames
+# which actually changed are compared pixel by pixel. The result can be printed,
+# written out as JSON, or rendered as an image showing the old and new version
+# of every changed frame next to a highlight of the pixels which changed.
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+import PIL.ImageDraw # type: ignore
+import PIL.ImageFont # type: ignore
+
+import rsi as RSIPy
+
+from .ContentHash import fileHash, imageHash, stateHash
+from .RsiFiles import directionNames, metadataFileName
+
+from typing import Any, Dict, List, Optional, Tuple
+
+class FrameDiff():
+    def __init__(self, direction : int, frame : int, old : Optional[PIL.Image.Image], new : Optional[PIL.Image.Image],
+            changedPixels : int, bounds : Optional[Tuple[int, int, int, int]]):
+        self.direction = direction
+        self.frame = frame
+        # None if the frame was added or removed
+        self.old = old
+        self.new = new
+        self.changedPixels = changedPixels
+        # (left, top, right, bottom) of the changed pixels
+        self.bounds = bounds
+
+    def toJson(self) -> Dict[str, Any]:
+        return {
+            'direction': self.direction,
+            'frame': self.frame,
+            'added': self.old is None,
+            'removed': self.new is None,
+            'changedPixels': self.changedPixels,
+            'bounds': self.bounds,
+        }
+
+class StateDiff():
+    # `kind` is one of 'added', 'removed', 'renamed' or 'changed'
+    def __init__(self, kind : str, name : str, oldName : Optional[str] = None):
+        self.kind = kind
+        self.name = name
+        self.oldName = oldName
+
+        self.oldDirections : Optional[int] = None
+        self.newDirections : Optional[int] = None
+        self.flagsChanged = False
+        # (direction, frame, old delay, new delay) - None for added or removed
+        # frames
+        self.delayChanges : List[Tuple[int, int, Optional[float], Optional[float]]] = []
+        self.frames : List[FrameDiff] = []
+
+    def describe(self) -> List[str]:
+        if self.kind == 'added':
+            return [f'added state {self.name}']
+        if self.kind == 'removed':
+            return [f'removed state {self.name}']
+
+        lines = []
+        if self.kind == 'renamed':
+            lines.append(f'renamed state {self.oldName} to {self.name}')
+        else:
+            lines.append(f'changed state {self.name}')
+
+        if self.oldDirections != self.newDirections:
+            lines.append(f'    directions: {self.oldDirections} -> {self.newDirections}')
+        if self.flagsChanged:
+            lines.append('    flags changed')
+        for (direction, frame, oldDelay, newDelay) in self.delayChanges:
+            if oldDelay is not None and newDelay is not None:
+                lines.append(f'    {directionName(direction)} frame {frame}: delay {oldDelay} -> {newDelay}')
+        for frameDiff in self.frames:
+            if frameDiff.old is None:
+                lines.append(f'    {directionName(frameDiff.direction)} frame {frameDiff.frame}: added')
+            elif frameDiff.new is None:
+                lines.append(f'    {directionName(frameDiff.direction)} frame {frameDiff.frame}: removed')
+            else:
+                lines.append(f'    {directionName(frameDiff.direction)} frame {frameDiff.frame}: {frameDiff.changedPixels} pixels changed')
+
+        return lines
+
+    def toJson(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'oldName': self.oldName,
+            'oldDirections': self.oldDirections,
+            'newDirections': self.newDirections,
+            'flagsChanged': self.flagsChanged,
+            'delayChanges': [list(change) for change in self.delayChanges],
+            'frames': [frameDiff.toJson() for frameDiff in self.frames],
+        }
+
+class RsiDiff():
+    def __init__(self, oldSize : Tuple[int, int], newSize : Tuple[int, int]):
+        self.oldSize = oldSize
+        self.newSize = newSize
+        self.licenseChanged = False
+        self.copyrightChanged = False
+        self.states : List[StateDiff] = []
+
+    def isEmpty(self) -> bool:
+        return self.oldSize == self.newSize and not self.licenseChanged and not self.copyrightChanged and len(self.states) == 0
+
+    def describe(self) -> List[str]:
+        lines = []
+        if self.oldSize != self.newSize:
+            lines.append(f'size: {self.oldSize[0]}x{self.oldSize[1]} -> {self.newSize[0]}x{self.newSize[1]}')
+        if self.licenseChanged:
+            lines.append('license changed')
+        if self.copyrightChanged:
+            lines.append('copyright changed')
+        for stateDiff in self.states:
+            lines.extend(stateDiff.describe())
+        return lines
+
+    def toJson(self) -> Dict[str, Any]:
+        return {
+            'oldSize': list(self.oldSize),
+            'newSize': list(self.newSize),
+            'licenseChanged': self.licenseChanged,
+            'copyrightChanged': self.copyrightChanged,
+            'states': [stateDiff.toJson() for stateDiff in self.states],
+        }
+
+def directionName(direction : int) -> str:
+    return directionNames[direction] if direction < len(directionNames) else f'direction {direction}'
+
+def frameHashes(state : RSIPy.State) -> List[List[str]]:
+    return [[imageHash(icon) for icon in icons] for icons in state.icons]
+
+# Compares two frames pixel by pixel
+def diffFrames(old : PIL.Image.Image, new : PIL.Image.Image) -> Tuple[int, Optional[Tuple[int, int, int, int]]]:
+    oldPixels = np.asarray(old.convert('RGBA') if old.mode != 'RGBA' else old)
+    newPixels = np.asarray(new.convert('RGBA') if new.mode != 'RGBA' else new)
+
+    if oldPixels.shape != newPixels.shape:
+        return (new.width * new.height, (0, 0, new.width, new.height))
+
+    changed = changedMask(oldPixels, newPixels)
+    changedCount = int(np.count_nonzero(changed))
+    if changedCount == 0:
+        return (0, None)
+
+    (ys, xs) = np.nonzero(changed)
+    return (changedCount, (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1))
+
+# Which pixels differ - fully transparent pixels are all the same, whatever
+# their colour channels hold
+def changedMask(oldPixels : np.ndarray, newPixels : np.ndarray) -> np.ndarray:
+    changed = np.any(oldPixels != newPixels, axis=2)
+    return changed & ~((oldPixels[..., 3] == 0) & (newPixels[..., 3] == 0))
+
+def diffState(stateDiff : StateDiff, old : RSIPy.State, new : RSIPy.State,
+        oldHashes : List[List[str]], newHashes : List[List[str]]) -> None:
+    stateDiff.oldDirections = old.directions
+    stateDiff.newDirections = new.directions
+    stateDiff.flagsChanged = old.flags != new.flags
+
+    for direction in range(max(old.directions, new.directions)):
+        oldIcons = old.icons[direction] if direction < old.directions else []
+        newIcons = new.icons[direction] if direction < new.directions else []
+        oldDelays = old.delays[direction] if direction < old.directions else []
+        newDelays = new.delays[direction] if direction < new.directions else []
+
+        for frame in range(max(len(oldIcons), len(newIcons))):
+            oldDelay = oldDelays[frame] if frame < len(oldDelays) else None
+            newDelay = newDelays[frame] if frame < len(newDelays) else None
+            if oldDelay != newDelay:
+                stateDiff.delayChanges.append((direction, frame, oldDelay, newDelay))
+
+            if frame >= len(oldIcons):
+                stateDiff.frames.append(FrameDiff(direction, frame, None, newIcons[frame], newIcons[frame].width * newIcons[frame].height, None))
+            elif frame >= len(newIcons):
+                stateDiff.frames.append(FrameDiff(direction, frame, oldIcons[frame], None, oldIcons[frame].width * oldIcons[frame].height, None))
+            elif oldHashes[direction][frame] != newHashes[direction][frame]:
+                (changedPixels, bounds) = diffFrames(oldIcons[frame], newIcons[frame])
+                if changedPixels != 0:
+                    stateDiff.frames.append(FrameDiff(direction, frame, oldIcons[frame], newIcons[frame], changedPixels, bounds))
+
+def diffRsis(old : RSIPy.Rsi, new : RSIPy.Rsi) -> RsiDiff:
+    diff = RsiDiff(old.size, new.size)
+    diff.licenseChanged = old.license != new.license
+    diff.copyrightChanged = old.copyright != new.copyright
+
+    # Hashing is the slow part, so every frame is hashed exactly once
+    oldHashes = { name: frameHashes(state) for name, state in old.states.items() }
+    newHashes = { name: frameHashes(state) for name, state in new.states.items() }
+    oldStateHashes = { name: stateHash(state, oldHashes[name]) for name, state in old.states.items() }
+    newStateHashes = { name: stateHash(state, newHashes[name]) for name, state in new.states.items() }
+
+    removed = [name for name in old.states.keys() if name not in new.states]
+    added = [name for name in new.states.keys() if name not in old.states]
+
+    # A removed state with exactly the same contents as an added one was renamed
+    removedByHash : Dict[str, List[str]] = {}
+    for name in removed:
+        removedByHash.setdefault(oldStateHashes[name], []).append(name)
+
+    renamed : Dict[str, str] = {}
+    for name in added:
+        candidates = removedByHash.get(newStateHashes[name], [])
+        if len(candidates) != 0:
+            renamed[name] = candidates.pop(0)
+
+    renamedFrom = set(renamed.values())
+
+    for name in sorted(set(old.states.keys()) | set(new.states.keys())):
+        if name in renamedFrom:
+            continue
+
+        if name not in new.states:
+            stateDiff = StateDiff('removed', name)
+            diffState(stateDiff, old.states[name], RSIPy.State(name, old.size, 0), oldHashes[name], [])
+            diff.states.append(stateDiff)
+        elif name in renamed:
+            stateDiff = StateDiff('renamed', name, renamed[name])
+            diffState(stateDiff, old.states[renamed[name]], new.states[name], oldHashes[renamed[name]], newHashes[name])
+            diff.states.append(stateDiff)
+        elif name not in old.states:
+            stateDiff = StateDiff('added', name)
+            diffState(stateDiff, RSIPy.State(name, new.size, 0), new.states[name], [], newHashes[name])
+            diff.states.append(stateDiff)
+        elif oldStateHashes[name] != newStateHashes[name] or old.states[name].flags != new.states[name].flags:
+            stateDiff = StateDiff('changed', name)
+            diffState(stateDiff, old.states[name], new.states[name], oldHashes[name], newHashes[name])
+            diff.states.append(stateDiff)
+
+    return diff
+
+# Rendering
+
+highlightColour = np.array([255, 0, 255], dtype=np.uint8)
+labelWidth = 160
+labelColour = (0, 0, 0)
+backgroundColour = (255, 255, 255)
+
+def framePixels(frame : Optional[PIL.Image.Image], size : Tuple[int, int]) -> np.ndarray:
+    if frame is None or frame.size != size:
+        return np.zeros((size[1], size[0], 4), dtype=np.uint8)
+
+    return np.asarray(frame.convert('RGBA') if frame.mode != 'RGBA' else frame)
+
+# Flattens a frame onto the background colour
+def flattenFrame(pixels : np.ndarray) -> np.ndarray:
+    alpha = pixels[..., 3:].astype(np.uint16)
+    return ((pixels[..., :3] * alpha + np.asarray(backgroundColour, dtype=np.uint16) * (255 - alpha)) // 255).astype(np.uint8)
+
+# The new frame faded out, with the changed pixels drawn over it
+def highlightFrame(oldPixels : np.ndarray, newPixels : np.ndarray) -> np.ndarray:
+    faded = ((np.asarray(backgroundColour, dtype=np.uint16) * 3 + flattenFrame(newPixels)) // 4).astype(np.uint8)
+    faded[changedMask(oldPixels, newPixels)] = highlightColour
+    return faded
+
+# One row per changed frame: the old frame, the new frame, and the changes
+# highlighted, with a label saying which frame it is
+def renderDiff(diff : RsiDiff, scale : int = 2) -> Optional[PIL.Image.Image]:
+    rows : List[Tuple[str, Optional[PIL.Image.Image], Optional[PIL.Image.Image]]] = []
+    for stateDiff in diff.states:
+        for frameDiff in stateDiff.frames:
+            rows.append((f'{stateDiff.name} {directionName(frameDiff.direction)} {frameDiff.frame}', frameDiff.old, frameDiff.new))
+
+    if len(rows) == 0:
+        return None
+
+    (width, height) = diff.newSize
+    canvas = np.empty((len(rows) * height, 3 * width, 3), dtype=np.uint8)
+
+    for (row, (_label, old, new)) in enumerate(rows):
+        top = row * height
+        oldPixels = framePixels(old, diff.newSize)
+        newPixels = framePixels(new, diff.newSize)
+
+        canvas[top:top + height, 0:width] = flattenFrame(oldPixels)
+        canvas[top:top + height, width:2 * width] = flattenFrame(newPixels)
+        canvas[top:top + height, 2 * width:3 * width] = highlightFrame(oldPixels, newPixels)
+
+    frames = PIL.Image.fromarray(canvas, 'RGB')
+    if scale != 1:
+        frames = frames.resize((frames.width * scale, frames.height * scale), PIL.Image.NEAREST)
+
+    # Labels go down the left, at their normal size
+    image = PIL.Image.new('RGB', (labelWidth + frames.width, frames.height), backgroundColour)
+    image.paste(frames, (labelWidth, 0))
+
+    draw = PIL.ImageDraw.Draw(image)
+    font = PIL.ImageFont.load_default()
+    for (row, (label, _old, _new)) in enumerate(rows):
+        draw.text((2, row * height * scale + 2), label, fill=labelColour, font=font)
+
+    return image
+
+# Comparing RSIs on disk
+
+# Opened directly through RSIPy, so that nothing on disk is touched, and without
+# the editor's model, which would hash every frame again
+def openRsi(rsiPath : Path) -> RSIPy.Rsi:
+    return RSIPy.Rsi.open(str(rsiPath))
+
+# Whether two RSI directories hold exactly the same files, without loading them
+def sameFiles(oldPath : Path, newPath : Path) -> bool:
+    def rsiFiles(rsiPath : Path) -> List[str]:
+        return sorted(entry.name for entry in os.scandir(rsiPath) if entry.is_file() and (entry.name == metadataFileName or entry.name.endswith('.png')))
+
+    oldFiles = rsiFiles(oldPath)
+    if oldFiles != rsiFiles(newPath):
+        return False
+
+    return all(fileHash(str(oldPath / fileName)) == fileHash(str(newPath / fileName)) for fileName in oldFiles)
+
+# Relative path -> RSI directory, for every RSI under a directory. A single RSI
+# is given the relative path '.'.
+def findRsis(root : Path) -> Dict[str, Path]:
+    if (root / metadataFileName).is_file():
+        return { '.': root }
+
+    return { metaPath.parent.relative_to(root).as_posix(): metaPath.parent for metaPath in root.rglob(metadataFileName) }
+
+# Command line entry point. Compares two RSIs, or every RSI in two directory
+# trees (e.g. two checkouts of a repository). Like diff, returns 1 if anything
+# changed.
+def reportDiff(oldRoot : str, newRoot : str, imageFolder : str = '', asJson : bool = False) -> int:
+    oldRsis = findRsis(Path(oldRoot))
+    newRsis = findRsis(Path(newRoot))
+
+    report : Dict[str, Any] = {}
+
+    for relativePath in sorted(set(oldRsis.keys()) | set(newRsis.keys())):
+        displayPath = relativePath if relativePath != '.' else newRoot
+
+        if relativePath not in newRsis or relativePath not in oldRsis:
+            report[relativePath] = { 'added': relativePath not in oldRsis, 'removed': relativePath not in newRsis }
+            if not asJson:
+                print(f'{displayPath}: {"added" if relativePath not in oldRsis else "removed"}')
+            continue
+
+        if sameFiles(oldRsis[relativePath], newRsis[relativePath]):
+            continue
+
+        diff = diffRsis(openRsi(oldRsis[relativePath]), openRsi(newRsis[relativePath]))
+        if diff.isEmpty():
+            continue
+
+        report[relativePath] = diff.toJson()
+
+        if not asJson:
+            print(f'{displayPath}:')
+            for line in diff.describe():
+                print(f'  {line}')
+
+        if imageFolder != '':
+            image = renderDiff(diff)
+            if image is not None:
+                Path(imageFolder).mkdir(parents=True, exist_ok=True)
+                imageName = 'diff' if relativePath == '.' else relativePath.replace('/', '_')
+                image.save(Path(imageFolder) / f'{imageName}.png')
+
+    if asJson:
+        print(json.dumps(report, indent=2))
+
+    return 1 if len(report) != 0 else 0
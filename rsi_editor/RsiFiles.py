@@ -0,0 +1,316 @@
+# Helpers for reading and writing the individual files that make up an RSI
+# directory
+
+# RSIPy only reads and writes RSIs as a whole. These let the editor deal with a
+# single state's sprite sheet, or just the metadata, without touching the rest
+# of the RSI. The layout matches what RSIPy reads and writes.
+
+import io
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+metadataFileName = 'meta.json'
+
+# Turns a sprite sheet into the PNG file contents to write
+SheetEncoder = Callable[[PIL.Image.Image], bytes]
+
+# The directions of a state, in the order they're stored
+directionNames = ['South', 'North', 'East', 'West', 'South East', 'South West', 'North East', 'North West']
+
+def statePath(rsiPath : Union[str, Path], stateName : str) -> Path:
+    return Path(rsiPath) / f'{stateName}.png'
+
+def readMetadata(rsiPath : Union[str, Path]) -> Dict[str, Any]:
+    with (Path(rsiPath) / metadataFileName).open() as metaFile:
+        return json.load(metaFile)
+
+def metadataSize(metadata : Dict[str, Any]) -> Tuple[int, int]:
+    return (metadata['size']['x'], metadata['size']['y'])
+
+# Metadata for each state, by name
+def metadataStates(metadata : Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    return { stateMeta['name']: stateMeta for stateMeta in metadata.get('states', []) }
+
+# Loads a single state from its sprite sheet. `stateMeta` is the state's entry
+# in the metadata's state list.
+def loadState(rsiPath : Union[str, Path], stateMeta : Dict[str, Any], size : Tuple[int, int]) -> RSIPy.State:
+    with PIL.Image.open(statePath(rsiPath, stateMeta['name'])) as sheet:
+        sheet.load()
+        sheetColumns = sheet.width // size[0]
+
+        def sheetFrame(frameIndex : int) -> PIL.Image.Image:
+            x = (frameIndex % sheetColumns) * size[0]
+            y = (frameIndex // sheetColumns) * size[1]
+            return sheet.crop((x, y, x + size[0], y + size[1])).convert('RGBA')
+
+        return stateFromSheet(stateMeta, size, sheetFrame)
+
+# Builds a state from its metadata and the frames of its sheet, given as the
+# frame at each position of the sheet (counting along each row in turn)
+def stateFromSheet(stateMeta : Dict[str, Any], size : Tuple[int, int], sheetFrame : Callable[[int], PIL.Image.Image]) -> RSIPy.State:
+    directions = stateMeta.get('directions', 1)
+    state = RSIPy.State(stateMeta['name'], size, directions)
+
+    if 'flags' in stateMeta:
+        state.flags = stateMeta['flags']
+
+    delays = stateMeta.get('delays')
+
+    frameIndex = 0
+    for direction in range(directions):
+        frameCount = 1
+        if delays is not None and direction < len(delays) and delays[direction]:
+            frameCount = len(delays[direction])
+            state.delays[direction] = list(delays[direction])
+
+        for _frame in range(frameCount):
+            state.icons[direction].append(sheetFrame(frameIndex))
+            frameIndex += 1
+
+    return state
+
+# Writing
+
+# The metadata RSIPy would write for the given RSI contents. RSIPy sorts the
+# states by name - with `sortStates` off, they're kept in the order given.
+def rsiMetadata(size : Tuple[int, int], states : Iterable[RSIPy.State], license : Optional[str], copyright : Optional[str],
+        sortStates : bool = True) -> Dict[str, Any]:
+    metadata : Dict[str, Any] = { 'version': 1, 'size': { 'x': size[0], 'y': size[1] } }
+
+    if license is not None:
+        metadata['license'] = license
+
+    if copyright is not None:
+        metadata['copyright'] = copyright
+
+    stateList = []
+    for state in states:
+        stateMeta : Dict[str, Any] = { 'name': state.name }
+        if state.flags:
+            stateMeta['flags'] = state.flags
+        stateMeta['directions'] = state.directions
+        stateMeta['delays'] = state.delays
+        stateList.append(stateMeta)
+
+    metadata['states'] = sorted(stateList, key=lambda stateMeta: stateMeta['name']) if sortStates else stateList
+    return metadata
+
+# Lays out all of a state's frames in a sprite sheet, as square as possible
+def stateSheet(state : RSIPy.State, size : Tuple[int, int]) -> PIL.Image.Image:
+    frameCount = sum(len(icons) for icons in state.icons)
+
+    columns = max(math.ceil(math.sqrt(frameCount)), 1)
+    rows = max(math.ceil(frameCount / columns), 1)
+
+    sheet = PIL.Image.new('RGBA', (columns * size[0], rows * size[1]))
+
+    frameIndex = 0
+    for icons in state.icons:
+        for icon in icons:
+            sheet.paste(icon, ((frameIndex % columns) * size[0], (frameIndex // columns) * size[1]))
+            frameIndex += 1
+
+    return sheet
+
+def writeSynced(path : Path, contents : bytes) -> None:
+    with path.open('wb') as writtenFile:
+        writtenFile.write(contents)
+        writtenFile.flush()
+        os.fsync(writtenFile.fileno())
+
+def syncDirectory(path : Path) -> None:
+    # Not every platform can open directories to sync them (e.g. Windows)
+    try:
+        directory = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+def encodePng(sheet : PIL.Image.Image) -> bytes:
+    encoded = io.BytesIO()
+    sheet.save(encoded, format='PNG')
+    return encoded.getvalue()
+
+def writeSheet(folder : Path, state : RSIPy.State, size : Tuple[int, int], encodeSheet : SheetEncoder = encodePng, sync : bool = True) -> None:
+    contents = encodeSheet(stateSheet(state, size))
+
+    if sync:
+        writeSynced(statePath(folder, state.name), contents)
+    else:
+        statePath(folder, state.name).write_bytes(contents)
+
+# Writes every state's sheet in parallel - sheets are independent, and PIL
+# releases the GIL while encoding
+def writeSheets(folder : Path, states : List[RSIPy.State], size : Tuple[int, int], encodeSheet : SheetEncoder = encodePng, sync : bool = True) -> None:
+    with ThreadPoolExecutor() as pool:
+        for _ in pool.map(lambda state: writeSheet(folder, state, size, encodeSheet, sync), states):
+            pass
+
+# Writes an RSI in place, the same way RSIPy does, but with control over how
+# the sheets are encoded
+def writeRsi(rsiPath : Union[str, Path], size : Tuple[int, int], states : List[RSIPy.State],
+        license : Optional[str], copyright : Optional[str], indent : Optional[int], encodeSheet : SheetEncoder = encodePng) -> None:
+    rsiPath = Path(rsiPath)
+    rsiPath.mkdir(parents=True, exist_ok=True)
+
+    metadata = rsiMetadata(size, states, license, copyright)
+    (rsiPath / metadataFileName).write_text(json.dumps(metadata, indent=indent))
+
+    writeSheets(rsiPath, states, size, encodeSheet, sync=False)
+
+def stagingPath(rsiPath : Path) -> Path:
+    return rsiPath.parent / f'.{rsiPath.name}.staging-{os.getpid()}'
+
+def backupPath(rsiPath : Path) -> Path:
+    return rsiPath.parent / f'.{rsiPath.name}.old-{os.getpid()}'
+
+# Windows API values used to check on processes
+processQueryLimitedInformation = 0x1000
+errorAccessDenied = 5
+stillActive = 259
+
+# Whether the process with the given id is still running
+def processAlive(pid : int) -> bool:
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32 # type: ignore
+
+        handle = kernel32.OpenProcess(processQueryLimitedInformation, False, pid)
+        if not handle:
+            # Access is only denied to processes which exist
+            return kernel32.GetLastError() == errorAccessDenied
+
+        exitCode = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exitCode))
+        kernel32.CloseHandle(handle)
+        return exitCode.value == stillActive
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# Staging and backup directories left behind by saves which can't still be
+# running - those of this process (which only saves one RSI at a time), or of
+# processes which have exited. Another process's save may be in progress in the
+# others.
+def abandonedSaves(rsiPath : Path) -> List[Path]:
+    leftovers = []
+
+    for pattern in [f'.{rsiPath.name}.staging-*', f'.{rsiPath.name}.old-*']:
+        for leftover in rsiPath.parent.glob(pattern):
+            pid = leftover.name.rsplit('-', 1)[-1]
+            if pid.isdigit() and (int(pid) == os.getpid() or not processAlive(int(pid))):
+                leftovers.append(leftover)
+
+    return leftovers
+
+# If a staged save was interrupted between moving the old RSI out of the way
+# and moving the new one into place, finishes it off. Any staging directory left
+# behind at that point is complete, so it's preferred over the old RSI.
+# Otherwise, anything left behind by an interrupted save is cleaned up.
+def recoverInterruptedSave(rsiPath : Union[str, Path]) -> None:
+    rsiPath = Path(rsiPath).absolute()
+
+    if not rsiPath.parent.is_dir():
+        return
+
+    leftovers = abandonedSaves(rsiPath)
+
+    if rsiPath.exists():
+        for leftover in leftovers:
+            shutil.rmtree(leftover, ignore_errors=True)
+        return
+
+    # Staging directories come first
+    for leftover in leftovers:
+        if (leftover / metadataFileName).is_file():
+            os.rename(leftover, rsiPath)
+            syncDirectory(rsiPath.parent)
+            return
+
+# Writes an RSI into a staging directory next to the target, syncs it to disk,
+# and then swaps it in for the old RSI. The RSI on disk is always either the
+# complete old version or the complete new one.
+#
+# Returns how long each step took, in milliseconds.
+def writeRsiStaged(rsiPath : Union[str, Path], size : Tuple[int, int], states : List[RSIPy.State],
+        license : Optional[str], copyright : Optional[str], indent : Optional[int], encodeSheet : SheetEncoder = encodePng) -> Dict[str, float]:
+    rsiPath = Path(rsiPath).absolute()
+    timings = {}
+
+    startTime = time.perf_counter()
+
+    recoverInterruptedSave(rsiPath)
+    rsiPath.parent.mkdir(parents=True, exist_ok=True)
+
+    staging = stagingPath(rsiPath)
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+
+    # A half written staging directory is no use to anyone, so it doesn't
+    # outlive a failed write
+    try:
+        writeSheets(staging, states, size, encodeSheet)
+
+        metadata = rsiMetadata(size, states, license, copyright)
+        writeSynced(staging / metadataFileName, json.dumps(metadata, indent=indent).encode())
+
+        timings['write'] = (time.perf_counter() - startTime) * 1000
+        stepTime = time.perf_counter()
+
+        # Anything else kept in the RSI directory is carried over
+        if rsiPath.is_dir():
+            for entry in os.scandir(rsiPath):
+                if entry.is_dir():
+                    shutil.copytree(entry.path, staging / entry.name, symlinks=True)
+                elif entry.is_file() and entry.name != metadataFileName and not entry.name.endswith('.png'):
+                    shutil.copy2(entry.path, staging / entry.name)
+
+        syncDirectory(staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    timings['sync'] = (time.perf_counter() - stepTime) * 1000
+    stepTime = time.perf_counter()
+
+    if rsiPath.exists():
+        backup = backupPath(rsiPath)
+        shutil.rmtree(backup, ignore_errors=True)
+
+        os.rename(rsiPath, backup)
+        os.rename(staging, rsiPath)
+        syncDirectory(rsiPath.parent)
+
+        shutil.rmtree(backup, ignore_errors=True)
+    else:
+        os.rename(staging, rsiPath)
+        syncDirectory(rsiPath.parent)
+
+    timings['swap'] = (time.perf_counter() - stepTime) * 1000
+    timings['total'] = (time.perf_counter() - startTime) * 1000
+
+    return timings
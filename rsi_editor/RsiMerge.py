@@ -0,0 +1,242 @@
+# Three-way merges of RSIs, state by state
+
+# States are merged as a whole: a state changed on only one side takes that
+# side's version, and only states changed differently on both sides conflict.
+# The same goes for the size, license and copyright. Conflicts keep our version,
+# so the result is always a usable RSI.
+#
+# Changing the size changes every state, as every frame has to be resized. So
+# a state which doesn't fit the merged size was changed on both sides, and
+# keeps our version - if that's one of ours, the size is kept as ours as well.
+#
+# There are two ways to merge:
+#   * whole RSI directories, which only writes the sheets of states that
+#     changed in the merge
+#   * just the metadata, as a git merge driver for meta.json. Git already merges
+#     the sheets on its own (as long as only one side changed each one), so
+#     it's only the metadata that needs help.
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import rsi as RSIPy
+
+from .ContentHash import stateHash
+from .RsiFiles import metadataFileName, metadataStates, rsiMetadata, statePath, writeSheet
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# Picks the merged version of something which may have changed on either side,
+# and says whether both sides changed it differently. `key` turns a version
+# into something comparable. None stands for "doesn't exist".
+def mergeValue(base : Optional[T], ours : Optional[T], theirs : Optional[T],
+        key : Callable[[Optional[T]], Any] = lambda value: value) -> Tuple[Optional[T], bool]:
+    (baseKey, ourKey, theirKey) = (key(base), key(ours), key(theirs))
+
+    if ourKey == theirKey or theirKey == baseKey:
+        return (ours, False)
+    if ourKey == baseKey:
+        return (theirs, False)
+    return (ours, True)
+
+# The order to write merged states in: ours as they were, with the states only
+# theirs has placed after the state they follow in theirs (or first, if they're
+# first there). Keeping the authored order means a merge doesn't reorder the
+# whole metadata.
+def mergedOrder(ourNames : List[str], theirNames : List[str]) -> List[str]:
+    order = list(ourNames)
+    placed = set(order)
+
+    previous : Optional[str] = None
+    for name in theirNames:
+        if name not in placed:
+            order.insert(order.index(previous) + 1 if previous is not None else 0, name)
+            placed.add(name)
+        previous = name
+
+    return order
+
+# Merging whole RSIs
+
+def stateKey(state : Optional[RSIPy.State]) -> Optional[Tuple[str, str]]:
+    if state is None:
+        return None
+    return (stateHash(state), json.dumps(state.flags, sort_keys=True))
+
+class MergeResult():
+    def __init__(self, size : Tuple[int, int], license : Optional[str], copyright : Optional[str], states : Dict[str, RSIPy.State]):
+        self.size = size
+        self.license = license
+        self.copyright = copyright
+        self.states = states
+
+        # Names of the things which were changed on both sides ('size',
+        # 'license', 'copyright' or 'state <name>')
+        self.conflicts : List[str] = []
+
+# Whether every frame of a state is the given size
+def fitsSize(state : RSIPy.State, size : Tuple[int, int]) -> bool:
+    return all(icon.size == size for icons in state.icons for icon in icons)
+
+def mergeRsis(base : RSIPy.Rsi, ours : RSIPy.Rsi, theirs : RSIPy.Rsi) -> MergeResult:
+    (size, sizeConflict) = mergeValue(base.size, ours.size, theirs.size)
+    (license, licenseConflict) = mergeValue(base.license, ours.license, theirs.license)
+    (copyright, copyrightConflict) = mergeValue(base.copyright, ours.copyright, theirs.copyright)
+
+    # Hashing is the slow part, so each state is only hashed once
+    keys : Dict[int, Any] = {}
+    def cachedKey(state : Optional[RSIPy.State]) -> Any:
+        if state is None:
+            return None
+        if id(state) not in keys:
+            keys[id(state)] = stateKey(state)
+        return keys[id(state)]
+
+    states : Dict[str, Optional[RSIPy.State]] = {}
+    stateConflicts = set()
+
+    for name in sorted(set(base.states.keys()) | set(ours.states.keys()) | set(theirs.states.keys())):
+        (state, conflict) = mergeValue(base.states.get(name), ours.states.get(name), theirs.states.get(name), cachedKey)
+
+        states[name] = state
+        if conflict:
+            stateConflicts.add(name)
+
+    assert size is not None
+    if any(state is not None and state is ours.states.get(name) and not fitsSize(state, size) for name, state in states.items()):
+        size = ours.size
+        sizeConflict = True
+
+    for name, state in states.items():
+        if state is not None and not fitsSize(state, size):
+            states[name] = ours.states.get(name)
+            stateConflicts.add(name)
+
+    order = mergedOrder(list(ours.states.keys()), list(theirs.states.keys()))
+    orderedStates : Dict[str, RSIPy.State] = {}
+    for name in order:
+        state = states.get(name)
+        if state is not None:
+            orderedStates[name] = state
+
+    result = MergeResult(size, license, copyright, orderedStates)
+
+    for (field, conflict) in [('size', sizeConflict), ('license', licenseConflict), ('copyright', copyrightConflict)]:
+        if conflict:
+            result.conflicts.append(field)
+
+    result.conflicts += [f'state {name}' for name in sorted(stateConflicts)]
+
+    return result
+
+# The indent used by a JSON file, so that merged metadata keeps the formatting
+# it already had
+def jsonIndent(text : str) -> Optional[int]:
+    for line in text.splitlines()[1:]:
+        stripped = line.lstrip(' ')
+        if stripped != line:
+            return len(line) - len(stripped)
+    return None
+
+# Without the editor's model, which would hash every frame before merging does
+def openRsi(rsiPath : Path) -> RSIPy.Rsi:
+    return RSIPy.Rsi.open(str(rsiPath))
+
+# Merges RSI directories, writing the result over `outputPath` (usually the
+# same as `oursPath`). Only the sheets of states which differ from our version
+# are written. Returns the conflicts.
+def mergeRsiFolders(basePath : Path, oursPath : Path, theirsPath : Path, outputPath : Path) -> List[str]:
+    ours = openRsi(oursPath)
+    result = mergeRsis(openRsi(basePath), ours, openRsi(theirsPath))
+
+    if outputPath.absolute() != oursPath.absolute():
+        shutil.copytree(oursPath, outputPath, dirs_exist_ok=True)
+
+    for name, state in result.states.items():
+        if result.size != ours.size or ours.states.get(name) is not state:
+            writeSheet(outputPath, state, result.size, sync=False)
+
+    for name in ours.states.keys():
+        if name not in result.states:
+            statePath(outputPath, name).unlink(missing_ok=True)
+
+    metadataText = (oursPath / metadataFileName).read_text()
+    metadata = rsiMetadata(result.size, result.states.values(), result.license, result.copyright, sortStates=False)
+    (outputPath / metadataFileName).write_text(json.dumps(metadata, indent=jsonIndent(metadataText)))
+
+    return result.conflicts
+
+# Merging just the metadata
+
+def mergeMetadata(base : Dict[str, Any], ours : Dict[str, Any], theirs : Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    merged : Dict[str, Any] = {}
+    conflicts = []
+
+    for field in sorted(set(base.keys()) | set(ours.keys()) | set(theirs.keys())):
+        if field == 'states':
+            continue
+
+        (value, conflict) = mergeValue(base.get(field), ours.get(field), theirs.get(field))
+        if value is not None:
+            merged[field] = value
+        if conflict:
+            conflicts.append(field)
+
+    (baseStates, ourStates, theirStates) = (metadataStates(base), metadataStates(ours), metadataStates(theirs))
+
+    states = {}
+    for name in sorted(set(baseStates.keys()) | set(ourStates.keys()) | set(theirStates.keys())):
+        (stateMeta, conflict) = mergeValue(baseStates.get(name), ourStates.get(name), theirStates.get(name))
+
+        if stateMeta is not None:
+            states[name] = stateMeta
+        if conflict:
+            conflicts.append(f'state {name}')
+
+    order = mergedOrder(list(ourStates.keys()), list(theirStates.keys()))
+    merged['states'] = [states[name] for name in order if name in states]
+
+    # Keep the fields in the order our version had them
+    order = list(ours.keys())
+    merged = dict(sorted(merged.items(), key=lambda item: order.index(item[0]) if item[0] in order else len(order)))
+
+    return (merged, conflicts)
+
+# Command line entry points
+
+def printConflicts(conflicts : List[str]) -> int:
+    for conflict in conflicts:
+        print(f'Conflict: {conflict} was changed on both sides - keeping ours')
+
+    return 1 if len(conflicts) != 0 else 0
+
+def mergeCommand(basePath : str, oursPath : str, theirsPath : str, outputPath : str = '') -> int:
+    output = Path(outputPath if outputPath != '' else oursPath)
+    return printConflicts(mergeRsiFolders(Path(basePath), Path(oursPath), Path(theirsPath), output))
+
+# Run by git as `<command> %O %A %B` - the result has to be written over %A
+def mergeDriver(basePath : str, oursPath : str, theirsPath : str) -> int:
+    def readJson(path : str) -> Tuple[Dict[str, Any], str]:
+        text = Path(path).read_text()
+        return (json.loads(text) if text.strip() != '' else {}, text)
+
+    try:
+        (base, _) = readJson(basePath)
+        (ours, oursText) = readJson(oursPath)
+        (theirs, _) = readJson(theirsPath)
+    except ValueError:
+        # Not valid JSON (e.g. it already has conflict markers in it), so leave
+        # it to be resolved by hand
+        return 1
+
+    (merged, conflicts) = mergeMetadata(base, ours, theirs)
+
+    temporaryPath = Path(f'{oursPath}.merge-{os.getpid()}')
+    temporaryPath.write_text(json.dumps(merged, indent=jsonIndent(oursText)))
+    os.replace(temporaryPath, oursPath)
+
+    return printConflicts(conflicts)
@@ -0,0 +1,152 @@
+# Changing the size of every frame of an RSI at once
+
+# Frames are either scaled to the new size (nearest neighbour, so pixel art
+# stays sharp) or placed on a canvas of the new size, which pads or crops them
+# around an anchor. Both are NumPy transforms over stacks of frames, like the
+# ones in FrameTransforms. Each distinct frame is only resized once, and the
+# frames are resized in chunks on several threads (NumPy doesn't hold the GIL
+# while copying pixels), with progress reported as each chunk finishes.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from .FrameTransforms import Transform, distinctFrames, replaceFrames, transformFrames
+from .RsiDiff import findRsis
+from .RsiFiles import metadataFileName, writeRsiStaged
+from .RsiMerge import jsonIndent
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+resizeModes = ['scale', 'canvas']
+
+# Anchor name -> where the old frame goes on the new canvas, as a fraction of
+# the space left over (or cut off) in each direction
+anchors : Dict[str, Tuple[float, float]] = {
+    'top left': (0, 0),
+    'top': (0.5, 0),
+    'top right': (1, 0),
+    'left': (0, 0.5),
+    'centre': (0.5, 0.5),
+    'right': (1, 0.5),
+    'bottom left': (0, 1),
+    'bottom': (0.5, 1),
+    'bottom right': (1, 1),
+}
+
+# Frames resized by each thread at a time
+chunkSize = 256
+
+# (frames resized, total frames) -> whether to carry on
+ResizeProgress = Callable[[int, int], bool]
+
+def scaleTo(size : Tuple[int, int]) -> Transform:
+    (x, y) = size
+
+    def scaleFrames(frames : np.ndarray) -> np.ndarray:
+        (count, height, width) = frames.shape[:3]
+        rows = np.arange(y) * height // y
+        columns = np.arange(x) * width // x
+
+        # Picking whole pixels as 32 bit values is much quicker than picking
+        # each channel separately
+        pixels = frames.view(np.uint32).reshape(count, height, width)
+        scaled = np.take(np.take(pixels, rows, axis=1), columns, axis=2)
+        return scaled.view(np.uint8).reshape(count, y, x, 4)
+
+    return scaleFrames
+
+def canvasTo(size : Tuple[int, int], anchor : str) -> Transform:
+    (x, y) = size
+    (anchorX, anchorY) = anchors[anchor]
+
+    def placeFrames(frames : np.ndarray) -> np.ndarray:
+        (count, height, width) = frames.shape[:3]
+
+        # Where the old frame's top left corner goes - negative when cropping
+        left = int((x - width) * anchorX)
+        top = int((y - height) * anchorY)
+
+        canvas = np.zeros((count, y, x, 4), dtype=np.uint8)
+        (fromX, fromY) = (max(-left, 0), max(-top, 0))
+        (toX, toY) = (max(left, 0), max(top, 0))
+        (copyWidth, copyHeight) = (min(width - fromX, x - toX), min(height - fromY, y - toY))
+
+        if copyWidth > 0 and copyHeight > 0:
+            canvas[:, toY:toY + copyHeight, toX:toX + copyWidth] = frames[:, fromY:fromY + copyHeight, fromX:fromX + copyWidth]
+
+        return canvas
+
+    return placeFrames
+
+def resizeTransform(size : Tuple[int, int], mode : str, anchor : str = 'centre') -> Transform:
+    if mode == 'scale':
+        return scaleTo(size)
+    return canvasTo(size, anchor)
+
+# Resized copies of some states, or None if cancelled through `progress`
+def resizeStates(states : List[RSIPy.State], size : Tuple[int, int], transform : Transform,
+        workers : Optional[int] = None, progress : Optional[ResizeProgress] = None) -> Optional[List[RSIPy.State]]:
+    (frames, frameNumbers) = distinctFrames(states)
+    chunks = [frames[start:start + chunkSize] for start in range(0, len(frames), chunkSize)]
+    resized : List[List[PIL.Image.Image]] = [[] for _chunk in chunks]
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = { executor.submit(transformFrames, chunk, transform): number for (number, chunk) in enumerate(chunks) }
+
+        done = 0
+        for future in as_completed(futures):
+            number = futures[future]
+            resized[number] = future.result()
+            done += len(chunks[number])
+
+            if progress is not None and not progress(done, len(frames)):
+                for unfinished in futures:
+                    unfinished.cancel()
+                return None
+
+    return replaceFrames(states, size, frameNumbers, [frame for chunk in resized for frame in chunk])
+
+# Raises ValueError unless both sides are at least a pixel
+def parseSize(text : str) -> Tuple[int, int]:
+    (x, _, y) = text.partition('x')
+    size = (int(x), int(y if y != '' else x))
+
+    if min(size) < 1:
+        raise ValueError(f'{text} is smaller than a pixel')
+
+    return size
+
+# Command line entry point - resizes RSIs in place, or every RSI under some
+# directories, leaving any already at the new size alone
+def resizeRsis(paths : List[str], sizeText : str, mode : str, anchor : str, workers : Optional[int] = None) -> int:
+    try:
+        size = parseSize(sizeText)
+    except ValueError:
+        print(f'Invalid size {sizeText} - expected e.g. 64x64')
+        return 2
+
+    transform = resizeTransform(size, mode, anchor)
+
+    for root in paths:
+        for rsiPath in sorted(findRsis(Path(root)).values()):
+            rsi = RSIPy.Rsi.open(str(rsiPath))
+            if rsi.size == size:
+                continue
+
+            states = resizeStates(list(rsi.states.values()), size, transform, workers)
+            assert states is not None
+
+            indent = jsonIndent((rsiPath / metadataFileName).read_text())
+            writeRsiStaged(rsiPath, size, states, rsi.license, rsi.copyright, indent)
+
+            (oldX, oldY) = rsi.size
+            print(f'{rsiPath}: {oldX}x{oldY} -> {size[0]}x{size[1]}')
+
+    return 0
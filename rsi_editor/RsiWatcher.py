@@ -0,0 +1,180 @@
+import os
+from pathlib import Path
+
+import PySide2.QtCore as QtC
+
+from .ContentHash import fileHash
+from .RsiFiles import metadataFileName, metadataStates, readMetadata
+
+from typing import Any, Dict, List, Optional, Set
+
+# How long to wait for a burst of file changes to settle before reporting them,
+# in milliseconds. Image editors often write a file in several steps.
+settleTime = 300
+
+# Watches an RSI directory for changes made outside of the editor.
+#
+# Changes are only reported if the contents of a file actually changed, which
+# means the editor's own saves are ignored as long as remember() is called
+# after saving.
+class RsiWatcher(QtC.QObject):
+    # (names of states changed or added on disk, names of states removed on
+    # disk, whether the size/license/copyright changed)
+    filesChanged = QtC.Signal(list, list, bool)
+
+    def __init__(self, parent : Optional[QtC.QObject] = None):
+        QtC.QObject.__init__(self, parent)
+
+        self.rsiPath : Optional[Path] = None
+
+        self.watcher = QtC.QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.fileChanged)
+        self.watcher.directoryChanged.connect(lambda _path: self.directoryChanged())
+
+        self.settleTimer = QtC.QTimer(self)
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.setInterval(settleTime)
+        self.settleTimer.timeout.connect(self.reportChanges)
+
+        # File name -> hash of its contents when we last looked at it
+        self.knownHashes : Dict[str, str] = {}
+        self.pending : Set[str] = set()
+
+        # The metadata as of the last time it was read
+        self.knownMetadata : Dict[str, Any] = {}
+
+    def watch(self, rsiPath : str) -> None:
+        self.stop()
+
+        if rsiPath == '' or not os.path.isdir(rsiPath):
+            return
+
+        self.rsiPath = Path(rsiPath)
+        self.watcher.addPath(str(self.rsiPath))
+        self.remember()
+
+    def stop(self) -> None:
+        self.settleTimer.stop()
+        self.pending.clear()
+        self.knownHashes.clear()
+        self.knownMetadata = {}
+
+        watched = self.watcher.files() + self.watcher.directories()
+        if len(watched) != 0:
+            self.watcher.removePaths(watched)
+
+        self.rsiPath = None
+
+    def isWatching(self) -> bool:
+        return self.rsiPath is not None
+
+    # Takes the current contents of the RSI as the unchanged version - call this
+    # after writing to the RSI
+    def remember(self) -> None:
+        if self.rsiPath is None:
+            return
+
+        self.knownHashes = {}
+        for fileName in self.rsiFiles():
+            self.knownHashes[fileName] = self.hashFile(fileName)
+
+        try:
+            self.knownMetadata = readMetadata(self.rsiPath)
+        except (OSError, ValueError):
+            self.knownMetadata = {}
+
+        self.watchFiles()
+
+    def rsiFiles(self) -> List[str]:
+        assert self.rsiPath is not None
+
+        return [entry.name for entry in os.scandir(self.rsiPath)
+                if entry.is_file() and (entry.name == metadataFileName or entry.name.endswith('.png'))]
+
+    def hashFile(self, fileName : str) -> str:
+        assert self.rsiPath is not None
+
+        try:
+            return fileHash(str(self.rsiPath / fileName))
+        except OSError:
+            return ''
+
+    # Many editors save by replacing the file, which stops it being watched, so
+    # this is called again whenever anything changes
+    def watchFiles(self) -> None:
+        assert self.rsiPath is not None
+
+        watched = set(self.watcher.files())
+        unwatched = [str(self.rsiPath / fileName) for fileName in self.rsiFiles() if str(self.rsiPath / fileName) not in watched]
+
+        if len(unwatched) != 0:
+            self.watcher.addPaths(unwatched)
+
+    def fileChanged(self, path : str) -> None:
+        self.pending.add(Path(path).name)
+        self.settleTimer.start()
+
+    def directoryChanged(self) -> None:
+        if self.rsiPath is None:
+            return
+
+        # Files may have been added, removed or replaced
+        self.pending.update(self.rsiFiles())
+        self.pending.update(fileName for fileName in self.knownHashes.keys() if not (self.rsiPath / fileName).exists())
+        self.settleTimer.start()
+
+    def reportChanges(self) -> None:
+        if self.rsiPath is None:
+            return
+
+        self.watchFiles()
+
+        changedStates = set()
+        removedStates = set()
+        headerChanged = False
+
+        for fileName in sorted(self.pending):
+            newHash = self.hashFile(fileName)
+
+            if self.knownHashes.get(fileName, '') == newHash:
+                continue
+
+            if fileName == metadataFileName:
+                try:
+                    metadata = readMetadata(self.rsiPath)
+                except (OSError, ValueError):
+                    # Most likely caught half way through being written - the
+                    # rest of the write will trigger another change
+                    continue
+
+                oldStates = metadataStates(self.knownMetadata)
+                newStates = metadataStates(metadata)
+
+                for name, stateMeta in newStates.items():
+                    if oldStates.get(name) != stateMeta:
+                        changedStates.add(name)
+
+                removedStates.update(set(oldStates.keys()) - set(newStates.keys()))
+
+                for key in ['size', 'license', 'copyright']:
+                    if self.knownMetadata.get(key) != metadata.get(key):
+                        headerChanged = True
+
+                self.knownMetadata = metadata
+            else:
+                changedStates.add(Path(fileName).stem)
+
+            if newHash == '':
+                self.knownHashes.pop(fileName, None)
+            else:
+                self.knownHashes[fileName] = newHash
+
+        self.pending.clear()
+
+        # Sheets without metadata are either removed states, or states which
+        # haven't been added to the metadata yet
+        knownStates = metadataStates(self.knownMetadata)
+        changedStates = { name for name in changedStates if name in knownStates }
+
+        if len(changedStates) != 0 or len(removedStates) != 0 or headerChanged:
+            self.filesChanged.emit(sorted(changedStates), sorted(removedStates), headerChanged)
@@ -0,0 +1,98 @@
+# Slicing sprite sheets into states
+
+# A sheet is a grid of frames the size of the RSI's frames, with a row for each
+# direction and a column for each frame. Which cells hold anything is worked out
+# for the whole grid at once, by checking the alpha of every pixel with NumPy,
+# so even sheets with thousands of cells are quick to slice.
+#
+# Fully transparent rows separate states, and transparent cells at the end of a
+# row are left out. Unless the number of directions is given, it's worked out
+# from the height of each block of rows: 1, 4 or 8 rows make a single state,
+# other multiples of 4 make several 4 directional states, and anything else
+# makes a 1 directional state of each row.
+
+import numpy as np
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from typing import List, Optional, Tuple
+
+# Delay given to each sliced frame
+defaultSliceDelay = 0.1
+
+# Which cells of the sheet have any pixels which aren't fully transparent, as a
+# (rows, columns) array. Cells cut off by the edge of the sheet are ignored.
+def occupiedCells(pixels : np.ndarray, size : Tuple[int, int]) -> np.ndarray:
+    (x, y) = size
+    rows = pixels.shape[0] // y
+    columns = pixels.shape[1] // x
+
+    alpha = pixels[:rows * y, :columns * x, 3].reshape(rows, y, columns, x)
+    return alpha.max(axis=(1, 3)) != 0
+
+# Groups the rows of the sheet into states, as lists of row numbers
+def stateRows(occupied : np.ndarray, directions : Optional[int]) -> List[List[int]]:
+    # Blocks of consecutive rows with something in them
+    blocks : List[List[int]] = []
+    for (row, used) in enumerate(occupied.any(axis=1)):
+        if not used:
+            continue
+        if len(blocks) != 0 and blocks[-1][-1] == row - 1:
+            blocks[-1].append(row)
+        else:
+            blocks.append([row])
+
+    groups : List[List[int]] = []
+    for block in blocks:
+        if directions is not None:
+            rowsPerState = directions
+        elif len(block) in (1, 4, 8):
+            rowsPerState = len(block)
+        elif len(block) % 4 == 0:
+            rowsPerState = 4
+        else:
+            rowsPerState = 1
+
+        # Rows left over at the end of a block are still imported, as states
+        # with too few directions would be
+        groups.extend(block[start:start + rowsPerState] for start in range(0, len(block), rowsPerState))
+
+    return groups
+
+def sliceSheet(sheet : PIL.Image.Image, size : Tuple[int, int], name : str, directions : Optional[int] = None, delay : float = defaultSliceDelay) -> List[RSIPy.State]:
+    pixels = np.asarray(sheet if sheet.mode == 'RGBA' else sheet.convert('RGBA'))
+    (x, y) = size
+
+    occupied = occupiedCells(pixels, size)
+    groups = stateRows(occupied, directions)
+
+    # Transparent cells inside a row are kept as blank frames, all sharing one
+    # image
+    blank = PIL.Image.new('RGBA', size)
+
+    states = []
+    for (number, rows) in enumerate(groups):
+        stateDirections = directions if directions is not None else len(rows)
+
+        # Every direction gets as many frames as the longest row
+        frames = max(int(np.flatnonzero(occupied[row]).max()) + 1 for row in rows)
+
+        stateName = name if len(groups) == 1 else f'{name}_{number + 1}'
+        state = RSIPy.State(stateName, size, stateDirections)
+
+        for (direction, row) in enumerate(rows):
+            state.icons[direction] = [PIL.Image.fromarray(pixels[row * y:(row + 1) * y, column * x:(column + 1) * x].copy(), 'RGBA')
+                    if occupied[row, column] else blank for column in range(frames)]
+            state.delays[direction] = [delay] * frames
+
+        # Directions missing from the end of the sheet are left blank
+        for direction in range(len(rows), stateDirections):
+            state.icons[direction] = [blank] * frames
+            state.delays[direction] = [delay] * frames
+
+        states.append(state)
+
+    return states
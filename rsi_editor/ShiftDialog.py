@@ -0,0 +1,42 @@
+import PySide2.QtCore as QtC
+import PySide2.QtWidgets as QtW
+
+from typing import Optional, Tuple
+
+# Asks how far to shift the frames of some states
+class ShiftDialog(QtW.QDialog):
+    def __init__(self, size : Tuple[int, int], parent : Optional[QtC.QObject] = None):
+        QtW.QDialog.__init__(self, parent)
+
+        self.setWindowTitle('Shift frames')
+
+        self.xInput = QtW.QSpinBox()
+        self.xInput.setRange(-size[0], size[0])
+
+        self.yInput = QtW.QSpinBox()
+        self.yInput.setRange(-size[1], size[1])
+
+        self.wrapCheckbox = QtW.QCheckBox()
+        self.wrapCheckbox.setText("Wrap pixels around the edges")
+
+        formLayout = QtW.QFormLayout()
+        formLayout.addRow("Right:", self.xInput)
+        formLayout.addRow("Down:", self.yInput)
+        formLayout.addRow(self.wrapCheckbox)
+
+        buttons = QtW.QDialogButtonBox(QtW.QDialogButtonBox.Ok | QtW.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        overallLayout = QtW.QVBoxLayout()
+        overallLayout.addLayout(formLayout)
+        overallLayout.addWidget(buttons)
+
+        self.setLayout(overallLayout)
+
+    # (x, y, wrap), or None if cancelled
+    def shift(self) -> Optional[Tuple[int, int, bool]]:
+        if self.exec() != QtW.QDialog.Accepted:
+            return None
+
+        return (self.xInput.value(), self.yInput.value(), self.wrapCheckbox.isChecked())
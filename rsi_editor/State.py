@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import PySide2.QtCore as QtC
 import PySide2.QtGui as QtG
 
@@ -6,9 +8,15 @@ import PIL.ImageQt as PILQt # type: ignore
 
 import rsi.state as RSIStatePy
 
+from .DelayTools import defaultDelay, directionDelays
+from .DirectionSynthesis import synthesiseDirections
+from .PreviewPlayer import PreviewPlayer
+from .Profiling import profiler, timed
+from .RsiFiles import directionNames
+
 # Typing imports
 from .Rsi import Rsi
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
 
 # TODO: Have this be configured by zooming in and out
 iconSize = QtC.QSize(100, 100)
@@ -20,8 +28,19 @@ class State(QtC.QAbstractTableModel):
     def __init__(self, parentRsi : Rsi, stateName : str, parent : Optional[QtC.QObject] = None):
         QtC.QAbstractTableModel.__init__(self, parent)
 
+        self.parentRsi = parentRsi
         self.state = parentRsi.states[stateName]
-        self.animations = [QtC.QSequentialAnimationGroup() for i in range(self.state.directions)]
+
+        # See batchUpdate
+        self.batchDepth = 0
+        self.pendingChange : Optional[Tuple[int, int, int, int]] = None
+        self.pendingRoles : Optional[Set[int]] = set()
+        self.pendingSummaryRows : Set[int] = set()
+
+        # One per direction, see PreviewPlayer
+        self.players : List[Optional[PreviewPlayer]] = []
+        self.disposed = False
+
         self.recalculateSummary()
         self.dataChanged.connect(self.frameDataChanged)
  
@@ -32,6 +51,69 @@ class State(QtC.QAbstractTableModel):
         self.columnsRemoved.connect(lambda _parent, _first, _last: self.recalculateSummary())
         self.columnsMoved.connect(lambda _source, _first, _last, _dest, _destfirst: self.recalculateSummary())
 
+    # Batching changes
+
+    # Within a batch, changes to the model's data are merged into a single
+    # dataChanged when the batch ends, and the animations are only regenerated
+    # then - once per direction, however many frames were changed. Batches can
+    # be nested, in which case everything waits for the outermost one.
+    @contextmanager
+    def batchUpdate(self) -> Iterator[None]:
+        self.batchDepth += 1
+        try:
+            yield
+        finally:
+            if self.batchDepth == 1:
+                self.flushBatch()
+            self.batchDepth -= 1
+
+    def isBatching(self) -> bool:
+        return self.batchDepth > 0
+
+    # Emits dataChanged, or merges it into the pending change if batching
+    def notifyDataChanged(self, topLeft : QtC.QModelIndex, bottomRight : QtC.QModelIndex, roles : List[int] = list()) -> None:
+        if not self.isBatching():
+            self.dataChanged.emit(topLeft, bottomRight, roles)
+            return
+
+        if not topLeft.isValid() or not bottomRight.isValid():
+            return
+
+        change = (topLeft.row(), topLeft.column(), bottomRight.row(), bottomRight.column())
+        if self.pendingChange is not None:
+            change = (min(change[0], self.pendingChange[0]), min(change[1], self.pendingChange[1]),
+                    max(change[2], self.pendingChange[2]), max(change[3], self.pendingChange[3]))
+        self.pendingChange = change
+
+        # No roles means every role changed
+        if self.pendingRoles is not None:
+            if len(roles) == 0:
+                self.pendingRoles = None
+            else:
+                self.pendingRoles.update(roles)
+
+    def flushBatch(self) -> None:
+        # Still counts as batching while the merged change is emitted, so that
+        # frameDataChanged just notes which animations need regenerating
+        if self.pendingChange is not None:
+            (top, left, bottom, right) = self.pendingChange
+            bottom = min(bottom, self.rowCount() - 1)
+            right = min(right, self.columnCount() - 1)
+
+            if top <= bottom and left <= right:
+                roles = list(self.pendingRoles) if self.pendingRoles is not None else []
+                self.dataChanged.emit(self.index(top, left), self.index(bottom, right), roles)
+
+        self.pendingChange = None
+        self.pendingRoles = set()
+
+        rows = sorted(row for row in self.pendingSummaryRows if row < self.rowCount())
+        self.pendingSummaryRows = set()
+
+        if len(rows) != 0:
+            for row in rows:
+                self.generateAnimation(row)
+
     # Getters
 
     def name(self) -> str:
@@ -45,20 +127,19 @@ class State(QtC.QAbstractTableModel):
         return list(zip(self.state.icons[direction], self.getDelays(direction)))
 
     def getDelays(self, direction : int) -> List[float]:
-        if self.state.delays[direction] == []:
-            return [0.0]
-        else:
-            return self.state.delays[direction]
+        return directionDelays(self.state.delays[direction])
 
     def delay(self, index: QtC.QModelIndex) -> Optional[float]:
         dirFrame = self.getDirFrame(index)
 
         if dirFrame is not None:
             direction, frame = dirFrame
-            return self.state.delays[direction][frame]
+            return self.getDelays(direction)[frame]
         return None
 
     def setDelay(self, index : QtC.QModelIndex, delay : float) -> None:
+        self.parentRsi.markModified(self.name())
+
         direction = index.row()
         frame = index.column() 
         
@@ -66,11 +147,33 @@ class State(QtC.QAbstractTableModel):
 
         if len(self.state.delays[direction]) <= frame:
             leftMostChange = len(self.state.delays[direction])
-            self.state.delays[direction].extend([0.0] * (frame - len(self.state.delays[direction]) + 1))
+            self.state.delays[direction].extend([defaultDelay] * (frame - len(self.state.delays[direction]) + 1))
 
         self.state.delays[direction][frame] = delay
 
-        self.dataChanged.emit(self.index(direction, leftMostChange), self.index(direction, frame), [QtC.Qt.DisplayRole])
+        self.notifyDataChanged(self.index(direction, leftMostChange), self.index(direction, frame), [QtC.Qt.DisplayRole])
+
+    # Sets many delays at once, as a single change to the model - so the
+    # animations are only regenerated once. Returns the old delays.
+    def setDelays(self, delays : Dict[Tuple[int, int], float]) -> Dict[Tuple[int, int], float]:
+        oldDelays = {}
+
+        for ((direction, frame), delay) in delays.items():
+            oldDelays[(direction, frame)] = self.getDelays(direction)[frame]
+
+            frameDelays = self.state.delays[direction]
+            if len(frameDelays) <= frame:
+                frameDelays.extend([defaultDelay] * (frame - len(frameDelays) + 1))
+            frameDelays[frame] = delay
+
+        if len(delays) != 0:
+            self.parentRsi.markModified(self.name())
+
+            rows = [direction for (direction, _frame) in delays.keys()]
+            columns = [frame for (_direction, frame) in delays.keys()]
+            self.notifyDataChanged(self.index(min(rows), min(columns)), self.index(max(rows), max(columns)), [QtC.Qt.DisplayRole])
+
+        return oldDelays
 
     def frame(self, index : QtC.QModelIndex) -> Optional[PIL.Image.Image]:
         dirFrame = self.getDirFrame(index)
@@ -82,6 +185,8 @@ class State(QtC.QAbstractTableModel):
         return None
 
     def setFrame(self, index : QtC.QModelIndex, image : PIL.Image.Image) -> None:
+        self.parentRsi.markModified(self.name())
+
         direction = index.row()
         frame = index.column() 
 
@@ -91,9 +196,9 @@ class State(QtC.QAbstractTableModel):
             leftMostChange = len(self.state.icons[direction])
             self.state.icons[direction].extend([None] * (frame - len(self.state.icons[direction]) + 1))
 
-        self.state.icons[direction][frame] = image.copy()
+        self.state.icons[direction][frame] = self.parentRsi.internFrame(image)
 
-        self.dataChanged.emit(self.index(direction, leftMostChange), self.index(direction, frame), [QtC.Qt.DecorationRole])
+        self.notifyDataChanged(self.index(direction, leftMostChange), self.index(direction, frame), [QtC.Qt.DecorationRole])
 
     def getDirFrame(self, index : QtC.QModelIndex) -> Optional[Tuple[int, int]]:
         framesInDirection = self.frames(index.row())
@@ -104,8 +209,11 @@ class State(QtC.QAbstractTableModel):
     # Frame manipulations
 
     def addFrame(self, index : QtC.QModelIndex, image : Optional[PIL.Image.Image] = None, delay : float = 0.0) -> None:
+        self.parentRsi.markModified(self.name())
+
         if image is None:
             image = PIL.Image.new('RGBA', self.state.size)
+        image = self.parentRsi.internFrame(image)
 
         columnEnd = self.columnCount(QtC.QModelIndex()) - 1
         # In this case, we're going to insert a column
@@ -120,9 +228,11 @@ class State(QtC.QAbstractTableModel):
         if insertColumn:
             self.endInsertColumns()
         
-        self.dataChanged.emit(index, index.siblingAtColumn(self.columnCount(QtC.QModelIndex()) - 1))
+        self.notifyDataChanged(index, index.siblingAtColumn(self.columnCount(QtC.QModelIndex()) - 1))
 
     def deleteFrame(self, index : QtC.QModelIndex) -> Tuple[PIL.Image.Image, float]:
+        self.parentRsi.markModified(self.name())
+
         removeColumn = True
         columnCount = self.columnCount(QtC.QModelIndex()) - 1
         for direction in range(self.directions()):
@@ -142,18 +252,21 @@ class State(QtC.QAbstractTableModel):
             self.endRemoveColumns()
 
         newColumnCount = self.columnCount(QtC.QModelIndex())
-        if index.column() >= newColumnCount:
-            self.dataChanged.emit(index, index.siblingAtColumn(newColumnCount - 1))
+        if index.column() < newColumnCount:
+            self.notifyDataChanged(index, index.siblingAtColumn(newColumnCount - 1))
 
         return (image, delay) 
 
     # Direction manipulations
 
     ## Returns: ( <removed icon lists>, <removed delay lists> )
-    def setDirections(self, directions : int) -> Tuple[List[List[PIL.Image.Image]], List[List[float]]]:
+    # New directions are generated using `rules` - see DirectionSynthesis
+    def setDirections(self, directions : int, rules : Optional[Mapping[str, str]] = None) -> Tuple[List[List[PIL.Image.Image]], List[List[float]]]:
         if self.directions() == directions:
             return ([], [])
 
+        self.parentRsi.markModified(self.name())
+
         if self.directions() > directions:
             firstRemoved = directions
             lastRemoved = self.directions() - 1
@@ -175,22 +288,23 @@ class State(QtC.QAbstractTableModel):
             firstInsertion = self.directions()
             lastInsertion = directions - 1
 
-            self.beginInsertRows(QtC.QModelIndex(), firstInsertion, lastInsertion)
-
+            # The new directions' previews are made once the views have caught
+            # up with the inserted rows. Made any sooner, their first frames
+            # would be announced for rows the views don't know about yet.
+            with self.batchUpdate():
+                self.beginInsertRows(QtC.QModelIndex(), firstInsertion, lastInsertion)
 
-            # Basically, we extend the short list into the longer list by iterating
-            # over the elements and copying each one until we have the size of list
-            # we want
-            dirIndex = 0
+                # Without any rules, the existing directions are just copied in turn
+                (newIcons, newDelays) = synthesiseDirections(self.state.icons, self.state.delays, directions,
+                        rules if rules is not None else {}, self.parentRsi.size)
 
-            for i in range(firstInsertion, directions):
-                self.state.icons.insert(i, [ im.copy() for im in self.state.icons[dirIndex]])
-                self.state.delays.insert(i, [ delay for delay in self.state.delays[dirIndex]])
-                dirIndex = (dirIndex + 1) % (firstInsertion)
+                for (icons, delays) in zip(newIcons, newDelays):
+                    self.state.icons.append([self.parentRsi.internFrame(icon) for icon in icons])
+                    self.state.delays.append(delays)
 
-            self.state.directions = directions
+                self.state.directions = directions
 
-            self.endInsertRows()
+                self.endInsertRows()
 
             return ([], [])
 
@@ -234,17 +348,18 @@ class State(QtC.QAbstractTableModel):
         else:
             if index.column() == self.summaryColumn():
                 if role == QtC.Qt.DecorationRole:
-                    # Some directions may have no animation
-                    currentAnim = self.animations[index.row()]
-                    if currentAnim is None:
+                    # Some directions may have no animation, and the view asks about
+                    # an invalid index (row -1) when it's detached from the model
+                    player = self.players[index.row()] if 0 <= index.row() < len(self.players) else None
+                    if player is None:
                         return None
 
                     # and while the animation *should* never refer to the summary column
                     # it might do if data is fetched between the column being removed
-                    # and the new animation being created
-                    currentFrame = currentAnim.currentAnimation()
-                    if currentFrame is not None and currentFrame.index.column() != self.summaryColumn():
-                        return self.data(currentFrame.index, role)
+                    # and the animation being updated
+                    currentFrame = player.currentIndex()
+                    if currentFrame is not None and currentFrame.column() != self.summaryColumn():
+                        return self.data(currentFrame, role)
                 if role == QtC.Qt.DisplayRole:
                     return ''
             return None
@@ -257,23 +372,8 @@ class State(QtC.QAbstractTableModel):
                     return 'All'
                 return None
             else:
-                if role == QtC.Qt.DisplayRole:
-                    if section == 0:
-                        return 'South'
-                    if section == 1:
-                        return 'North'
-                    if section == 2:
-                        return 'East'
-                    if section == 3:
-                        return 'West'
-                    if section == 4:
-                        return 'South East'
-                    if section == 5:
-                        return 'South West'
-                    if section == 6:
-                        return 'North East'
-                    if section == 7:
-                        return 'North West'
+                if role == QtC.Qt.DisplayRole and section < len(directionNames):
+                    return directionNames[section]
                 return None
         else:
             if section > self.columnCount(QtC.QModelIndex()):
@@ -328,54 +428,72 @@ class State(QtC.QAbstractTableModel):
     def summaryColumn(self) -> int:
         return self.columnCount(QtC.QModelIndex()) - 1
 
-    def recalculateSummary(self, rowsChanged : Optional[range] = None) -> None:
+    @timed('State.recalculateSummary')
+    def recalculateSummary(self, rowsChanged : Optional[Iterable[int]] = None) -> None:
+        if self.disposed:
+            return
+
         numRows = self.rowCount(QtC.QModelIndex())
 
         if rowsChanged is None:
             rowsChanged = range(numRows)
 
-        numAnims = len(self.animations)
-        if numAnims != numRows:
-            if numAnims > numRows:
-                self.animations = self.animations[0:numRows]
+        numPlayers = len(self.players)
+        if numPlayers != numRows:
+            if numPlayers > numRows:
+                for player in self.players[numRows:]:
+                    if player is not None:
+                        player.dispose()
+                self.players = self.players[0:numRows]
             else:
-                self.animations = self.animations + ([QtC.QSequentialAnimationGroup()] * (numRows - numAnims))
+                # Filled in by generateAnimation
+                self.players = self.players + ([None] * (numRows - numPlayers))
+
+        if self.isBatching():
+            self.pendingSummaryRows.update(rowsChanged)
+            return
 
         for rowIndex in rowsChanged:
             self.generateAnimation(rowIndex)
 
     def generateAnimation(self, row : int) -> None:
-        animGroup = QtC.QSequentialAnimationGroup(parent=self)
+        profiler.count('animations rebuilt')
 
+        frames = []
         for column in range(self.columnCount(QtC.QModelIndex())):
             currentIndex = self.index(row, column)
 
             frameDelay = self.data(currentIndex, role=QtC.Qt.DisplayRole)
             if isinstance(frameDelay, float):
-                animGroup.addAnimation(SummaryFrame(currentIndex, frameDelay, parent=self))
+                frames.append((currentIndex, frameDelay))
             else:
                 break
 
-        previousAnim = self.animations[row]
-        if previousAnim is not None:
-            previousAnim.stop()
-
         animIndex = self.index(row, self.summaryColumn(), QtC.QModelIndex())
-        animGroup.currentAnimationChanged.connect(lambda _void: self.dataChanged.emit(animIndex, animIndex, [QtC.Qt.DecorationRole]))
-        self.animations[row] = animGroup
-        animGroup.setLoopCount(-1)
-        animGroup.start()
-
-# Special kind of animation that does nothing other than hold on to an index
-# so that we can track it later
-class SummaryFrame(QtC.QAbstractAnimation):
-    def __init__(self, index : QtC.QModelIndex, delay : float, parent : QtC.QObject = None):
-        QtC.QAbstractAnimation.__init__(self, parent)
-        self.index = index
-        self.delay = delay
-
-    def duration(self) -> int:
-        return int(self.delay * 1000)
-
-    def updateCurrentTime(self, time : float) -> None:
-        return
+
+        player = self.players[row]
+        if player is None:
+            player = PreviewPlayer(animIndex, parent=self)
+            player.frameChanged.connect(self.previewFrameChanged)
+            self.players[row] = player
+
+        player.setFrames(frames, animIndex)
+
+    def previewFrameChanged(self, summaryIndex : QtC.QModelIndex) -> None:
+        self.dataChanged.emit(summaryIndex, summaryIndex, [QtC.Qt.DecorationRole])
+
+    # Stops and deletes the animations. The model shouldn't be used afterwards.
+    def dispose(self) -> None:
+        self.disposed = True
+        self.pendingSummaryRows = set()
+
+        for player in self.players:
+            if player is not None:
+                player.dispose()
+        self.players = []
+
+    # Instrumentation: the number of animation objects currently alive under
+    # this model. This should stay at one per direction plus one per frame,
+    # however many edits have been made.
+    def liveAnimations(self) -> int:
+        return len(self.findChildren(QtC.QAbstractAnimation))
@@ -0,0 +1,65 @@
+import PySide2.QtCore as QtC
+
+from .Rsi import Rsi
+
+from typing import List, Optional, Set
+
+# Shows only the states of an RSI whose names match a filter, looked up in the
+# RSI's StateNameIndex
+class StateFilterModel(QtC.QSortFilterProxyModel):
+    def __init__(self, parent : Optional[QtC.QObject] = None):
+        QtC.QSortFilterProxyModel.__init__(self, parent)
+
+        self.rsi : Optional[Rsi] = None
+        self.filterText = ''
+
+        # Names of the states to show, or None to show every state
+        self.matches : Optional[Set[str]] = None
+
+        # Whether to show each row of the RSI, worked out in one go since
+        # filterAcceptsRow is called for every row whenever the filter changes
+        self.acceptedRows : List[bool] = []
+
+    def setSourceModel(self, rsi : Optional[Rsi]) -> None:
+        previous = self.rsi
+        if previous is not None:
+            previous.rowsInserted.disconnect(self.refreshMatches)
+            previous.rowsRemoved.disconnect(self.refreshMatches)
+            previous.rowsMoved.disconnect(self.refreshMatches)
+            previous.dataChanged.disconnect(self.refreshMatches)
+
+        # Connected before the proxy connects its own slots, so that the
+        # matches are up to date by the time new or renamed states are filtered
+        if rsi is not None:
+            rsi.rowsInserted.connect(self.refreshMatches)
+            rsi.rowsRemoved.connect(self.refreshMatches)
+            rsi.rowsMoved.connect(self.refreshMatches)
+            rsi.dataChanged.connect(self.refreshMatches)
+
+        self.rsi = rsi
+        self.refreshMatches()
+        QtC.QSortFilterProxyModel.setSourceModel(self, rsi)
+
+    def setFilterText(self, text : str) -> None:
+        previousMatches = self.matches
+        self.filterText = text
+        self.refreshMatches()
+
+        # Refiltering means a call to filterAcceptsRow for every row, so it's
+        # skipped if typing didn't change what's shown
+        if self.matches != previousMatches:
+            self.invalidateFilter()
+
+    def refreshMatches(self, *_args : object) -> None:
+        if self.rsi is None:
+            (self.matches, self.acceptedRows) = (None, [])
+            return
+
+        self.matches = self.rsi.nameIndex.search(self.filterText)
+        if self.matches is None:
+            self.acceptedRows = [True] * self.rsi.rowCount()
+        else:
+            self.acceptedRows = [name in self.matches for name in self.rsi.rowOrder()]
+
+    def filterAcceptsRow(self, sourceRow : int, _sourceParent : QtC.QModelIndex) -> bool:
+        return self.acceptedRows[sourceRow]
@@ -0,0 +1,235 @@
+# On-disk index of every state across a directory tree of RSIs, for finding
+# states by name without opening each RSI
+
+# Only meta.json files are read, so indexing is fast even for large trees -
+# they're read in parallel, and only when they've changed since the index was
+# last updated. Thumbnails are added as they're first shown rather than while
+# indexing, along with the modification time of the sheet they were made from,
+# so each sheet only has to be read once.
+#
+# Searching is fuzzy: the letters of the query have to appear in the state's
+# name in order, but not necessarily next to each other.
+
+from __future__ import annotations
+
+import base64
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .RsiFiles import metadataFileName, metadataSize
+
+from typing import Any, Dict, List, Optional, Tuple
+
+# The default name of the index file, written to the root of the indexed tree
+indexFileName = '.rsi-states.json'
+
+indexVersion = 2
+
+class StateEntry():
+    def __init__(self, rsiPath : str, name : str, directions : int, frames : int):
+        # Relative to the root of the index
+        self.rsiPath = rsiPath
+        self.name = name
+        self.directions = directions
+        self.frames = frames
+
+class StateMatch():
+    def __init__(self, state : StateEntry, score : float):
+        self.state = state
+
+        # Lower is better
+        self.score = score
+
+class StateIndex():
+    def __init__(self, root : str, indexPath : str = ''):
+        self.root = Path(root)
+        self.indexPath = Path(indexPath) if indexPath != '' else self.root / indexFileName
+
+        # Relative RSI path -> { 'mtime', 'size', 'license', 'copyright', 'states': [[name, directions, frames]],
+        # 'thumbnails': { name: [sheet mtime, base64 PNG] } }
+        self.rsis : Dict[str, Dict[str, Any]] = {}
+
+        # Whether thumbnails were added since the index was loaded or saved
+        self.thumbnailsChanged = False
+
+        # Flattened for searching, see rebuildSearch
+        self.states : List[StateEntry] = []
+        self.searchNames : List[str] = []
+
+    @classmethod
+    def load(cls, root : str, indexPath : str = '') -> StateIndex:
+        index = cls(root, indexPath)
+
+        try:
+            with index.indexPath.open() as indexFile:
+                contents = json.load(indexFile)
+
+            if contents.get('version') == indexVersion:
+                index.rsis = contents['rsis']
+        except (OSError, ValueError):
+            pass
+
+        index.rebuildSearch()
+        return index
+
+    def save(self) -> None:
+        with self.indexPath.open('w') as indexFile:
+            json.dump({ 'version': indexVersion, 'rsis': self.rsis }, indexFile)
+
+        self.thumbnailsChanged = False
+
+    # Brings the index up to date with the tree - returns the number of RSIs
+    # whose metadata had to be read again
+    def update(self, workers : Optional[int] = None) -> int:
+        found : Dict[str, Tuple[Path, int]] = {}
+        for (folder, folders, files) in os.walk(self.root):
+            # Hidden folders (like .git) can be huge, and never hold RSIs
+            folders[:] = [name for name in folders if not name.startswith('.')]
+
+            if metadataFileName in files:
+                metaPath = Path(folder) / metadataFileName
+                try:
+                    mtime = metaPath.stat().st_mtime_ns
+                except OSError:
+                    continue
+                found[Path(folder).relative_to(self.root).as_posix()] = (metaPath, mtime)
+
+        for removed in set(self.rsis.keys()) - set(found.keys()):
+            del self.rsis[removed]
+
+        changed = [(relativePath, metaPath, mtime) for (relativePath, (metaPath, mtime)) in found.items()
+                if self.rsis.get(relativePath, {}).get('mtime') != mtime]
+
+        with ThreadPoolExecutor(workers) as executor:
+            entries = list(executor.map(lambda change: indexMetadata(change[1], change[2]), changed))
+
+        for ((relativePath, _metaPath, _mtime), entry) in zip(changed, entries):
+            if entry is None:
+                # Broken RSIs are skipped, rather than stopping the whole scan
+                self.rsis.pop(relativePath, None)
+            else:
+                # Thumbnails are checked against their sheets when they're used,
+                # so they can be kept even though the metadata changed
+                names = { name for (name, _directions, _frames) in entry['states'] }
+                entry['thumbnails'] = { name: thumbnail for (name, thumbnail) in self.rsis.get(relativePath, {}).get('thumbnails', {}).items()
+                        if name in names }
+                self.rsis[relativePath] = entry
+
+        self.rebuildSearch()
+        return len(changed)
+
+    def rebuildSearch(self) -> None:
+        self.states = [StateEntry(rsiPath, name, directions, frames)
+                for (rsiPath, entry) in sorted(self.rsis.items())
+                for (name, directions, frames) in entry['states']]
+        self.searchNames = [state.name.lower() for state in self.states]
+
+    def rsiPath(self, state : StateEntry) -> Path:
+        return self.root / state.rsiPath
+
+    # The PNG thumbnail stored for a state, or None if there isn't one or its
+    # sheet has changed since it was made. `sheetMtime` is the sheet's current
+    # modification time.
+    def thumbnail(self, state : StateEntry, sheetMtime : int) -> Optional[bytes]:
+        stored = self.rsis[state.rsiPath].get('thumbnails', {}).get(state.name)
+        if stored is None or stored[0] != sheetMtime:
+            return None
+        return base64.b64decode(stored[1])
+
+    def setThumbnail(self, state : StateEntry, sheetMtime : int, png : bytes) -> None:
+        thumbnails = self.rsis[state.rsiPath].setdefault('thumbnails', {})
+        thumbnails[state.name] = [sheetMtime, base64.b64encode(png).decode('ascii')]
+        self.thumbnailsChanged = True
+
+    # The best matches for `query`, best first
+    def search(self, query : str, limit : int = 200) -> List[StateMatch]:
+        query = query.strip().lower()
+        if query == '':
+            return [StateMatch(state, 0) for state in self.states[:limit]]
+
+        # Names containing the query as is always beat the rest (see
+        # fuzzyScore), so if there are enough of them the rest can be skipped
+        matches = [StateMatch(self.states[position], substringScore(query, name, name.find(query)))
+                for (position, name) in enumerate(self.searchNames) if query in name]
+
+        if len(matches) < limit:
+            # The regular expression does the slow part (finding which names
+            # match at all) in C, so only the matches are scored in Python
+            pattern = re.compile('.*?'.join(re.escape(character) for character in query))
+
+            matches = []
+            for (position, name) in enumerate(self.searchNames):
+                found = pattern.search(name)
+                if found is not None:
+                    matches.append(StateMatch(self.states[position], fuzzyScore(query, name, found)))
+
+        matches.sort(key=lambda match: (match.score, match.state.name, match.state.rsiPath))
+        return matches[:limit]
+
+def indexMetadata(metaPath : Path, mtime : int) -> Optional[Dict[str, Any]]:
+    try:
+        with metaPath.open() as metaFile:
+            metadata = json.load(metaFile)
+
+        states = []
+        for stateMeta in metadata.get('states', []):
+            delays = stateMeta.get('delays')
+            frames = len(delays[0]) if delays is not None and len(delays) != 0 else 1
+            states.append([stateMeta['name'], stateMeta.get('directions', 1), frames])
+
+        return {
+            'mtime': mtime,
+            'size': list(metadataSize(metadata)),
+            'license': metadata.get('license'),
+            'copyright': metadata.get('copyright'),
+            'states': states,
+        }
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def substringScore(query : str, name : str, start : int) -> float:
+    if name == query:
+        return 0
+
+    # Matches at the start of a word are better
+    boundary = start == 0 or not name[start - 1].isalnum()
+    return 1 + (0 if boundary else 1) + start / 100 + len(name) / 1000
+
+# Scores a match found by StateIndex.search - exact names come first, then names
+# containing the query as is, then names where the matched letters are close
+# together and near the start
+def fuzzyScore(query : str, name : str, found : re.Match) -> float:
+    start = name.find(query)
+    if start != -1:
+        return substringScore(query, name, start)
+
+    # The leftmost match may be spread out more than it needs to be, so try
+    # starting from each place the first letter appears and keep the tightest
+    pattern = found.re
+    (bestStart, bestSpan) = (found.start(), found.end() - found.start())
+    start = name.find(query[0], found.start() + 1)
+    while start != -1:
+        tighter = pattern.match(name, start)
+        if tighter is None:
+            break
+        if tighter.end() - start < bestSpan:
+            (bestStart, bestSpan) = (start, tighter.end() - start)
+        start = name.find(query[0], start + 1)
+
+    return 10 + (bestSpan - len(query)) + bestStart / 100 + len(name) / 1000
+
+# Command line entry point - prints the states best matching a query
+def findStates(root : str, query : str, indexPath : str = '', limit : int = 20) -> int:
+    index = StateIndex.load(root, indexPath)
+    index.update()
+    index.save()
+
+    matches = index.search(query, limit)
+    for match in matches:
+        state = match.state
+        print(f'{state.rsiPath}: {state.name} ({state.directions} directions, {state.frames} frames)')
+
+    return 0 if len(matches) != 0 else 1
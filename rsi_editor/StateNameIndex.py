@@ -0,0 +1,93 @@
+# Index of the state names in an RSI, for filtering the state list as you type
+
+# Queries match names containing them, ignoring case. Queries of three or more
+# characters are looked up by trigram: a name containing the query contains
+# every trigram of the query, so only the names sharing its rarest trigram need
+# checking. Shorter queries match the start of any word in a name (words being
+# separated by underscores, dashes and so on), found with a binary search of
+# the sorted words.
+
+import bisect
+import re
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+wordSeparator = re.compile('[^a-z0-9]+')
+
+def trigramsOf(text : str) -> Set[str]:
+    return { text[start:start + 3] for start in range(len(text) - 2) }
+
+def wordsOf(text : str) -> Set[str]:
+    return { word for word in wordSeparator.split(text) if word != '' }
+
+class StateNameIndex():
+    def __init__(self, names : Iterable[str] = ()):
+        self.names : Set[str] = set()
+        self.trigrams : Dict[str, Set[str]] = {}
+
+        # (word, name), sorted
+        self.words : List[Tuple[str, str]] = []
+
+        for name in names:
+            self.names.add(name)
+            self.addTrigrams(name)
+            self.words.extend((word, name) for word in wordsOf(name.lower()))
+        self.words.sort()
+
+    def add(self, name : str) -> None:
+        if name in self.names:
+            return
+
+        self.names.add(name)
+        self.addTrigrams(name)
+        for word in wordsOf(name.lower()):
+            bisect.insort(self.words, (word, name))
+
+    def remove(self, name : str) -> None:
+        if name not in self.names:
+            return
+
+        self.names.discard(name)
+
+        for trigram in trigramsOf(name.lower()):
+            names = self.trigrams[trigram]
+            names.discard(name)
+            if len(names) == 0:
+                del self.trigrams[trigram]
+
+        for word in wordsOf(name.lower()):
+            position = bisect.bisect_left(self.words, (word, name))
+            if position < len(self.words) and self.words[position] == (word, name):
+                del self.words[position]
+
+    def rename(self, oldName : str, newName : str) -> None:
+        self.remove(oldName)
+        self.add(newName)
+
+    def addTrigrams(self, name : str) -> None:
+        for trigram in trigramsOf(name.lower()):
+            self.trigrams.setdefault(trigram, set()).add(name)
+
+    # The names matching `query`, or None if the query matches everything
+    def search(self, query : str) -> Optional[Set[str]]:
+        query = query.strip().lower()
+
+        if query == '':
+            return None
+
+        if len(query) >= 3:
+            candidates = min((self.trigrams.get(trigram, set()) for trigram in trigramsOf(query)), key=len)
+            return { name for name in candidates if query in name.lower() }
+
+        if wordSeparator.search(query) is not None:
+            # Not a word, so there's nothing to look up
+            return { name for name in self.names if query in name.lower() }
+
+        matches = set()
+        for position in range(bisect.bisect_left(self.words, (query, '')), len(self.words)):
+            (word, name) = self.words[position]
+            if not word.startswith(query):
+                break
+            matches.add(name)
+
+        return matches
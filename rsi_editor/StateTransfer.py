@@ -0,0 +1,161 @@
+# Copying states between RSIs, through the clipboard or by dragging them
+
+# Copied states are written as stateMimeType: a JSON header followed by the raw
+# RGBA pixels of each distinct frame, which is much quicker to write and read
+# back than PNG. That's only read by other processes though (like another
+# instance of the editor) - within the same process, the mime data also carries
+# a token for the copied states themselves, kept in a registry, so pasting them
+# shares the frames rather than decoding them again. Sharing is safe since
+# frames are never edited in place.
+
+from __future__ import annotations
+
+from collections import OrderedDict
+import itertools
+import json
+import os
+import struct
+
+import PySide2.QtCore as QtC
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+
+import rsi as RSIPy
+
+from typing import Dict, List, Optional, Set, Tuple
+
+stateMimeType = 'application/x-rsi-editor-states'
+tokenMimeType = 'application/x-rsi-editor-states-token'
+
+transferMagic = b'RSISTATE'
+transferVersion = 1
+
+# Only the most recent copies can be pasted without decoding - older ones have
+# almost always been replaced on the clipboard by then
+registrySize = 8
+
+class StateTransfer():
+    def __init__(self, size : Tuple[int, int], states : List[RSIPy.State], source : Optional[object] = None):
+        self.size = size
+        self.states = states
+
+        # The model the states were copied from, if it's in this process
+        self.source = source
+
+    # Copies of the states, which can be changed without affecting the
+    # originals (or anything else they were pasted into)
+    def copies(self) -> List[RSIPy.State]:
+        return [copyState(state) for state in self.states]
+
+registry : OrderedDict[str, StateTransfer] = OrderedDict()
+tokens = itertools.count()
+
+def copyState(state : RSIPy.State) -> RSIPy.State:
+    copy = RSIPy.State(state.name, state.size, state.directions)
+    copy.flags = dict(state.flags)
+    copy.delays = [list(delays) for delays in state.delays]
+    copy.icons = [list(icons) for icons in state.icons]
+    return copy
+
+# The states are copied as they are now, so later edits don't change what's
+# pasted
+def stateMimeData(size : Tuple[int, int], states : List[RSIPy.State], source : Optional[object] = None) -> QtC.QMimeData:
+    transfer = StateTransfer(size, [copyState(state) for state in states], source)
+
+    token = f'{os.getpid()}:{next(tokens)}'
+    registry[token] = transfer
+    while len(registry) > registrySize:
+        registry.popitem(last=False)
+
+    mimeData = QtC.QMimeData()
+    mimeData.setData(stateMimeType, QtC.QByteArray(encodeStates(size, transfer.states)))
+    mimeData.setData(tokenMimeType, QtC.QByteArray(token.encode()))
+    return mimeData
+
+# The states in some mime data, or None if there aren't any (or they can't be
+# read)
+def statesFromMimeData(mimeData : Optional[QtC.QMimeData]) -> Optional[StateTransfer]:
+    if mimeData is None or not mimeData.hasFormat(stateMimeType):
+        return None
+
+    if mimeData.hasFormat(tokenMimeType):
+        transfer = registry.get(mimeData.data(tokenMimeType).data().decode(errors='replace'))
+        if transfer is not None:
+            return StateTransfer(transfer.size, transfer.copies(), transfer.source)
+
+    try:
+        (size, states) = decodeStates(mimeData.data(stateMimeType).data())
+    except ValueError:
+        return None
+
+    return StateTransfer(size, states)
+
+def encodeStates(size : Tuple[int, int], states : List[RSIPy.State]) -> bytes:
+    # Each distinct frame, by identity
+    frameNumbers : Dict[int, int] = {}
+    frames : List[PIL.Image.Image] = []
+    for state in states:
+        for icons in state.icons:
+            for icon in icons:
+                if id(icon) not in frameNumbers:
+                    frameNumbers[id(icon)] = len(frames)
+                    frames.append(icon)
+
+    header = json.dumps({
+        'size': list(size),
+        'frames': len(frames),
+        'states': [{
+            'name': state.name,
+            'directions': state.directions,
+            'flags': state.flags,
+            'delays': state.delays,
+            'icons': [[frameNumbers[id(icon)] for icon in icons] for icons in state.icons],
+        } for state in states],
+    }).encode()
+
+    pixels = [(frame if frame.mode == 'RGBA' else frame.convert('RGBA')).tobytes() for frame in frames]
+    return b''.join([transferMagic, struct.pack('<II', transferVersion, len(header)), header] + pixels)
+
+def decodeStates(data : bytes) -> Tuple[Tuple[int, int], List[RSIPy.State]]:
+    prefixSize = len(transferMagic) + 8
+    if data[:len(transferMagic)] != transferMagic or len(data) < prefixSize:
+        raise ValueError('Not copied states')
+
+    (version, headerSize) = struct.unpack_from('<II', data, len(transferMagic))
+    if version != transferVersion:
+        raise ValueError(f'Unsupported version {version}')
+
+    try:
+        header = json.loads(data[prefixSize:prefixSize + headerSize])
+        (x, y) = header['size']
+        frameSize = x * y * 4
+
+        pixelsStart = prefixSize + headerSize
+        if len(data) != pixelsStart + header['frames'] * frameSize:
+            raise ValueError('Truncated frames')
+
+        frames = [PIL.Image.frombytes('RGBA', (x, y), data[start:start + frameSize])
+                for start in range(pixelsStart, len(data), frameSize)]
+
+        states = []
+        for saved in header['states']:
+            state = RSIPy.State(saved['name'], (x, y), saved['directions'])
+            state.flags = saved['flags']
+            state.delays = [list(delays) for delays in saved['delays']]
+            state.icons = [[frames[frame] for frame in icons] for icons in saved['icons']]
+            states.append(state)
+    except (KeyError, TypeError, IndexError) as error:
+        raise ValueError('Malformed header') from error
+
+    return ((x, y), states)
+
+# A name for a pasted state which isn't already taken
+def pastedName(name : str, taken : Set[str]) -> str:
+    if name not in taken:
+        return name
+
+    number = 2
+    while f'{name}_{number}' in taken:
+        number += 1
+    return f'{name}_{number}'
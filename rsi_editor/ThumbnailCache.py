@@ -0,0 +1,285 @@
+# Cache of the state thumbnails shown in the state list
+
+# In memory, thumbnails are keyed by the content hash of the frame they show and
+# the size they're shown at, so a thumbnail made for one RSI is reused for any
+# other state with the same first frame. The least recently used are dropped
+# once they use too much memory.
+#
+# On disk, each RSI has a pack of its states' thumbnails at each size they're
+# shown at, kept between sessions. Like the frame cache (see FrameCache), a pack
+# records which version of each sheet a thumbnail was made from (by
+# modification time and size), so a thumbnail is only used while its sheet is
+# unchanged on disk and its state unchanged in the editor. Stored thumbnails
+# don't need the state's frames, so the frames of a mapped RSI aren't read just
+# to show the state list. Packs are written in the background after an RSI is
+# opened or saved, never while the list is being drawn, and the least recently
+# used are deleted once the cache grows past its size limit.
+#
+# A pack is laid out as the magic, the offset of the header, the RGBA pixels of
+# each thumbnail one after another, and then the JSON header. The pixels are
+# left uncompressed, so a thumbnail is read straight from the mapped pack.
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+
+import PySide2.QtCore as QtC
+import PySide2.QtGui as QtG
+
+import PIL # type: ignore
+import PIL.Image # type: ignore
+import PIL.ImageQt as PILQt # type: ignore
+
+from .ContentHash import bytesHash
+from .FrameCache import sheetKey
+from .Profiling import profiler, timed
+from .RsiFiles import statePath
+
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+
+# Bump this when the layout of packs or the way thumbnails are drawn changes,
+# so old packs are ignored
+thumbnailPackVersion = 1
+
+packMagic = b'RSITHUMB'
+prefixSize = len(packMagic) + 8
+
+# Size of all the packs before the least recently used are deleted. Packs are
+# raw pixels, so a 100x100 thumbnail takes 40 KB.
+defaultMaxBytes = 256 * 1024 * 1024
+
+# Memory used by thumbnails before the least recently used are dropped. The
+# editor lowers this when memory is short - see Document.enforceMemoryBudget.
+defaultMaxMemoryBytes = 64 * 1024 * 1024
+
+def defaultCacheFolder() -> Optional[Path]:
+    cacheFolder = QtC.QStandardPaths.writableLocation(QtC.QStandardPaths.CacheLocation)
+
+    if cacheFolder == '':
+        return None
+
+    return Path(cacheFolder) / 'thumbnails'
+
+def renderThumbnail(frame : PIL.Image.Image, size : QtC.QSize) -> QtG.QPixmap:
+    return QtG.QPixmap.fromImage(PILQt.ImageQt(frame)).scaled(size)
+
+# The RGBA pixels of a thumbnail, drawn as renderThumbnail draws it. Only
+# QImage is used, as pixmaps can't be made off the GUI thread.
+def thumbnailPixels(frame : PIL.Image.Image, size : Tuple[int, int]) -> bytes:
+    image = PILQt.ImageQt(frame).scaled(QtC.QSize(*size)).convertToFormat(QtG.QImage.Format_RGBA8888)
+    return bytes(image.constBits())
+
+# The pack of an RSI's thumbnails at one size, opened and mapped. Only the
+# thumbnails which are still up to date are kept.
+class ThumbnailPack():
+    def __init__(self, packPath : Path, size : Tuple[int, int]):
+        self.packPath = packPath
+        self.size = size
+
+        # State name -> { 'key', 'offset' }
+        self.entries : Dict[str, Dict[str, Any]] = {}
+        self.mapped : Optional[mmap.mmap] = None
+
+    def has(self, stateName : str) -> bool:
+        return stateName in self.entries
+
+    # Stops using a state's thumbnail, once the state has been changed
+    def discard(self, stateName : str) -> None:
+        self.entries.pop(stateName, None)
+
+    # Identifies the thumbnail in the memory cache
+    def key(self, stateName : str) -> str:
+        return f'{self.packPath.name}:{self.entries[stateName]["key"]}:{stateName}'
+
+    def pixmap(self, stateName : str) -> QtG.QPixmap:
+        assert self.mapped is not None
+
+        (x, y) = self.size
+        offset = self.entries[stateName]['offset']
+
+        # QImage doesn't keep the pixels alive, so they're held until the
+        # pixmap has copied them
+        pixels = self.mapped[offset:offset + x * y * 4]
+        image = QtG.QImage(pixels, x, y, x * 4, QtG.QImage.Format_RGBA8888)
+        return QtG.QPixmap.fromImage(image)
+
+class ThumbnailCache():
+    def __init__(self, cacheFolder : Optional[Path] = None, maxMemoryBytes : int = defaultMaxMemoryBytes, maxBytes : int = defaultMaxBytes):
+        # Least recently used first, along with their size in memory
+        self.icons : OrderedDict[str, Tuple[QtG.QIcon, int]] = OrderedDict()
+        self.memoryBytes = 0
+        self.maxMemoryBytes = maxMemoryBytes
+
+        # Packs aren't kept if this is None
+        self.cacheFolder = cacheFolder
+        self.maxBytes = maxBytes
+
+        # Packs are written one at a time, off the GUI thread
+        self.writer = ThreadPoolExecutor(1)
+
+    # `frameHash` is the frame's content hash (see ContentHash.imageHash)
+    def icon(self, frameHash : str, frame : PIL.Image.Image, size : QtC.QSize) -> QtG.QIcon:
+        def render() -> QtG.QPixmap:
+            with profiler.span('ThumbnailCache.render'):
+                return renderThumbnail(frame, size)
+
+        return self.cachedIcon(f'{frameHash}-{size.width()}x{size.height()}', render, 'thumbnails drawn')
+
+    # A state's thumbnail from its RSI's pack - see ThumbnailPack.has
+    def storedIcon(self, pack : ThumbnailPack, stateName : str) -> QtG.QIcon:
+        return self.cachedIcon(pack.key(stateName), lambda: pack.pixmap(stateName), 'thumbnails read from disk')
+
+    def cachedIcon(self, key : str, makePixmap : Callable[[], QtG.QPixmap], counter : str) -> QtG.QIcon:
+        cached = self.icons.get(key)
+        if cached is not None:
+            self.icons.move_to_end(key)
+            profiler.count('thumbnail cache hits')
+            return cached[0]
+
+        pixmap = makePixmap()
+        profiler.count(counter)
+
+        icon = QtG.QIcon(pixmap)
+        iconBytes = pixmap.width() * pixmap.height() * 4
+        self.icons[key] = (icon, iconBytes)
+        self.memoryBytes += iconBytes
+        self.trimMemory(self.maxMemoryBytes)
+
+        return icon
+
+    # Drops the least recently used thumbnails until they use no more than
+    # `maxBytes`
+    def trimMemory(self, maxBytes : int) -> None:
+        while self.memoryBytes > maxBytes and len(self.icons) != 0:
+            (_key, (_icon, iconBytes)) = self.icons.popitem(last=False)
+            self.memoryBytes -= iconBytes
+
+    # Packs on disk
+
+    def packPath(self, rsiPath : Union[str, Path], size : QtC.QSize) -> Optional[Path]:
+        if self.cacheFolder is None:
+            return None
+
+        key = bytesHash(str(Path(rsiPath).absolute()).encode())
+        return self.cacheFolder / f'{key}-{size.width()}x{size.height()}.thumbnails'
+
+    # Opens the pack of an RSI's thumbnails, keeping only those of the given
+    # states whose sheets haven't changed since they were stored. The pack is
+    # empty if there isn't one yet, and None if packs aren't kept.
+    @timed('ThumbnailCache.openPack')
+    def openPack(self, rsiPath : Union[str, Path], stateNames : Iterable[str], size : QtC.QSize) -> Optional[ThumbnailPack]:
+        packPath = self.packPath(rsiPath, size)
+        if packPath is None:
+            return None
+
+        pack = ThumbnailPack(packPath, (size.width(), size.height()))
+
+        try:
+            with packPath.open('rb') as packFile:
+                prefix = packFile.read(prefixSize)
+                if len(prefix) != prefixSize or prefix[:len(packMagic)] != packMagic:
+                    return pack
+
+                (headerOffset,) = struct.unpack_from('<Q', prefix, len(packMagic))
+                packFile.seek(headerOffset)
+                header = json.loads(packFile.read())
+                if header.get('version') != thumbnailPackVersion or tuple(header['size']) != pack.size:
+                    return pack
+
+                # Stays valid after the file is closed or replaced, as with
+                # frame packs
+                mapped = mmap.mmap(packFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+            os.utime(packPath)
+
+            for name in stateNames:
+                entry = header['states'].get(name)
+                if entry is not None and entry['key'] == sheetKey(statePath(rsiPath, name)):
+                    pack.entries[name] = entry
+        except (OSError, ValueError, KeyError, TypeError):
+            pack.entries = {}
+            return pack
+
+        pack.mapped = mapped
+        return pack
+
+    # Stores the thumbnails of an RSI's states (state name -> the frame shown),
+    # made from the sheets as they are on disk now. The pack is written in the
+    # background - returns the write, or None if packs aren't kept.
+    def savePack(self, rsiPath : Union[str, Path], frames : Dict[str, PIL.Image.Image], size : QtC.QSize) -> Optional[Future]:
+        packPath = self.packPath(rsiPath, size)
+        if packPath is None:
+            return None
+
+        thumbnails = {}
+        for (name, frame) in frames.items():
+            try:
+                thumbnails[name] = (sheetKey(statePath(rsiPath, name)), frame)
+            except OSError:
+                continue
+
+        return self.writer.submit(self.writePack, packPath, (size.width(), size.height()), thumbnails)
+
+    # Written alongside and then moved into place, so a pack is never seen half
+    # written
+    def writePack(self, packPath : Path, size : Tuple[int, int], thumbnails : Dict[str, Tuple[str, PIL.Image.Image]]) -> None:
+        packPath.parent.mkdir(parents=True, exist_ok=True)
+        temporaryPath = packPath.with_name(f'{packPath.name}.{os.getpid()}.tmp')
+
+        states : Dict[str, Dict[str, Any]] = {}
+
+        try:
+            with temporaryPath.open('wb') as packFile:
+                packFile.write(packMagic + struct.pack('<Q', 0))
+                offset = prefixSize
+
+                for (name, (key, frame)) in thumbnails.items():
+                    pixels = thumbnailPixels(frame, size)
+                    packFile.write(pixels)
+
+                    states[name] = { 'key': key, 'offset': offset }
+                    offset += len(pixels)
+
+                header = { 'version': thumbnailPackVersion, 'size': list(size), 'states': states }
+                packFile.write(json.dumps(header).encode())
+                packFile.seek(len(packMagic))
+                packFile.write(struct.pack('<Q', offset))
+
+            os.replace(temporaryPath, packPath)
+        except BaseException:
+            temporaryPath.unlink(missing_ok=True)
+            raise
+
+        self.evict(packPath)
+
+    # Deletes the least recently used packs, other than `keep`, once the cache
+    # is bigger than its limit
+    def evict(self, keep : Path) -> None:
+        assert self.cacheFolder is not None
+
+        packs = []
+        for packPath in self.cacheFolder.glob('*.thumbnails'):
+            try:
+                stat = packPath.stat()
+            except OSError:
+                continue
+            packs.append((stat.st_mtime, stat.st_size, packPath))
+
+        total = sum(packSize for (_time, packSize, _path) in packs)
+        for (_time, packSize, packPath) in sorted(packs):
+            if total <= self.maxBytes:
+                break
+            if packPath == keep:
+                continue
+
+            try:
+                packPath.unlink()
+            except OSError:
+                continue
+            total -= packSize
@@ -1,5 +1,90 @@
+import argparse
+import sys
+
 from .editor import editor
+from .FrameIndex import reportDuplicates
+from .Overview import writeOverview
+from .RsiDiff import reportDiff
+from .RsiMerge import mergeCommand, mergeDriver
+from .PreviewExport import exportRsiPreviews, previewFormats
+from .RsiResize import anchors, resizeModes, resizeRsis
+from .StateIndex import findStates
 
-def main() -> int:
+def runEditor(_args : argparse.Namespace) -> int:
     editor()
     return 0
+
+def main() -> int:
+    # With no arguments, just open the editor
+    if len(sys.argv) <= 1:
+        editor()
+        return 0
+
+    parser = argparse.ArgumentParser(prog='rsi_editor', description='Editor and tools for Robust Station Images')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    editParser = commands.add_parser('edit', help='open the editor')
+    editParser.set_defaults(run=runEditor)
+
+    indexParser = commands.add_parser('index', help='index every RSI under a directory and report duplicated frames and states')
+    indexParser.add_argument('root', help='directory to search for RSIs')
+    indexParser.add_argument('--index', default='', help='index file to use (default: <root>/.rsi-index.json)')
+    indexParser.add_argument('--within-state', action='store_true', help='also report frames repeated within a single state')
+    indexParser.set_defaults(run=lambda args: reportDuplicates(args.root, args.index, args.within_state))
+
+    findParser = commands.add_parser('find', help='search for states by name across every RSI under a directory')
+    findParser.add_argument('root', help='directory to search for RSIs')
+    findParser.add_argument('query', help='state name to search for - letters can be left out')
+    findParser.add_argument('--index', default='', help='index file to use (default: <root>/.rsi-states.json)')
+    findParser.add_argument('--limit', type=int, default=20, help='most matches to show (default: 20)')
+    findParser.set_defaults(run=lambda args: findStates(args.root, args.query, args.index, args.limit))
+
+    previewsParser = commands.add_parser('previews', help='export animated previews of every state of some RSIs')
+    previewsParser.add_argument('rsis', nargs='+', help='RSIs to export previews of')
+    previewsParser.add_argument('-o', '--output', required=True, help='directory to export to - each RSI gets its own folder in it')
+    previewsParser.add_argument('-f', '--format', nargs='+', choices=list(previewFormats.keys()), default=['gif'], help='formats to export (default: gif)')
+    previewsParser.add_argument('--scale', type=int, default=1, help='scale previews up by this factor')
+    previewsParser.add_argument('--workers', type=int, default=None, help='number of processes to render with (default: one per CPU)')
+    previewsParser.set_defaults(run=lambda args: exportRsiPreviews(args.rsis, args.output, args.format, args.scale, args.workers))
+
+    overviewParser = commands.add_parser('overview', help='render an overview of every state of an RSI into one image')
+    overviewParser.add_argument('rsi', help='RSI to render')
+    overviewParser.add_argument('-o', '--output', required=True, help='image file to write')
+    overviewParser.add_argument('--frames', type=int, default=1, help='frames to show of each direction - 0 shows every frame (default: 1)')
+    overviewParser.add_argument('--scale', type=int, default=1, help='scale the overview up by this factor')
+    overviewParser.add_argument('--no-labels', action='store_true', help="don't write state names under each state")
+    overviewParser.set_defaults(run=lambda args: writeOverview(args.rsi, args.output, args.frames, args.scale, not args.no_labels))
+
+    resizeParser = commands.add_parser('resize', help='resize every frame of some RSIs (or every RSI under some directories) in place')
+    resizeParser.add_argument('paths', nargs='+', help='RSIs, or directories to search for RSIs')
+    resizeParser.add_argument('--size', required=True, help='new frame size, e.g. 64x64')
+    resizeParser.add_argument('--mode', choices=resizeModes, default='scale', help='scale frames (nearest neighbour), or pad/crop them onto a canvas of the new size (default: scale)')
+    resizeParser.add_argument('--anchor', choices=list(anchors.keys()), default='centre', help='where frames go on the canvas when padding or cropping (default: centre)')
+    resizeParser.add_argument('--workers', type=int, default=None, help='number of threads to resize with')
+    resizeParser.set_defaults(run=lambda args: resizeRsis(args.paths, args.size, args.mode, args.anchor, args.workers))
+
+    diffParser = commands.add_parser('diff', help='compare two RSIs, or every RSI in two directories - exits with 1 if anything changed')
+    diffParser.add_argument('old', help='old RSI, or directory of RSIs')
+    diffParser.add_argument('new', help='new RSI, or directory of RSIs')
+    diffParser.add_argument('--images', default='', help='directory to write an image of the changed frames of each RSI to')
+    diffParser.add_argument('--json', action='store_true', help='print the differences as JSON')
+    diffParser.set_defaults(run=lambda args: reportDiff(args.old, args.new, args.images, args.json))
+
+    mergeParser = commands.add_parser('merge', help='three-way merge of RSIs, state by state - exits with 1 if there were conflicts')
+    mergeParser.add_argument('base', help='the RSI both versions started from')
+    mergeParser.add_argument('ours', help='our version of the RSI')
+    mergeParser.add_argument('theirs', help='their version of the RSI')
+    mergeParser.add_argument('-o', '--output', default='', help='RSI to write the result to (default: ours)')
+    mergeParser.set_defaults(run=lambda args: mergeCommand(args.base, args.ours, args.theirs, args.output))
+
+    mergeDriverParser = commands.add_parser('merge-driver', help='git merge driver for RSI meta.json files')
+    mergeDriverParser.add_argument('base', help='%%O - the common ancestor')
+    mergeDriverParser.add_argument('ours', help='%%A - our version, overwritten with the result')
+    mergeDriverParser.add_argument('theirs', help='%%B - their version')
+    mergeDriverParser.set_defaults(run=lambda args: mergeDriver(args.base, args.ours, args.theirs))
+
+    args = parser.parse_args()
+    return args.run(args)
+
+if __name__ == '__main__':
+    exit(main())
@@ -9,15 +9,35 @@ import PIL # type: ignore
 import rsi as RSIPy
 
 from .Config import Config, ConfigEditor
+from .DelayTools import Delays, copyTiming, directionDelays, normalise, scale, setAll
+from .Document import Document, enforceMemoryBudget
+from .FrameCache import FrameCache, defaultCacheFolder as defaultFrameFolder
+from .FramePicker import FramePicker
+from .FrameTransforms import Transform, flipHorizontal, flipVertical, hueShift, replaceColour, rotateAnticlockwise, rotateClockwise, rotateHalf, shift, transformStates
 from .ImageEditor import ImageEditor
 from .ItemAction import ItemAction
+from .Journal import Journal, Operation, abandonedJournals, deleteJournal, loadBase, putStateOperation, readJournal, replay
+from .Overview import renderOverview
+from .PngOptimiser import PngOptimiser, defaultCacheFolder
+from .PreviewExport import exportPreviews, previewFormats
+from .ProfilerPanel import ProfilerPanel
 from .Rsi import Rsi, iconSize
+from .ResizeDialog import ResizeDialog
+from .RsiBrowser import RsiBrowser
+from .RsiFiles import directionNames, loadState, metadataSize, metadataStates
+from .RsiResize import resizeStates, resizeTransform
+from .RsiWatcher import RsiWatcher
+from .SheetSlicer import sliceSheet
+from .ShiftDialog import ShiftDialog
 from .State import State
+from .StateFilterModel import StateFilterModel
+from .StateTransfer import StateTransfer, pastedName, statesFromMimeData
+from .ThumbnailCache import ThumbnailCache, defaultCacheFolder as defaultThumbnailFolder
 from .AnimationView import AnimationView
 from .ListView import ListView
 from .SizeDialog import SizeDialog
 
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 
 rsiFileFilter = 'Robust Station Image (*.rsi);;RSI JSON metadata (*.json)'
@@ -31,20 +51,90 @@ class EditorWindow(QtW.QMainWindow):
 
         self.config = Config.load()
 
-        self.undoStack = QtW.QUndoStack(self)
-        self.undoStack.cleanChanged.connect(lambda clean: self.setWindowModified(not clean))
+        # Undo and redo act on the active document's undo stack
+        self.undoGroup = QtW.QUndoGroup(self)
+        self.undoGroup.cleanChanged.connect(lambda clean: self.setWindowModified(not clean))
+
+        # Every open RSI, in tab order - there's always at least one, even if
+        # nothing is open in it
+        self.documents : List[Document] = []
+        self.document = self.createDocument()
+        self.undoGroup.setActiveStack(self.document.undoStack)
+
+        # Counts document switches, for Document.lastActive
+        self.activations = 0
 
         self.editorMenu()
 
-        self.currentRsi : Optional[Rsi] = None
         self.currentState : Optional[State] = None
 
+        # The RSI whose signals the window is connected to
+        self.shownRsi : Optional[Rsi] = None
+
+        # Kept for the whole session, as it caches optimised sheets
+        self.pngOptimiser = PngOptimiser(defaultCacheFolder())
+        self.thumbnailCache = ThumbnailCache(defaultThumbnailFolder())
+        self.frameCache = FrameCache(defaultFrameFolder())
+
+        # Made the first time it's used
+        self.rsiBrowser : Optional[RsiBrowser] = None
+
+        self.rsiWatcher = RsiWatcher(self)
+        self.rsiWatcher.filesChanged.connect(self.rsiFilesChanged)
+
         self.contentLayout()
 
         self.contentMenus()
 
         self.reloadRsi()
 
+        # Wait until the window is shown before offering to recover anything
+        QtC.QTimer.singleShot(0, self.recoverJournals)
+
+    def closeEvent(self, event : QtG.QCloseEvent) -> None:
+        while len(self.documents) > 1 or not self.document.isEmpty():
+            if not self.closeCurrentRsi():
+                event.ignore()
+                return
+
+        event.accept()
+
+    # The active document's RSI, undo stack and journal
+
+    @property
+    def currentRsi(self) -> Optional[Rsi]:
+        return self.document.rsi
+
+    @currentRsi.setter
+    def currentRsi(self, rsi : Optional[Rsi]) -> None:
+        self.document.rsi = rsi
+        self.document.unloaded = False
+
+    @property
+    def undoStack(self) -> QtW.QUndoStack:
+        return self.document.undoStack
+
+    @property
+    def journal(self) -> Optional[Journal]:
+        return self.document.journal
+
+    @journal.setter
+    def journal(self, journal : Optional[Journal]) -> None:
+        self.document.journal = journal
+
+    @property
+    def journalIndex(self) -> int:
+        return self.document.journalIndex
+
+    @journalIndex.setter
+    def journalIndex(self, index : int) -> None:
+        self.document.journalIndex = index
+
+    def setWindowFilePath(self, filePath : str) -> None:
+        QtW.QMainWindow.setWindowFilePath(self, filePath)
+        self.document.path = filePath
+        self.updateDocumentTabs()
+
     def editorMenu(self) -> None:
         fileMenu = self.menuBar().addMenu("&File")
 
@@ -69,11 +159,27 @@ class EditorWindow(QtW.QMainWindow):
         saveAsAction.setShortcut(QtG.QKeySequence.SaveAs)
         saveAsAction.triggered.connect(self.saveAsRsi)
 
+        closeAction = fileMenu.addAction("&Close")
+        closeAction.setShortcut(QtG.QKeySequence.Close)
+        closeAction.triggered.connect(self.closeCurrentRsi)
+
+        fileMenu.addSeparator()
+
+        browseAction = fileMenu.addAction("&Browse RSIs...")
+        browseAction.setShortcut(QtG.QKeySequence('Ctrl+Shift+O'))
+        browseAction.triggered.connect(self.browseRsis)
+
         fileMenu.addSeparator()
 
         importDmiAction = fileMenu.addAction("&Import DMI")
         importDmiAction.triggered.connect(self.importDmi)
 
+        exportPreviewsAction = fileMenu.addAction("Export animated previews...")
+        exportPreviewsAction.triggered.connect(self.exportPreviews)
+
+        exportOverviewAction = fileMenu.addAction("Export overview...")
+        exportOverviewAction.triggered.connect(self.exportOverview)
+
         fileMenu.addSeparator()
 
         # TODO: Set up preferences
@@ -87,19 +193,19 @@ class EditorWindow(QtW.QMainWindow):
         undoAction = editMenu.addAction("&Undo")
         undoAction.setIcon(QtG.QIcon.fromTheme("edit-undo", self.style().standardIcon(QtW.QStyle.SP_ArrowLeft)))
         undoAction.setShortcut(QtG.QKeySequence.Undo)
-        undoAction.triggered.connect(self.undoStack.undo)
+        undoAction.triggered.connect(self.undoGroup.undo)
 
         # Redo
         redoAction = editMenu.addAction("&Redo")
         redoAction.setIcon(QtG.QIcon.fromTheme("edit-redo", self.style().standardIcon(QtW.QStyle.SP_ArrowRight)))
         redoAction.setShortcut(QtG.QKeySequence.Redo)
-        redoAction.triggered.connect(self.undoStack.redo)
+        redoAction.triggered.connect(self.undoGroup.redo)
 
         # Undo history
         undoMenu = editMenu.addMenu("Undo history")
 
         undoHistory = QtW.QUndoView(parent=undoMenu)
-        undoHistory.setStack(self.undoStack)
+        undoHistory.setGroup(self.undoGroup)
         undoAction = QtW.QWidgetAction(undoMenu)
         undoAction.setDefaultWidget(undoHistory)
 
@@ -107,6 +213,11 @@ class EditorWindow(QtW.QMainWindow):
 
         editMenu.addSeparator()
 
+        resizeAction = editMenu.addAction("Re&size RSI...")
+        resizeAction.triggered.connect(self.resizeRsi)
+
+        editMenu.addSeparator()
+
         self.directionGroup = QtW.QActionGroup(editMenu)
 
         for direction in [1, 4, 8]:
@@ -117,6 +228,14 @@ class EditorWindow(QtW.QMainWindow):
         self.directionGroup.setEnabled(False)
         self.directionGroup.triggered.connect(lambda action: self.undoStack.push(SetDirectionsCommand(self, action.data())))
 
+        viewMenu = self.menuBar().addMenu("&View")
+
+        # Hidden until it's opened from the menu
+        self.profilerPanel = ProfilerPanel(self)
+        self.addDockWidget(QtC.Qt.BottomDockWidgetArea, self.profilerPanel)
+        self.profilerPanel.hide()
+        viewMenu.addAction(self.profilerPanel.toggleViewAction())
+
     def contentMenus(self) -> None:
         self.stateContentsMenu()
         self.stateListMenu()
@@ -131,10 +250,31 @@ class EditorWindow(QtW.QMainWindow):
         insertFrameAction = self.stateContents.addItemAction("Add frame")
         insertFrameAction.indexTriggered.connect(self.stateContentsAddFrame)
 
+        reuseFrameAction = self.stateContents.addItemAction("Add existing frame...")
+        reuseFrameAction.indexTriggered.connect(self.stateContentsReuseFrame)
+
         deleteFrameAction = self.stateContents.addItemAction("Delete frame")
         deleteFrameAction.setEnableIf(lambda index: self.stateContents.model().frame(index) is not None)
         deleteFrameAction.indexTriggered.connect(self.stateContentsDeleteFrame)
 
+        delaysAction = self.stateContents.addItemAction("Delays")
+        delaysAction.setAllowMultiple(True)
+        delaysAction.setEnableIf(lambda index: self.stateContents.model().frame(index) is not None)
+        delaysMenu = QtW.QMenu(self)
+        delaysAction.setMenu(delaysMenu)
+
+        # (text, function returning the new delays or None if cancelled)
+        delayEdits : List[Tuple[str, Callable[[Delays], Optional[Delays]]]] = [
+            ("Set delays...", self.askSetDelays),
+            ("Scale delays...", self.askScaleDelays),
+            ("Normalise delays...", self.askNormaliseDelays),
+            ("Copy timing from...", self.askCopyTiming),
+        ]
+
+        for (text, getDelays) in delayEdits:
+            action = delaysMenu.addAction(text)
+            action.triggered.connect(lambda _checked, text=text, getDelays=getDelays: self.editSelectedDelays(text.rstrip('.'), getDelays))
+
     def stateListMenu(self) -> None:
         # Action stuff
 
@@ -145,11 +285,46 @@ class EditorWindow(QtW.QMainWindow):
         importPngAction = self.stateList.addItemAction("Import PNG")
         importPngAction.triggered.connect(self.importPng)
 
+        importSheetAction = self.stateList.addItemAction("Import sprite sheet...")
+        importSheetAction.setCheckValid(False)
+        importSheetAction.triggered.connect(lambda _checked: self.importSheet())
+
+        copyStatesAction = self.stateList.addItemAction("Copy")
+        copyStatesAction.setAllowMultiple(True)
+        copyStatesAction.setShortcut(QtG.QKeySequence.Copy)
+        copyStatesAction.indexTriggered.connect(self.copyStates)
+
+        pasteStatesAction = self.stateList.addItemAction("Paste")
+        pasteStatesAction.setCheckValid(False)
+        pasteStatesAction.setShortcut(QtG.QKeySequence.Paste)
+        pasteStatesAction.triggered.connect(lambda _checked: self.pasteStates())
+
         deleteStateAction = self.stateList.addItemAction("Delete state")
         deleteStateAction.setAllowMultiple(True)
         deleteStateAction.setShortcut(QtG.QKeySequence.Delete)
         deleteStateAction.indexTriggered.connect(self.deleteStates)
 
+        transformAction = self.stateList.addItemAction("Transform")
+        transformAction.setAllowMultiple(True)
+        transformMenu = QtW.QMenu(self)
+        transformAction.setMenu(transformMenu)
+
+        # (text, function returning the transform to use or None if cancelled)
+        transforms : List[Tuple[str, Callable[[], Optional[Transform]]]] = [
+            ("Flip horizontally", lambda: flipHorizontal),
+            ("Flip vertically", lambda: flipVertical),
+            ("Rotate clockwise", lambda: self.quarterTurn(rotateClockwise)),
+            ("Rotate anticlockwise", lambda: self.quarterTurn(rotateAnticlockwise)),
+            ("Rotate half a turn", lambda: rotateHalf),
+            ("Shift...", self.askShift),
+            ("Shift hue...", self.askHueShift),
+            ("Replace colour...", self.askReplaceColour),
+        ]
+
+        for (text, getTransform) in transforms:
+            action = transformMenu.addAction(text)
+            action.triggered.connect(lambda _checked, text=text, getTransform=getTransform: self.transformSelectedStates(text.rstrip('.'), getTransform()))
+
     def contentLayout(self) -> None:
         splitter = QtW.QSplitter()
         splitter.setOrientation(QtC.Qt.Vertical)
@@ -173,7 +348,17 @@ class EditorWindow(QtW.QMainWindow):
         self.stateList.setContextMenuPolicy(QtC.Qt.ActionsContextMenu)
         self.stateList.clicked.connect(self.stateListDrillDown)
 
-        stateLayout = QtW.QHBoxLayout()
+        # The state list shows the current RSI through this
+        self.stateFilter = StateFilterModel(self)
+
+        self.stateFilterInput = QtW.QLineEdit()
+        self.stateFilterInput.setPlaceholderText('Filter states')
+        self.stateFilterInput.setClearButtonEnabled(True)
+        self.stateFilterInput.setEnabled(False)
+        self.stateFilterInput.textChanged.connect(self.stateFilter.setFilterText)
+
+        stateLayout = QtW.QVBoxLayout()
+        stateLayout.addWidget(self.stateFilterInput)
         stateLayout.addWidget(self.stateList)
         stateWidget = QtW.QWidget()
         stateWidget.setLayout(stateLayout)
@@ -200,42 +385,92 @@ class EditorWindow(QtW.QMainWindow):
         splitter.addWidget(stateWidget)
         splitter.addWidget(self.configGroupBox)
 
+        self.documentTabs = QtW.QTabBar()
+        self.documentTabs.setDocumentMode(True)
+        self.documentTabs.setExpanding(False)
+        self.documentTabs.setTabsClosable(True)
+        self.documentTabs.currentChanged.connect(lambda index: self.activateDocument(self.documents[index]))
+        self.documentTabs.tabCloseRequested.connect(self.closeDocument)
 
-        self.setCentralWidget(splitter)
+        centralLayout = QtW.QVBoxLayout()
+        centralLayout.setContentsMargins(0, 0, 0, 0)
+        centralLayout.addWidget(self.documentTabs)
+        centralLayout.addWidget(splitter)
+        centralWidget = QtW.QWidget()
+        centralWidget.setLayout(centralLayout)
+
+        self.setCentralWidget(centralWidget)
+        self.updateDocumentTabs()
 
     def reloadRsi(self) -> None:
+        # Several RSIs can be shown in turn, so only the one being shown is
+        # connected to the window
+        if self.shownRsi is not None:
+            self.shownRsi.stateRenamed.disconnect(self.renameState)
+            self.shownRsi.statesDropped.disconnect(self.dropStates)
+            self.shownRsi.licenseChanged.disconnect(self.showLicense)
+            self.shownRsi.copyrightChanged.disconnect(self.showCopyright)
+            self.shownRsi.sizeChanged.disconnect(self.showSize)
+        self.shownRsi = self.currentRsi
+
         if self.currentRsi is not None:
-            self.stateList.setModel(self.currentRsi)
+            self.currentRsi.thumbnailCache = self.thumbnailCache
+            if self.currentRsi.thumbnailPack is None and self.windowFilePath() != '':
+                self.openThumbnails()
+            self.stateFilter.setSourceModel(self.currentRsi)
+            self.stateList.setModel(self.stateFilter)
             self.stateList.setEnabled(True)
+            self.stateFilterInput.setEnabled(True)
 
             self.currentRsi.stateRenamed.connect(self.renameState)
+            self.currentRsi.statesDropped.connect(self.dropStates)
 
-            (x, y) = self.currentRsi.size
-            self.sizeInfo.setText(f'x: {x}, y: {y}')
+            self.showSize()
+            self.currentRsi.sizeChanged.connect(self.showSize)
 
-            license = self.currentRsi.license
-            if license is not None:
-                self.licenseInput.setText(license)
+            self.showLicense()
             self.licenseInput.setEnabled(True)
-            self.currentRsi.licenseChanged.connect(
-                    lambda : self.licenseInput.setText(self.currentRsi.license) if self.currentRsi.license is not None else None)
+            self.currentRsi.licenseChanged.connect(self.showLicense)
 
-            copyright = self.currentRsi.copyright
-            if copyright is not None:
-                self.copyrightInput.setText(copyright)
+            self.showCopyright()
             self.copyrightInput.setEnabled(True)
-            self.currentRsi.copyrightChanged.connect(
-                    lambda : self.copyrightInput.setText(self.currentRsi.copyright) if self.currentRsi.copyright is not None else None)
+            self.currentRsi.copyrightChanged.connect(self.showCopyright)
 
         else:
             self.stateList.setModel(None)
+            self.stateFilter.setSourceModel(None)
             self.stateList.setEnabled(False)
+            self.stateFilterInput.setEnabled(False)
 
             self.sizeInfo.setText('')
+            self.licenseInput.setText('')
             self.licenseInput.setEnabled(False)
+            self.copyrightInput.setText('')
             self.copyrightInput.setEnabled(False)
 
         self.reloadState()
+        self.applyMemoryBudget()
+
+    def showSize(self) -> None:
+        assert self.currentRsi is not None
+
+        (x, y) = self.currentRsi.size
+        self.sizeInfo.setText(f'x: {x}, y: {y}')
+
+    def showLicense(self) -> None:
+        if self.currentRsi is not None:
+            self.licenseInput.setText(self.currentRsi.license if self.currentRsi.license is not None else '')
+
+    def showCopyright(self) -> None:
+        if self.currentRsi is not None:
+            self.copyrightInput.setText(self.currentRsi.copyright if self.currentRsi.copyright is not None else '')
+
+    # Replaces the state being edited, stopping the animations of the old one
+    def setCurrentState(self, state : Optional[State]) -> None:
+        if self.currentState is not None:
+            self.currentState.dispose()
+
+        self.currentState = state
 
     def reloadState(self) -> None:
 
@@ -258,30 +493,38 @@ class EditorWindow(QtW.QMainWindow):
 
 
     def newRsi(self) -> None:
-        if not self.closeCurrentRsi():
-            return
-
         sizeDialog = SizeDialog(parent = self)
         size = sizeDialog.size()
 
         if size is None:
             return
 
+        self.openDocument()
         self.currentRsi = Rsi.new(size.width(), size.height())
         self.setWindowFilePath('')
+        self.updateWatcher()
+        self.startJournal({ 'size': [size.width(), size.height()] })
         self.reloadRsi()
 
     def openRsi(self) -> None:
-        if not self.closeCurrentRsi():
-            return
-
         rsiFile = QtW.QFileDialog.getExistingDirectory(self, 'Open RSI')
 
         if rsiFile == '':
             return
 
-        self.currentRsi = Rsi.fromFile(rsiFile)
+        self.openRsiPath(rsiFile)
+
+    def openRsiPath(self, rsiFile : str) -> None:
+        for document in self.documents:
+            if document.path != '' and Path(document.path).absolute() == Path(rsiFile).absolute():
+                self.activateDocument(document)
+                return
+
+        self.openDocument()
+        self.currentRsi = Rsi.fromFile(rsiFile, self.mappedFrameCache())
         self.setWindowFilePath(rsiFile)
+        self.updateWatcher()
+        self.startJournal({ 'path': rsiFile })
 
         self.reloadRsi()
 
@@ -296,8 +539,27 @@ class EditorWindow(QtW.QMainWindow):
         if self.config.formatMetadata:
             indent = self.config.metadataIndent
 
-        self.currentRsi.save(self.windowFilePath(), indent)
+        optimiser = self.pngOptimiser if self.config.optimisePng else None
+
+        if self.config.stagedSave:
+            timings = self.currentRsi.saveStaged(self.windowFilePath(), indent, optimiser)
+            self.statusBar().showMessage(
+                    f'Saved in {timings["total"]:.0f} ms (write {timings["write"]:.0f} ms, sync {timings["sync"]:.0f} ms, swap {timings["swap"]:.0f} ms)',
+                    5000)
+        else:
+            self.currentRsi.save(self.windowFilePath(), indent, optimiser)
+        self.currentRsi.markSaved()
         self.undoStack.setClean()
+        self.updateWatcher()
+
+        # The sheets have all been written again, so the stored thumbnails
+        # need to be as well
+        self.thumbnailCache.savePack(self.windowFilePath(), self.currentRsi.thumbnailFrames(), iconSize)
+
+        # Everything journaled so far is now in the saved RSI
+        if self.journal is not None:
+            self.journal.reset({ 'path': self.windowFilePath() })
+
         return True
 
     def saveAsRsi(self) -> bool:
@@ -309,42 +571,169 @@ class EditorWindow(QtW.QMainWindow):
 
         return self.saveRsi()
 
-    def importDmi(self) -> None:
-        if not self.closeCurrentRsi():
+    def browseRsis(self) -> None:
+        if self.rsiBrowser is None:
+            self.rsiBrowser = RsiBrowser(self.config.browserRoot, self.thumbnailCache, self)
+            self.rsiBrowser.stateChosen.connect(self.openState)
+            self.rsiBrowser.rootChanged.connect(self.setBrowserRoot)
+        else:
+            # Catch up with anything changed since it was last shown
+            self.rsiBrowser.rescan()
+
+        self.rsiBrowser.show()
+        self.rsiBrowser.raise_()
+        self.rsiBrowser.activateWindow()
+
+    def setBrowserRoot(self, root : str) -> None:
+        self.config.browserRoot = root
+        self.config.save()
+
+    # Opens an RSI (if it isn't open already) and shows one of its states
+    def openState(self, rsiFile : str, stateName : str) -> None:
+        self.openRsiPath(rsiFile)
+
+        if self.currentRsi is None:
+            return
+
+        sourceIndex = self.currentRsi.getStateIndex(stateName)
+        if not sourceIndex.isValid():
             return
 
+        # The state has to be shown to be selected
+        if not self.stateFilter.mapFromSource(sourceIndex).isValid():
+            self.stateFilterInput.clear()
+
+        stateIndex = self.stateFilter.mapFromSource(sourceIndex)
+        self.stateList.setCurrentIndex(stateIndex)
+        self.stateList.scrollTo(stateIndex)
+        self.stateListDrillDown(stateIndex)
+
+    def importDmi(self) -> None:
         (dmiFile, _) = QtW.QFileDialog.getOpenFileName(self, 'Import DMI', filter=dmiFileFilter)
 
         if dmiFile == '':
             return
 
+        self.openDocument()
         self.currentRsi = Rsi.fromDmi(dmiFile)
         self.setWindowFilePath('')
+        self.updateWatcher()
+        self.startJournal({ 'dmi': dmiFile })
 
         self.reloadRsi()
     
     def importPng(self) -> None:
+        if self.currentRsi is None:
+            return
+
         (pngFile, _) = QtW.QFileDialog.getOpenFileName(self, 'Import PNG', filter=pngFileFilter)
 
         if pngFile == '':
             return
         
-        fileName = Path(pngFile).stem
-        
-        self.currentRsi.addState(fileName)
+        fileName = pastedName(Path(pngFile).stem, set(self.currentRsi.states.keys()))
 
-        self.currentState = State(self.currentRsi, fileName)
-        self.stateContentsAddFrame(self.currentState.createIndex(0,0))
-        self.setFrameDelay(self.currentState.createIndex(0,0), 1.0)
+        with PIL.Image.open(Path(pngFile)) as image:
+            frame = image.convert('RGBA')
 
-        load_image = PIL.Image.open(Path(pngFile))
-        self.currentState.setFrame(self.currentState.createIndex(0,0), load_image)
+        # Added through the undo stack, so that it's journaled along with
+        # everything done to it afterwards
+        importedState = RSIPy.State(fileName, self.currentRsi.size, 1)
+        importedState.icons[0].append(frame)
+        importedState.delays[0].append(1.0)
+        self.undoStack.push(AddStatesCommand(self, 'Import PNG', { fileName: importedState }))
 
+        state = State(self.currentRsi, fileName)
+        self.setCurrentState(state)
 
         self.reloadState()
 
         self.reloadRsi()
 
+    def importSheet(self) -> None:
+        if self.currentRsi is None:
+            return
+
+        (sheetFile, _) = QtW.QFileDialog.getOpenFileName(self, 'Import sprite sheet', filter=pngFileFilter)
+
+        if sheetFile == '':
+            return
+
+        choices = ['Work out from the sheet', '1', '4', '8']
+        (choice, accepted) = QtW.QInputDialog.getItem(self, 'Import sprite sheet', 'Directions (one row each):', choices, editable=False)
+        if not accepted:
+            return
+
+        directions = None if choice == choices[0] else int(choice)
+
+        try:
+            with PIL.Image.open(sheetFile) as sheet:
+                states = sliceSheet(sheet, self.currentRsi.size, Path(sheetFile).stem, directions)
+        except OSError as error:
+            QtW.QMessageBox.warning(self, 'Can\'t import sprite sheet', f'{sheetFile} couldn\'t be read: {error}')
+            return
+
+        if len(states) == 0:
+            (x, y) = self.currentRsi.size
+            QtW.QMessageBox.warning(self, 'Can\'t import sprite sheet', f'There are no {x}x{y} frames in {sheetFile} with anything in them.')
+            return
+
+        self.addStates('Import sprite sheet', StateTransfer(self.currentRsi.size, states))
+
+    def exportPreviews(self) -> None:
+        if self.currentRsi is None:
+            return
+
+        outputFolder = QtW.QFileDialog.getExistingDirectory(self, 'Export animated previews')
+
+        if outputFolder == '':
+            return
+
+        (previewFormat, accepted) = QtW.QInputDialog.getItem(self, 'Export animated previews', 'Format:', list(previewFormats.keys()), editable=False)
+
+        if not accepted:
+            return
+
+        progressDialog = QtW.QProgressDialog('Exporting previews...', 'Cancel', 0, 0, self)
+        progressDialog.setWindowModality(QtC.Qt.WindowModal)
+        progressDialog.setMinimumDuration(500)
+
+        def progress(done : int, total : int) -> bool:
+            progressDialog.setMaximum(total)
+            progressDialog.setValue(done)
+            QtW.QApplication.processEvents()
+            return not progressDialog.wasCanceled()
+
+        try:
+            (rendered, skipped, failed) = exportPreviews(dict(self.currentRsi.states), outputFolder, [previewFormat], progress=progress)
+            cancelled = progressDialog.wasCanceled()
+        finally:
+            progressDialog.reset()
+
+        if cancelled:
+            self.statusBar().showMessage(f'Export cancelled - exported previews of {rendered} states', 5000)
+        else:
+            self.statusBar().showMessage(f'Exported previews of {rendered} states ({skipped} unchanged)', 5000)
+
+        if len(failed) != 0:
+            errors = '\n'.join(f'{name}: {error}' for name, error in sorted(failed.items()))
+            QtW.QMessageBox.warning(self, 'Some previews weren\'t exported', f'These states could not be rendered:\n{errors}')
+
+    def exportOverview(self) -> None:
+        if self.currentRsi is None:
+            return
+
+        (overviewFile, _) = QtW.QFileDialog.getSaveFileName(self, 'Export overview', filter=pngFileFilter)
+
+        if overviewFile == '':
+            return
+
+        QtW.QApplication.setOverrideCursor(QtC.Qt.WaitCursor)
+        try:
+            renderOverview(list(self.currentRsi.states.values()), self.currentRsi.size).save(overviewFile, format='PNG')
+        finally:
+            QtW.QApplication.restoreOverrideCursor()
+
     def setRsiPath(self) -> bool:
         rsiPath = QtW.QFileDialog.getExistingDirectory(self, 'Save RSI')
 
@@ -374,18 +763,136 @@ class EditorWindow(QtW.QMainWindow):
 
         if response:
             self.currentRsi = None
-            self.currentState = None
-            self.reloadRsi()
+            self.setCurrentState(None)
+            self.stopJournal()
 
             self.undoStack.clear()
+            self.journalIndex = 0
+
+            if len(self.documents) > 1:
+                closed = self.document
+                closedIndex = self.documents.index(closed)
+                self.documents.remove(closed)
+
+                self.activateDocument(self.documents[min(closedIndex, len(self.documents) - 1)])
+
+                self.undoGroup.removeStack(closed.undoStack)
+                closed.undoStack.deleteLater()
+            else:
+                self.setWindowFilePath('')
+                self.updateWatcher()
+                self.reloadRsi()
 
         return response
 
+    # Documents
+
+    def createDocument(self) -> Document:
+        document = Document(self.undoGroup)
+        document.undoStack.indexChanged.connect(self.journalUndoStack)
+        document.undoStack.cleanChanged.connect(lambda _clean: self.updateDocumentTabs())
+
+        self.documents.append(document)
+        return document
+
+    # Gets a document ready to have an RSI opened in it - the active one, if
+    # nothing is open in it, otherwise a new one
+    def openDocument(self) -> None:
+        if not self.document.isEmpty():
+            self.activateDocument(self.createDocument())
+
+    def activateDocument(self, document : Document) -> None:
+        if document is not self.document:
+            self.document.stateName = self.currentState.name() if self.currentState is not None else None
+            self.setCurrentState(None)
+            self.document = document
+
+        self.activations += 1
+        document.lastActive = self.activations
+
+        if document.unloaded:
+            QtW.QApplication.setOverrideCursor(QtC.Qt.WaitCursor)
+            try:
+                document.load(self.mappedFrameCache())
+            except Exception as error:
+                document.unloaded = False
+                QtW.QMessageBox.warning(self, 'Could not reload RSI', f'{document.path} could not be read again: {error}')
+            finally:
+                QtW.QApplication.restoreOverrideCursor()
+
+        self.undoGroup.setActiveStack(document.undoStack)
+        QtW.QMainWindow.setWindowFilePath(self, document.path)
+        self.updateWatcher()
+        self.reloadRsi()
+
+        stateName = document.stateName
+        if self.currentRsi is not None and stateName is not None and stateName in self.currentRsi.states:
+            self.setCurrentState(State(self.currentRsi, stateName))
+            self.reloadState()
+
+        self.updateDocumentTabs()
+
+    def updateDocumentTabs(self) -> None:
+        self.documentTabs.blockSignals(True)
+
+        while self.documentTabs.count() < len(self.documents):
+            self.documentTabs.addTab('')
+        while self.documentTabs.count() > len(self.documents):
+            self.documentTabs.removeTab(self.documentTabs.count() - 1)
+
+        for (index, document) in enumerate(self.documents):
+            self.documentTabs.setTabText(index, document.title() + ('' if document.undoStack.isClean() else '*'))
+            self.documentTabs.setTabToolTip(index, document.path)
+
+        self.documentTabs.setCurrentIndex(self.documents.index(self.document))
+        self.documentTabs.setVisible(len(self.documents) > 1)
+
+        self.documentTabs.blockSignals(False)
+
+    def closeDocument(self, index : int) -> None:
+        self.activateDocument(self.documents[index])
+        self.closeCurrentRsi()
+
+    # Uses the thumbnails stored for the current RSI in earlier sessions, and
+    # stores any which are missing
+    def openThumbnails(self) -> None:
+        assert self.currentRsi is not None
+
+        pack = self.thumbnailCache.openPack(self.windowFilePath(), self.currentRsi.states.keys(), iconSize)
+        if pack is None:
+            return
+
+        # Recovered changes are made before the RSI is shown
+        for name in self.currentRsi.modifiedStates:
+            pack.discard(name)
+        self.currentRsi.thumbnailPack = pack
+
+        if any(not pack.has(name) for name in self.currentRsi.states.keys()):
+            self.thumbnailCache.savePack(self.windowFilePath(), self.currentRsi.thumbnailFrames(), iconSize)
+
+    # The frame cache to open RSIs through, if they're opened that way
+    def mappedFrameCache(self) -> Optional[FrameCache]:
+        return self.frameCache if self.config.mapFrames else None
+
+    # Frees the frames of documents which haven't been used for a while, if
+    # the open RSIs are using more memory than they're allowed
+    def applyMemoryBudget(self) -> None:
+        unloaded = enforceMemoryBudget(self.documents, self.document, self.thumbnailCache, self.config.memoryBudget * 1024 * 1024)
+
+        if len(unloaded) != 0:
+            self.statusBar().showMessage(f'Freed the images of {", ".join(document.title() for document in unloaded)} to save memory', 5000)
+
+    # The state at an index of the state list, which may be filtered
+    def stateListState(self, stateListIndex : QtC.QModelIndex) -> RSIPy.State:
+        assert self.currentRsi is not None
+
+        return self.currentRsi.getState(self.stateFilter.mapToSource(stateListIndex))
+
     def stateListDrillDown(self, stateListIndex : QtC.QModelIndex) -> None:
         assert self.currentRsi is not None
 
-        state = self.currentRsi.getState(stateListIndex)
-        self.currentState = State(self.currentRsi, state.name)
+        state = self.stateListState(stateListIndex)
+        self.setCurrentState(State(self.currentRsi, state.name))
         self.reloadState()
 
     def stateContentsEdit(self, stateIndex : QtC.QModelIndex) -> None:
@@ -401,6 +908,14 @@ class EditorWindow(QtW.QMainWindow):
     def stateContentsAddFrame(self, frameIndex : QtC.QModelIndex) -> None:
         self.undoStack.push(NewFrameCommand(self, frameIndex))
 
+    def stateContentsReuseFrame(self, frameIndex : QtC.QModelIndex) -> None:
+        assert self.currentRsi is not None
+
+        image = FramePicker(self.currentRsi.uniqueFrames(), iconSize, parent=self).frame()
+
+        if image is not None:
+            self.undoStack.push(NewFrameCommand(self, frameIndex, image))
+
     def stateContentsDeleteFrame(self, frameIndex : QtC.QModelIndex) -> None:
         self.undoStack.push(DeleteFrameCommand(self, frameIndex))
 
@@ -410,18 +925,209 @@ class EditorWindow(QtW.QMainWindow):
         if self.currentState.delay(frameIndex) != delay:
             self.undoStack.push(EditDelayCommand(self, frameIndex, delay))
 
+    # Editing many delays at once
+
+    def editSelectedDelays(self, text : str, getDelays : Callable[[Delays], Optional[Delays]]) -> None:
+        if self.currentState is None:
+            return
+
+        indexes = self.stateContents.selectionModel().selectedIndexes()
+        if len(indexes) == 0:
+            indexes = [self.stateContents.currentIndex()]
+
+        delays = {}
+        for index in indexes:
+            delay = self.currentState.delay(index)
+            if delay is not None:
+                delays[(index.row(), index.column())] = delay
+
+        if len(delays) == 0:
+            return
+
+        newDelays = getDelays(delays)
+        if newDelays is None:
+            return
+
+        changed = { position: delay for (position, delay) in newDelays.items() if delays[position] != delay }
+        if len(changed) != 0:
+            self.undoStack.push(EditDelaysCommand(self, text, changed))
+
+    def askSetDelays(self, delays : Delays) -> Optional[Delays]:
+        (delay, accepted) = QtW.QInputDialog.getDouble(self, 'Set delays', 'Delay (seconds):', next(iter(delays.values())), 0, 1000, 3)
+        return setAll(delays, delay) if accepted else None
+
+    def askScaleDelays(self, delays : Delays) -> Optional[Delays]:
+        (factor, accepted) = QtW.QInputDialog.getDouble(self, 'Scale delays', 'Multiply delays by:', 1, 0, 1000, 3)
+        return scale(delays, factor) if accepted else None
+
+    def askNormaliseDelays(self, delays : Delays) -> Optional[Delays]:
+        firstDirection = min(direction for (direction, _frame) in delays.keys())
+        currentTotal = sum(delay for ((direction, _frame), delay) in delays.items() if direction == firstDirection)
+
+        (total, accepted) = QtW.QInputDialog.getDouble(self, 'Normalise delays', 'Total for each direction (seconds):', currentTotal, 0, 1000, 3)
+        return normalise(delays, total) if accepted else None
+
+    def askCopyTiming(self, delays : Delays) -> Optional[Delays]:
+        assert self.currentRsi is not None
+
+        # Every direction of every state
+        sources : Dict[str, List[float]] = {}
+        for (name, state) in self.currentRsi.states.items():
+            for direction in range(state.directions):
+                label = name if state.directions == 1 else f'{name}: {directionNames[direction]}'
+                sources[label] = directionDelays(state.delays[direction])
+
+        (source, accepted) = QtW.QInputDialog.getItem(self, 'Copy timing', 'Copy delays from:', list(sources.keys()), editable=False)
+        return copyTiming(delays, sources[source]) if accepted else None
+
     def renameState(self, oldStateName : str, newStateName : str) -> None:
         if oldStateName != newStateName:
             self.undoStack.push(RenameStateCommand(self, oldStateName, newStateName))
 
+    # Copying states
+
+    def copyStates(self, indexes : List[QtC.QModelIndex]) -> None:
+        indexes = [index for index in indexes if index.isValid()]
+        if len(indexes) != 0:
+            QtW.QApplication.clipboard().setMimeData(self.stateList.model().mimeData(indexes))
+
+    def pasteStates(self) -> None:
+        transfer = statesFromMimeData(QtW.QApplication.clipboard().mimeData())
+        if transfer is None:
+            self.statusBar().showMessage('There are no states to paste', 5000)
+            return
+
+        self.addStates('Paste states', transfer)
+
+    def dropStates(self, transfer : StateTransfer) -> None:
+        self.addStates('Drop states', transfer)
+
+    def addStates(self, text : str, transfer : StateTransfer) -> None:
+        if self.currentRsi is None or len(transfer.states) == 0:
+            return
+
+        if transfer.size != self.currentRsi.size:
+            (x, y) = transfer.size
+            (rsiX, rsiY) = self.currentRsi.size
+            QtW.QMessageBox.warning(self, 'Can\'t add states', f'The states are {x}x{y}, but the frames of this RSI are {rsiX}x{rsiY}.')
+            return
+
+        # States are never overwritten, so clashing names are given a number
+        taken = set(self.currentRsi.states.keys())
+        states : Dict[str, RSIPy.State] = {}
+        for state in transfer.states:
+            state.name = pastedName(state.name, taken)
+            taken.add(state.name)
+            states[state.name] = state
+
+        self.undoStack.push(AddStatesCommand(self, text, states))
+
+    # Transforming frames
+
+    def transformSelectedStates(self, text : str, transform : Optional[Transform]) -> None:
+        if self.currentRsi is None or transform is None:
+            return
+
+        indexes = self.stateList.selectionModel().selectedIndexes()
+        if len(indexes) == 0:
+            indexes = [self.stateList.currentIndex()]
+
+        stateNames = [self.stateListState(index).name for index in indexes if index.isValid()]
+        if len(stateNames) == 0:
+            return
+
+        transformed = transformStates([self.currentRsi.states[name] for name in stateNames], self.currentRsi.size, transform)
+        self.undoStack.push(ReplaceStatesCommand(self, text, dict(zip(stateNames, transformed))))
+
+    def resizeRsi(self) -> None:
+        if self.currentRsi is None:
+            return
+
+        result = ResizeDialog(self.currentRsi.size, parent=self).resize()
+        if result is None:
+            return
+
+        (size, mode, anchor) = result
+        if size == self.currentRsi.size:
+            return
+
+        progressDialog = QtW.QProgressDialog('Resizing frames...', 'Cancel', 0, 0, self)
+        progressDialog.setWindowModality(QtC.Qt.WindowModal)
+        progressDialog.setMinimumDuration(500)
+
+        def progress(done : int, total : int) -> bool:
+            progressDialog.setMaximum(total)
+            progressDialog.setValue(done)
+            QtW.QApplication.processEvents()
+            return not progressDialog.wasCanceled()
+
+        names = list(self.currentRsi.states.keys())
+        try:
+            resized = resizeStates(list(self.currentRsi.states.values()), size, resizeTransform(size, mode, anchor), progress=progress)
+        finally:
+            progressDialog.reset()
+
+        if resized is not None:
+            self.undoStack.push(ResizeRsiCommand(self, size, dict(zip(names, resized))))
+
+    # Quarter turns would change the shape of frames which aren't square
+    def quarterTurn(self, transform : Transform) -> Optional[Transform]:
+        assert self.currentRsi is not None
+
+        (x, y) = self.currentRsi.size
+        if x != y:
+            QtW.QMessageBox.warning(self, 'Can\'t rotate', 'Only square frames can be rotated by a quarter turn.')
+            return None
+
+        return transform
+
+    def askShift(self) -> Optional[Transform]:
+        assert self.currentRsi is not None
+
+        result = ShiftDialog(self.currentRsi.size, parent=self).shift()
+        if result is None:
+            return None
+
+        (x, y, wrap) = result
+        return shift(x, y, wrap)
+
+    def askHueShift(self) -> Optional[Transform]:
+        (degrees, accepted) = QtW.QInputDialog.getInt(self, 'Shift hue', 'Degrees:', 0, -180, 180)
+        if not accepted:
+            return None
+
+        return hueShift(degrees)
+
+    def askReplaceColour(self) -> Optional[Transform]:
+        old = QtW.QColorDialog.getColor(parent=self, title='Colour to replace', options=QtW.QColorDialog.ShowAlphaChannel)
+        if not old.isValid():
+            return None
+
+        new = QtW.QColorDialog.getColor(old, parent=self, title='Replace with', options=QtW.QColorDialog.ShowAlphaChannel)
+        if not new.isValid():
+            return None
+
+        return replaceColour(old.getRgb(), new.getRgb())
+
+    # Shows the new version of the current state, if it has been replaced
+    def refreshCurrentState(self, stateNames : List[str]) -> None:
+        assert self.currentRsi is not None
+
+        if self.currentState is not None and self.currentState.name() in stateNames:
+            if self.currentState.name() in self.currentRsi.states:
+                self.setCurrentState(State(self.currentRsi, self.currentState.name()))
+            else:
+                self.setCurrentState(None)
+            self.reloadState()
+
     def deleteStates(self, states : List[QtC.QModelIndex]) -> None:
         assert self.currentRsi is not None
         
-        stateNames = [ self.currentRsi.getState(index).name for index in states ]
+        stateNames = [ self.stateListState(index).name for index in states ]
 
         for stateName in stateNames:
             if self.currentState is not None and self.currentState.name() == stateName:
-                self.currentState = None
+                self.setCurrentState(None)
                 self.reloadState()
 
         self.undoStack.push(DeleteStatesCommand(self, stateNames))
@@ -443,6 +1149,190 @@ class EditorWindow(QtW.QMainWindow):
 
         if configEdited:
             self.config.save()
+            self.updateWatcher()
+
+    # Watching for changes made outside the editor
+
+    def updateWatcher(self) -> None:
+        rsiPath = self.windowFilePath()
+
+        if self.currentRsi is None or rsiPath == '' or not self.config.watchFiles:
+            self.rsiWatcher.stop()
+        else:
+            # Always start over, as a staged save replaces the whole directory
+            self.rsiWatcher.watch(rsiPath)
+
+    # Merges changes made on disk into the open RSI. States without unsaved
+    # changes are simply reloaded - the user is only asked about states which
+    # were changed in both places.
+    def rsiFilesChanged(self, changedStates : List[str], removedStates : List[str], headerChanged : bool) -> None:
+        if self.currentRsi is None:
+            return
+
+        metadata = self.rsiWatcher.knownMetadata
+
+        if metadataSize(metadata) != self.currentRsi.size:
+            self.reloadChangedRsi()
+            return
+
+        conflicts = [name for name in changedStates if name in self.currentRsi.modifiedStates]
+        if headerChanged and self.currentRsi.metadataModified:
+            conflicts.append('License and copyright')
+
+        takeDisk = False
+        if len(conflicts) != 0:
+            conflictReply = QtW.QMessageBox.question(
+                    self,
+                    'Files changed on disk',
+                    'These were changed on disk, but also have unsaved changes:\n\n'
+                        + '\n'.join(conflicts)
+                        + '\n\nReplace your changes with the versions on disk?',
+                    buttons=QtW.QMessageBox.Yes|QtW.QMessageBox.No,
+                    defaultButton=QtW.QMessageBox.No)
+
+            takeDisk = conflictReply == QtW.QMessageBox.Yes
+
+        header : Optional[Tuple[Optional[str], Optional[str]]] = None
+        if headerChanged and (takeDisk or not self.currentRsi.metadataModified):
+            header = (metadata.get('license'), metadata.get('copyright'))
+
+        diskStates = metadataStates(metadata)
+        reloaded : Dict[str, Optional[RSIPy.State]] = {}
+
+        for name in changedStates:
+            if name in self.currentRsi.modifiedStates and not takeDisk:
+                continue
+
+            try:
+                reloaded[name] = loadState(self.windowFilePath(), diskStates[name], self.currentRsi.size)
+            except OSError:
+                # The sheet is probably still being written
+                continue
+
+        for name in removedStates:
+            if name in self.currentRsi.states and name not in self.currentRsi.modifiedStates:
+                reloaded[name] = None
+
+        if header is None and len(reloaded) == 0:
+            return
+
+        # Reloading goes through the undo stack, so that undoing past it puts
+        # back the states the earlier commands were made on. It's not an
+        # unsaved change though.
+        wasClean = self.undoStack.isClean()
+        self.undoStack.push(ReloadStatesCommand(self, reloaded, header))
+        if wasClean:
+            self.undoStack.setClean()
+
+    # Changes which can't be merged (like a new size) need the whole RSI reloaded
+    def reloadChangedRsi(self) -> None:
+        if not self.undoStack.isClean():
+            reloadReply = QtW.QMessageBox.question(
+                    self,
+                    'RSI changed on disk',
+                    'The RSI was changed on disk in a way that can\'t be merged with your unsaved changes - reload it and discard your changes?',
+                    buttons=QtW.QMessageBox.Yes|QtW.QMessageBox.No,
+                    defaultButton=QtW.QMessageBox.No)
+
+            if reloadReply != QtW.QMessageBox.Yes:
+                return
+
+        self.currentRsi = Rsi.fromFile(self.windowFilePath(), self.mappedFrameCache())
+        self.setCurrentState(None)
+        self.stopJournal()
+        self.undoStack.clear()
+        self.journalIndex = 0
+        self.updateWatcher()
+        self.startJournal({ 'path': self.windowFilePath() })
+        self.reloadRsi()
+
+    # Crash recovery
+
+    def startJournal(self, base : Dict[str, Any]) -> None:
+        self.stopJournal()
+
+        try:
+            self.journal = Journal.create(base)
+        except OSError:
+            # The editor still works without a journal, just without recovery
+            self.journal = None
+
+    def stopJournal(self) -> None:
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+
+    # Works out which commands were done or undone from how the undo stack's
+    # index moved, and journals them
+    def journalUndoStack(self, index : int) -> None:
+        operations : List[Operation] = []
+
+        if self.journal is not None:
+            if index > self.journalIndex:
+                for commandIndex in range(self.journalIndex, index):
+                    command = self.undoStack.command(commandIndex)
+                    if command is not None:
+                        operations.extend(command.journal(False))
+            elif index < self.journalIndex:
+                for commandIndex in reversed(range(index, self.journalIndex)):
+                    command = self.undoStack.command(commandIndex)
+                    if command is not None:
+                        operations.extend(command.journal(True))
+            elif index > 0:
+                # The index doesn't move when a command is merged into the
+                # previous one
+                command = self.undoStack.command(index - 1)
+                if command is not None:
+                    operations.extend(command.journal(False))
+
+            self.journal.record(operations)
+
+        self.journalIndex = index
+
+    def recoverJournals(self) -> None:
+        for folder in abandonedJournals():
+            (base, operations) = readJournal(folder)
+
+            if len(operations) == 0:
+                deleteJournal(folder)
+                continue
+
+            rsiName = base.get('path', base.get('dmi', 'a new RSI'))
+
+            recoverReply = QtW.QMessageBox.question(
+                    self,
+                    'Recover unsaved changes?',
+                    f'RSI-editor did not exit cleanly while editing {rsiName}. Recover the unsaved changes?',
+                    buttons=QtW.QMessageBox.Yes|QtW.QMessageBox.No,
+                    defaultButton=QtW.QMessageBox.Yes)
+
+            if recoverReply != QtW.QMessageBox.Yes:
+                deleteJournal(folder)
+                continue
+
+            journal = Journal.resume(folder)
+            if journal is None:
+                continue
+
+            try:
+                rsi = loadBase(base)
+                assert rsi is not None
+                replay(folder, rsi, operations)
+            except Exception as error:
+                journal.discard()
+                QtW.QMessageBox.warning(self, 'Recovery failed', f'The unsaved changes could not be recovered: {error}')
+                continue
+
+            self.openDocument()
+            self.currentRsi = rsi
+            self.setWindowFilePath(base.get('path', ''))
+            self.journal = journal
+            self.updateWatcher()
+            self.reloadRsi()
+
+            # The recovered changes aren't saved, but aren't on the undo stack
+            # either
+            self.undoStack.resetClean()
 
 ##############################
 ### COMMANDS FOR UNDO/REDO ###
@@ -451,6 +1341,15 @@ class EditorWindow(QtW.QMainWindow):
 SetLicenseCommandId = 100
 SetCopyrightCommandId = 101
 
+# Every command also has a `journal` method, which describes what was just done
+# (or undone) as operations for the crash recovery journal - see Journal.py
+
+# A journal operation on a single frame of the current state
+def frameOperation(editor : EditorWindow, kind : str, frameIndex : QtC.QModelIndex, **fields : Any) -> Operation:
+    assert editor.currentState is not None
+
+    return { 'op': kind, 'state': editor.currentState.name(), 'row': frameIndex.row(), 'column': frameIndex.column(), **fields }
+
 class SetLicenseCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, oldLicense : Optional[str], newLicense : Optional[str]):
         QtW.QUndoCommand.__init__(self)
@@ -480,6 +1379,9 @@ class SetLicenseCommand(QtW.QUndoCommand):
 
         self.editor.currentRsi.setLicense(self.oldLicense)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        return [{ 'op': 'license', 'value': self.oldLicense if undone else self.newLicense }]
+
 class SetCopyrightCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, oldCopyright : Optional[str], newCopyright : Optional[str]):
         QtW.QUndoCommand.__init__(self)
@@ -509,6 +1411,9 @@ class SetCopyrightCommand(QtW.QUndoCommand):
         
         self.editor.currentRsi.setCopyright(self.oldCopyright)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        return [{ 'op': 'copyright', 'value': self.oldCopyright if undone else self.newCopyright }]
+
 class NewStateCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow):
         QtW.QUndoCommand.__init__(self)
@@ -540,6 +1445,11 @@ class NewStateCommand(QtW.QUndoCommand):
         
         self.editor.currentRsi.removeState(self.newStateName)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        if undone:
+            return [{ 'op': 'removeState', 'name': self.newStateName }]
+        return [{ 'op': 'addState', 'name': self.newStateName }]
+
 class DeleteStatesCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, stateNames : List[str]):
         QtW.QUndoCommand.__init__(self)
@@ -564,8 +1474,47 @@ class DeleteStatesCommand(QtW.QUndoCommand):
         assert self.editor.currentRsi is not None
         assert self.deleted is not None
 
-        for name, state in self.deleted.items():
-            self.editor.currentRsi.addState(name, state)
+        with self.editor.currentRsi.batchUpdate():
+            for name, state in self.deleted.items():
+                self.editor.currentRsi.addState(name, state)
+
+    def journal(self, undone : bool) -> List[Operation]:
+        assert self.deleted is not None
+
+        if undone:
+            return [putStateOperation(name, state) for name, state in self.deleted.items()]
+        return [{ 'op': 'removeState', 'name': name } for name in self.deleted.keys()]
+
+# Adds whole states at once, e.g. when pasting them
+class AddStatesCommand(QtW.QUndoCommand):
+    def __init__(self, editor : EditorWindow, text : str, states : Dict[str, RSIPy.State]):
+        QtW.QUndoCommand.__init__(self)
+
+        self.editor = editor
+        self.states = states
+
+        self.setText(text)
+
+    def id(self) -> int:
+        return -1
+
+    def redo(self) -> None:
+        assert self.editor.currentRsi is not None
+
+        with self.editor.currentRsi.batchUpdate():
+            for name, state in self.states.items():
+                self.editor.currentRsi.addState(name, state)
+
+    def undo(self) -> None:
+        assert self.editor.currentRsi is not None
+
+        self.editor.currentRsi.removeStates(list(self.states.keys()))
+        self.editor.refreshCurrentState(list(self.states.keys()))
+
+    def journal(self, undone : bool) -> List[Operation]:
+        if undone:
+            return [{ 'op': 'removeState', 'name': name } for name in self.states.keys()]
+        return [putStateOperation(name, state) for name, state in self.states.items()]
 
 class RenameStateCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, oldStateName : str, newStateName : str):
@@ -594,6 +1543,159 @@ class RenameStateCommand(QtW.QUndoCommand):
         if self.overwritten != None:
             self.editor.currentRsi.addState(self.newStateName, self.overwritten)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        if undone:
+            operations = [{ 'op': 'renameState', 'old': self.newStateName, 'new': self.oldStateName }]
+            if self.overwritten is not None:
+                operations.append(putStateOperation(self.newStateName, self.overwritten))
+            return operations
+
+        operations = []
+        if self.overwritten is not None:
+            operations.append({ 'op': 'removeState', 'name': self.newStateName })
+        operations.append({ 'op': 'renameState', 'old': self.oldStateName, 'new': self.newStateName })
+        return operations
+
+# Replaces whole states at once, e.g. after transforming all of their frames
+class ReplaceStatesCommand(QtW.QUndoCommand):
+    def __init__(self, editor : EditorWindow, text : str, newStates : Dict[str, RSIPy.State]):
+        QtW.QUndoCommand.__init__(self)
+
+        assert editor.currentRsi is not None
+
+        self.editor = editor
+        self.newStates = newStates
+        self.oldStates = { name: editor.currentRsi.states[name] for name in newStates.keys() }
+
+        self.setText(text)
+
+    def id(self) -> int:
+        return -1
+
+    def redo(self) -> None:
+        self.putStates(self.newStates)
+
+    def undo(self) -> None:
+        self.putStates(self.oldStates)
+
+    def putStates(self, states : Dict[str, RSIPy.State]) -> None:
+        assert self.editor.currentRsi is not None
+
+        with self.editor.currentRsi.batchUpdate():
+            for name, state in states.items():
+                self.editor.currentRsi.addState(name, state)
+
+        self.editor.refreshCurrentState(list(states.keys()))
+
+    def journal(self, undone : bool) -> List[Operation]:
+        states = self.oldStates if undone else self.newStates
+        return [putStateOperation(name, state) for name, state in states.items()]
+
+# Puts in the versions of states on disk (or removes states removed from disk),
+# and the license and copyright on disk if `header` is given
+class ReloadStatesCommand(QtW.QUndoCommand):
+    def __init__(self, editor : EditorWindow, diskStates : Dict[str, Optional[RSIPy.State]], header : Optional[Tuple[Optional[str], Optional[str]]]):
+        QtW.QUndoCommand.__init__(self)
+
+        assert editor.currentRsi is not None
+
+        self.editor = editor
+        self.diskStates = diskStates
+        self.oldStates = { name: editor.currentRsi.states.get(name) for name in diskStates.keys() }
+        self.diskHeader = header
+        self.oldHeader = (editor.currentRsi.license, editor.currentRsi.copyright)
+
+        self.setText('Reload from disk')
+
+    def id(self) -> int:
+        return -1
+
+    def redo(self) -> None:
+        rsi = self.editor.currentRsi
+        assert rsi is not None
+
+        with rsi.batchUpdate():
+            for name, state in self.diskStates.items():
+                if state is None:
+                    rsi.removeState(name)
+                    rsi.modifiedStates.discard(name)
+                else:
+                    rsi.reloadState(name, state)
+
+        if self.diskHeader is not None:
+            rsi.setLicense(self.diskHeader[0])
+            rsi.setCopyright(self.diskHeader[1])
+            rsi.metadataModified = False
+
+        self.editor.refreshCurrentState(list(self.diskStates.keys()))
+
+    # What was there before no longer matches the disk, so it's an unsaved change
+    def undo(self) -> None:
+        rsi = self.editor.currentRsi
+        assert rsi is not None
+
+        with rsi.batchUpdate():
+            for name, state in self.oldStates.items():
+                if state is None:
+                    rsi.removeState(name)
+                else:
+                    rsi.addState(name, state)
+
+        if self.diskHeader is not None:
+            rsi.setLicense(self.oldHeader[0])
+            rsi.setCopyright(self.oldHeader[1])
+
+        self.editor.refreshCurrentState(list(self.oldStates.keys()))
+
+    def journal(self, undone : bool) -> List[Operation]:
+        states = self.oldStates if undone else self.diskStates
+        operations : List[Operation] = [putStateOperation(name, state) if state is not None else { 'op': 'removeState', 'name': name }
+                for name, state in states.items()]
+
+        if self.diskHeader is not None:
+            (license, copyright) = self.oldHeader if undone else self.diskHeader
+            operations += [{ 'op': 'license', 'value': license }, { 'op': 'copyright', 'value': copyright }]
+
+        return operations
+
+# Changes the size of the RSI, along with every state in it
+class ResizeRsiCommand(QtW.QUndoCommand):
+    def __init__(self, editor : EditorWindow, newSize : Tuple[int, int], newStates : Dict[str, RSIPy.State]):
+        QtW.QUndoCommand.__init__(self)
+
+        assert editor.currentRsi is not None
+
+        self.editor = editor
+        self.oldSize = editor.currentRsi.size
+        self.newSize = newSize
+        self.oldStates = dict(editor.currentRsi.states)
+        self.newStates = newStates
+
+        self.setText('Resize RSI')
+
+    def id(self) -> int:
+        return -1
+
+    def redo(self) -> None:
+        self.putStates(self.newSize, self.newStates)
+
+    def undo(self) -> None:
+        self.putStates(self.oldSize, self.oldStates)
+
+    def putStates(self, size : Tuple[int, int], states : Dict[str, RSIPy.State]) -> None:
+        assert self.editor.currentRsi is not None
+
+        with self.editor.currentRsi.batchUpdate():
+            self.editor.currentRsi.setSize(size)
+            for name, state in states.items():
+                self.editor.currentRsi.addState(name, state)
+
+        self.editor.refreshCurrentState(list(states.keys()))
+
+    def journal(self, undone : bool) -> List[Operation]:
+        (size, states) = (self.oldSize, self.oldStates) if undone else (self.newSize, self.newStates)
+        return [{ 'op': 'size', 'value': list(size) }] + [putStateOperation(name, state) for name, state in states.items()]
+
 class SetDirectionsCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, numDirections : int):
         QtW.QUndoCommand.__init__(self)
@@ -601,6 +1703,10 @@ class SetDirectionsCommand(QtW.QUndoCommand):
         self.editor = editor
         self.numDirections = numDirections
 
+        # How new directions are generated - fixed when the command is made, so
+        # that redoing it always gives the same result
+        self.rules = dict(editor.config.directionRules) if editor.config.synthesiseDirections else None
+
         self.oldDirections = 0
         self.oldIcons : List[List[PIL.Image.Image]] = []
         self.oldDelays : List[List[float]] = []
@@ -614,25 +1720,40 @@ class SetDirectionsCommand(QtW.QUndoCommand):
         assert self.editor.currentState is not None
         
         self.oldDirections = self.editor.currentState.directions()
-        self.oldIcons, self.oldDelays = self.editor.currentState.setDirections(self.numDirections)
+        self.oldIcons, self.oldDelays = self.editor.currentState.setDirections(self.numDirections, self.rules)
 
     def undo(self) -> None:
         assert self.editor.currentState is not None
         
-        self.editor.currentState.setDirections(self.oldDirections)
+        with self.editor.currentState.batchUpdate():
+            self.editor.currentState.setDirections(self.oldDirections)
+
+            for i in range(self.numDirections, self.oldDirections):
+                for j in range(len(self.oldIcons[i - self.numDirections])):
+                    self.editor.currentState.setFrame(self.editor.currentState.index(i, j), self.oldIcons[i - self.numDirections][j])
+                    self.editor.currentState.setDelay(self.editor.currentState.index(i, j), self.oldDelays[i - self.numDirections][j])
 
-        for i in range(self.numDirections, self.oldDirections):
-            for j in range(len(self.oldIcons[i - self.numDirections])):
-                self.editor.currentState.setFrame(self.editor.currentState.index(i, j), self.oldIcons[i - self.numDirections][j])
-                self.editor.currentState.setDelay(self.editor.currentState.index(i, j), self.oldDelays[i - self.numDirections][j])
+    def journal(self, undone : bool) -> List[Operation]:
+        assert self.editor.currentState is not None
 
+        if undone:
+            return [{
+                'op': 'setDirections',
+                'state': self.editor.currentState.name(),
+                'directions': self.oldDirections,
+                'firstRestored': self.numDirections,
+                'icons': self.oldIcons,
+                'delays': self.oldDelays,
+            }]
+        return [{ 'op': 'setDirections', 'state': self.editor.currentState.name(), 'directions': self.numDirections, 'rules': self.rules }]
 
 class NewFrameCommand(QtW.QUndoCommand):
-    def __init__(self, editor : EditorWindow, frameIndex : QtC.QModelIndex):
+    def __init__(self, editor : EditorWindow, frameIndex : QtC.QModelIndex, image : Optional[PIL.Image.Image] = None):
         QtW.QUndoCommand.__init__(self)
 
         self.editor = editor
         self.frameIndex = frameIndex
+        self.image = image
         
         self.setText('Add frame')
 
@@ -642,13 +1763,18 @@ class NewFrameCommand(QtW.QUndoCommand):
     def redo(self) -> None:
         assert self.editor.currentState is not None
 
-        self.editor.currentState.addFrame(self.frameIndex)
+        self.editor.currentState.addFrame(self.frameIndex, self.image)
 
     def undo(self) -> None:
         assert self.editor.currentState is not None
 
         self.editor.currentState.deleteFrame(self.frameIndex)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        if undone:
+            return [frameOperation(self.editor, 'deleteFrame', self.frameIndex)]
+        return [frameOperation(self.editor, 'addFrame', self.frameIndex, image=self.image, delay=0.0)]
+
 class DeleteFrameCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, frameIndex : QtC.QModelIndex):
         QtW.QUndoCommand.__init__(self)
@@ -675,6 +1801,13 @@ class DeleteFrameCommand(QtW.QUndoCommand):
 
         self.editor.currentState.addFrame(self.frameIndex, self.deleted[0], self.deleted[1])
 
+    def journal(self, undone : bool) -> List[Operation]:
+        assert self.deleted is not None
+
+        if undone:
+            return [frameOperation(self.editor, 'addFrame', self.frameIndex, image=self.deleted[0], delay=self.deleted[1])]
+        return [frameOperation(self.editor, 'deleteFrame', self.frameIndex)]
+
 class EditDelayCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, frameIndex : QtC.QModelIndex, delay : float):
         QtW.QUndoCommand.__init__(self)
@@ -703,6 +1836,43 @@ class EditDelayCommand(QtW.QUndoCommand):
         
         self.editor.currentState.setDelay(self.frameIndex, self.oldDelay)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        return [frameOperation(self.editor, 'setDelay', self.frameIndex, delay=self.oldDelay if undone else self.newDelay)]
+
+# Changes many delays of the current state at once
+class EditDelaysCommand(QtW.QUndoCommand):
+    def __init__(self, editor : EditorWindow, text : str, delays : Delays):
+        QtW.QUndoCommand.__init__(self)
+
+        self.editor = editor
+        self.newDelays = delays
+        self.oldDelays : Delays = {}
+
+        self.setText(text)
+
+    def id(self) -> int:
+        return -1
+
+    def redo(self) -> None:
+        assert self.editor.currentState is not None
+
+        self.oldDelays = self.editor.currentState.setDelays(self.newDelays)
+
+    def undo(self) -> None:
+        assert self.editor.currentState is not None
+
+        self.editor.currentState.setDelays(self.oldDelays)
+
+    def journal(self, undone : bool) -> List[Operation]:
+        assert self.editor.currentState is not None
+
+        delays = self.oldDelays if undone else self.newDelays
+        return [{
+            'op': 'setDelays',
+            'state': self.editor.currentState.name(),
+            'delays': [[direction, frame, delay] for ((direction, frame), delay) in delays.items()],
+        }]
+
 class EditFrameCommand(QtW.QUndoCommand):
     def __init__(self, editor : EditorWindow, frameIndex : QtC.QModelIndex, unedited : PIL.Image.Image, edited : PIL.Image.Image):
         QtW.QUndoCommand.__init__(self)
@@ -727,6 +1897,9 @@ class EditFrameCommand(QtW.QUndoCommand):
 
         self.editor.currentState.setFrame(self.frameIndex, self.unedited)
 
+    def journal(self, undone : bool) -> List[Operation]:
+        return [frameOperation(self.editor, 'setFrame', self.frameIndex, image=self.unedited if undone else self.edited)]
+
 def editor() -> None:
     app = QtW.QApplication([])
 